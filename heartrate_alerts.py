@@ -0,0 +1,186 @@
+import itertools
+import queue
+import threading
+import time
+from collections import namedtuple
+from heartrate_detection import LEVELS
+
+"""
+Non-blocking alert dispatch.
+
+Detectors hand their alert events to an AlertDispatcher with submit(), which
+never blocks: it drops duplicates of an alert that is still unacknowledged,
+rate-limits each ride and occupant to one alert per `cooldown` seconds (an
+escalation from 'anxious' to 'control' always goes through) and puts the
+rest on a bounded queue. When the queue is full the new alert is dropped and
+counted. The consumer takes alerts off the queue without blocking (poll(),
+e.g. from the Tk main loop) or on a background thread (start(handler)), and
+acknowledge() records the response and how long it took.
+
+show_alert_window() is the non-modal replacement for the old askyesno and
+showinfo message boxes: the question stays open in its own window while the
+data keeps flowing.
+"""
+
+max_pending = 64  # Alerts waiting for delivery before new ones are dropped
+alert_cooldown = 60  # Seconds between alerts for the same ride and occupant
+
+Alert = namedtuple('Alert', ['alert_id', 'ride_id', 'occupant', 'level', 'time', 'heart_rate', 'created'])
+
+COUNTERS = ('submitted', 'queued', 'deduplicated', 'rate_limited', 'dropped', 'delivered', 'acknowledged')
+
+class AlertDispatcher:
+    def __init__(self, max_pending=max_pending, cooldown=alert_cooldown, clock=time.monotonic):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.cooldown = cooldown
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.outstanding = {}  # alert_id -> alert that has not been acknowledged
+        self.active = {}  # (ride_id, occupant, level) -> alert_id of its unacknowledged alert
+        self.last_sent = {}  # (ride_id, occupant) -> (clock time, level) of the last alert
+        self.acknowledgements = []  # (alert, response, seconds until acknowledged)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self._ids = itertools.count(1)
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    # Queue an alert for a detector AlertEvent (only 'start' events raise alerts).
+    # Returns the queued Alert, or None if it was deduplicated, rate-limited or dropped.
+    def submit(self, event, ride_id=0):
+        if event.kind != 'start':
+            return None
+        key = (ride_id, event.occupant, event.level)
+        with self.lock:
+            self.counters['submitted'] += 1
+            if key in self.active:
+                self.counters['deduplicated'] += 1
+                return None
+            now = self.clock()
+            last = self.last_sent.get((ride_id, event.occupant))
+            if last is not None and now - last[0] < self.cooldown and LEVELS.index(event.level) <= LEVELS.index(last[1]):
+                self.counters['rate_limited'] += 1
+                return None
+            alert = Alert(next(self._ids), ride_id, event.occupant, event.level, event.time, event.heart_rate, now)
+            try:
+                self.queue.put_nowait(alert)
+            except queue.Full:
+                self.counters['dropped'] += 1
+                return None
+            self.active[key] = alert.alert_id
+            self.outstanding[alert.alert_id] = alert
+            self.last_sent[(ride_id, event.occupant)] = (now, event.level)
+            self.counters['queued'] += 1
+        return alert
+
+    # Submit every event of a detector update; returns the alerts that were queued
+    def submit_many(self, events, ride_id=0):
+        alerts = (self.submit(event, ride_id) for event in events)
+        return [alert for alert in alerts if alert is not None]
+
+    # Alerts waiting for delivery, without blocking
+    def poll(self, max_alerts=None):
+        alerts = []
+        while max_alerts is None or len(alerts) < max_alerts:
+            try:
+                alerts.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        with self.lock:
+            self.counters['delivered'] += len(alerts)
+        return alerts
+
+    # Record the response to an alert (an Alert or its id). Returns False if it
+    # was already acknowledged.
+    def acknowledge(self, alert, response='ok'):
+        alert_id = alert.alert_id if isinstance(alert, Alert) else alert
+        with self.lock:
+            alert = self.outstanding.pop(alert_id, None)
+            if alert is None:
+                return False
+            self.active.pop((alert.ride_id, alert.occupant, alert.level), None)
+            self.acknowledgements.append((alert, response, self.clock() - alert.created))
+            self.counters['acknowledged'] += 1
+        return True
+
+    # Acknowledge every outstanding alert of a ride and/or occupant (None matches all)
+    def acknowledge_all(self, ride_id=None, occupant=None, response='ok'):
+        alerts = self.pending(ride_id, occupant)
+        for alert in alerts:
+            self.acknowledge(alert, response)
+        return alerts
+
+    # Unacknowledged alerts, oldest first
+    def pending(self, ride_id=None, occupant=None):
+        with self.lock:
+            return [alert for alert in self.outstanding.values()
+                    if (ride_id is None or alert.ride_id == ride_id)
+                    and (occupant is None or alert.occupant == occupant)]
+
+    # Deliver alerts to handler(alert) on a background thread
+    def start(self, handler):
+        self._stop_event.clear()
+
+        def run():
+            while not self._stop_event.is_set():
+                try:
+                    alert = self.queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                with self.lock:
+                    self.counters['delivered'] += 1
+                handler(alert)
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def summary(self):
+        with self.lock:
+            counters = ", ".join(f"{count} {name.replace('_', ' ')}" for name, count in self.counters.items())
+            return f"{len(self.outstanding)} unacknowledged alerts ({counters})"
+
+# Describe an alert in one line
+def describe_alert(alert):
+    ride = f"Ride {alert.ride_id} " if alert.ride_id else ""
+    return f"{ride}{alert.occupant.title()}: {alert.level} heart rate ({alert.heart_rate:.0f} BPM at {alert.time:.0f} s)"
+
+# Ask the occupant whether they are okay in a non-modal window; the answer
+# acknowledges the alert ('ok' or 'emergency'), as does closing the window
+# ('dismissed'), so a closed window does not hold back later alerts
+def show_alert_window(root, dispatcher, alert):
+    import tkinter as tk
+
+    window = tk.Toplevel(root)
+    window.title("Anxious Heart Rate")
+    label = tk.Label(window, text=f"{describe_alert(alert)}\n{alert.occupant.title()}: Are you feeling okay?",
+                     font=("Helvetica", 12), padx=20, pady=10)
+    label.pack()
+    buttons = tk.Frame(window)
+    buttons.pack(pady=10)
+
+    def answer(okay):
+        dispatcher.acknowledge(alert, 'ok' if okay else 'emergency')
+        if okay:
+            window.destroy()
+            return
+        buttons.destroy()
+        label.config(text=f"Emergency response has been notified for the {alert.occupant}.", fg="red")
+        window.after(5000, window.destroy)
+
+    def close():
+        dispatcher.acknowledge(alert, 'dismissed')
+        window.destroy()
+
+    window.protocol("WM_DELETE_WINDOW", close)
+    tk.Button(buttons, text="Yes", width=8, command=lambda: answer(True)).pack(side=tk.LEFT, padx=5)
+    tk.Button(buttons, text="No", width=8, command=lambda: answer(False)).pack(side=tk.LEFT, padx=5)
+    return window
+
+# Open a window for every alert waiting in the dispatcher
+def show_pending_alerts(root, dispatcher):
+    return [show_alert_window(root, dispatcher, alert) for alert in dispatcher.poll()]
@@ -0,0 +1,135 @@
+from collections import deque
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+"""
+Rolling statistics for heart rate series, computed incrementally for live
+monitoring and in batch for stored recordings.
+
+RollingStats updates the rolling mean, rolling standard deviation, EWMA and
+rolling min/max in O(1) (amortised for min/max) per new sample. rolling_stats()
+computes the same statistics for a whole array and gives bit-identical
+results: both sides use running sums accumulated in the same order (np.cumsum
+adds sequentially), the same Python float arithmetic for the EWMA and exact
+comparisons for min/max.
+
+Until a full window of samples has arrived, the windowed statistics are NaN,
+which matches the 'valid' part of np.convolve used before.
+"""
+
+window_size = 10  # Default moving-average window in samples
+ewma_alpha = 0.1  # Default EWMA smoothing factor
+
+STATISTICS = ('mean', 'std', 'ewma', 'min', 'max')
+
+# Rolling variance from windowed sums; tiny negative values from rounding are clipped
+def _std_from_sums(window_sum, window_sum_squares, window):
+    mean = window_sum / window
+    return np.sqrt(np.maximum(window_sum_squares / window - mean * mean, 0.0))
+
+class RollingStats:
+    def __init__(self, window=window_size, alpha=ewma_alpha):
+        if window <= 0:
+            raise ValueError("Window size must be positive.")
+        self.window = window
+        self.alpha = alpha
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.ewma = None
+        self._sum = 0.0
+        self._sum_squares = 0.0
+        # Running sums at the start of the current window, followed by the newer ones
+        self._sums = deque([(0.0, 0.0)], maxlen=self.window + 1)
+        self._min = deque()  # (index, value) pairs with increasing values
+        self._max = deque()  # (index, value) pairs with decreasing values
+
+    # Add one sample and return the statistics as a dict
+    def update(self, value):
+        value = float(value)
+        index = self.count
+        self.count += 1
+
+        self._sum += value
+        self._sum_squares += value * value
+        self._sums.append((self._sum, self._sum_squares))
+
+        self.ewma = value if self.ewma is None else self.alpha * value + (1 - self.alpha) * self.ewma
+
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((index, value))
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((index, value))
+        oldest = index - self.window
+        while self._min[0][0] <= oldest:
+            self._min.popleft()
+        while self._max[0][0] <= oldest:
+            self._max.popleft()
+
+        return self.stats()
+
+    # Add a chunk of samples
+    def update_many(self, values):
+        for value in values:
+            self.update(value)
+        return self.stats()
+
+    # Current statistics; the windowed ones are NaN until the window is full
+    def stats(self):
+        if self.count < self.window:
+            nan = float('nan')
+            return {'mean': nan, 'std': nan, 'ewma': self.ewma if self.ewma is not None else nan,
+                    'min': nan, 'max': nan}
+        first_sum, first_sum_squares = self._sums[0]
+        window_sum = self._sum - first_sum
+        window_sum_squares = self._sum_squares - first_sum_squares
+        return {
+            'mean': window_sum / self.window,
+            'std': float(_std_from_sums(window_sum, window_sum_squares, self.window)),
+            'ewma': self.ewma,
+            'min': self._min[0][1],
+            'max': self._max[0][1],
+        }
+
+# EWMA of a whole array with the same float arithmetic as RollingStats
+def ewma(values, alpha=ewma_alpha):
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        return values.copy()
+    step = np.frompyfunc(lambda previous, value: alpha * value + (1 - alpha) * previous, 2, 1)
+    return step.accumulate(values.astype(object)).astype(float)
+
+# Rolling mean of a whole array (NaN until the window is full)
+def rolling_mean(values, window=window_size):
+    values = np.asarray(values, dtype=float)
+    sums = np.concatenate([[0.0], np.cumsum(values)])
+    result = np.full(len(values), np.nan)
+    result[window - 1:] = (sums[window:] - sums[:-window]) / window
+    return result
+
+# Batch version of RollingStats: every statistic for a whole array, as a dict of
+# arrays the same length as values
+def rolling_stats(values, window=window_size, alpha=ewma_alpha):
+    if window <= 0:
+        raise ValueError("Window size must be positive.")
+    values = np.asarray(values, dtype=float)
+    length = len(values)
+    result = {name: np.full(length, np.nan) for name in STATISTICS}
+    result['ewma'] = ewma(values, alpha)
+    if length < window:
+        return result
+
+    sums = np.concatenate([[0.0], np.cumsum(values)])
+    sums_squares = np.concatenate([[0.0], np.cumsum(values * values)])
+    window_sums = sums[window:] - sums[:-window]
+    window_sums_squares = sums_squares[window:] - sums_squares[:-window]
+    result['mean'][window - 1:] = window_sums / window
+    result['std'][window - 1:] = _std_from_sums(window_sums, window_sums_squares, window)
+
+    windows = sliding_window_view(values, window)
+    result['min'][window - 1:] = windows.min(axis=1)
+    result['max'][window - 1:] = windows.max(axis=1)
+    return result
@@ -0,0 +1,260 @@
+import warnings
+import numpy as np
+
+"""
+Vectorised anomaly detection over many rides at once.
+
+All detectors take a (rides x samples) matrix, so scoring a whole fleet costs
+a few NumPy operations per detector instead of a Python loop per ride. Rides
+of different lengths are padded with NaN (see ride_matrix); NaN samples never
+raise a flag.
+
+- Rolling z-score: each sample against the mean and standard deviation of the
+  valid samples among the `window` before it (from windowed cumulative sums
+  of the values, their squares and a count of valid samples).
+- CUSUM: two-sided tabular CUSUM on values standardised with a per-ride
+  baseline (the first `baseline` samples). It flags a sustained shift in
+  level rather than single spikes. It is sequential in time but vectorised
+  across rides.
+- Rate of change: BPM per second over `lag` samples, which flags sudden jumps.
+
+StreamingAnomalyDetector applies the same detectors to live data, one column
+(one sample per ride) at a time, in O(rides) vectorised work per tick.
+"""
+
+zscore_window = 30  # Samples in the rolling z-score window
+zscore_limit = 3.0  # |z| above which a sample is flagged
+cusum_baseline = 60  # Samples used to estimate each ride's baseline level
+cusum_slack = 0.5  # CUSUM allowance k, in baseline standard deviations
+cusum_limit = 8.0  # CUSUM decision threshold h, in baseline standard deviations
+rate_limit = 30.0  # BPM per second above which a change is flagged
+rate_lag = 1  # Samples between the two values of a rate of change
+
+# Stack one column of every ride in a recording into a NaN-padded (rides x samples) matrix.
+# Returns the ride ids and the matrix; a single-ride recording gives one row.
+def ride_matrix(recording, column):
+    rides = list(recording.rides())
+    if not rides:
+        return np.array([0]), np.asarray(recording[column], dtype=float)[None, :]
+    length = max(ride['length'] for ride, _ in rides)
+    matrix = np.full((len(rides), length), np.nan)
+    for row, (ride, ride_recording) in enumerate(rides):
+        matrix[row, :ride['length']] = ride_recording[column]
+    return np.array([ride['ride_id'] for ride, _ in rides]), matrix
+
+# Mean and standard deviation of windows from their sums, sums of squares and
+# numbers of valid samples; NaN where fewer than two samples were valid
+def window_stats(sums, sums_squares, counts):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(counts >= 2, sums / counts, np.nan)
+        std = np.sqrt(np.maximum(sums_squares / counts - mean * mean, 0.0))
+    return mean, std
+
+# z-scores of values against window means and standard deviations (0 for a flat window)
+def window_zscores(values, mean, std):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(std > 0, (values - mean) / std, np.where(np.isnan(std), np.nan, 0.0))
+
+# Rolling z-score of every sample against the previous `window` samples of its
+# row. NaN samples are left out of the window statistics (only the valid
+# samples are counted), so a gap does not switch the z-score off for the rest
+# of the ride.
+def rolling_zscore(matrix, window=zscore_window):
+    matrix = np.asarray(matrix, dtype=float)
+    rides, length = matrix.shape
+    zscores = np.full((rides, length), np.nan)
+    if length <= window:
+        return zscores
+    valid = ~np.isnan(matrix)
+    filled = np.where(valid, matrix, 0.0)
+    padded = np.zeros((3, rides, length + 1))
+    np.cumsum(filled, axis=1, out=padded[0, :, 1:])
+    np.cumsum(filled * filled, axis=1, out=padded[1, :, 1:])
+    np.cumsum(valid, axis=1, out=padded[2, :, 1:])
+
+    # Sums over samples t - window .. t - 1 for every t >= window
+    sums, sums_squares, counts = padded[:, :, window:length] - padded[:, :, :length - window]
+    mean, std = window_stats(sums, sums_squares, counts)
+    zscores[:, window:] = window_zscores(matrix[:, window:], mean, std)
+    return zscores
+
+# Per-row baseline mean and standard deviation from the first `baseline` samples
+def baseline_stats(matrix, baseline=cusum_baseline):
+    head = np.asarray(matrix, dtype=float)[:, :baseline]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # Rows that are all NaN
+        mean = np.nanmean(head, axis=1)
+        std = np.nanstd(head, axis=1)
+    std = np.where(std > 0, std, 1.0)
+    return mean, std
+
+# Two-sided CUSUM; returns the (upper, lower) statistics, each (rides x samples).
+# Like the streaming detector, it starts once the baseline is complete.
+def cusum(matrix, baseline=cusum_baseline, slack=cusum_slack):
+    matrix = np.asarray(matrix, dtype=float)
+    mean, std = baseline_stats(matrix, baseline)
+    standardised = (matrix - mean[:, None]) / std[:, None]
+    upper = np.zeros(matrix.shape)
+    lower = np.zeros(matrix.shape)
+    high = np.zeros(len(matrix))
+    low = np.zeros(len(matrix))
+    for t in range(max(0, baseline - 1), matrix.shape[1]):
+        column = np.nan_to_num(standardised[:, t], nan=slack)  # NaN (padding) leaves the sums unchanged
+        high = np.maximum(0.0, high + column - slack)
+        low = np.maximum(0.0, low - column - slack)
+        upper[:, t] = high
+        lower[:, t] = low
+    return upper, lower
+
+# Rate of change in BPM per second over `lag` samples (NaN for the first `lag` samples)
+def rate_of_change(matrix, sample_rate=1.0, lag=rate_lag):
+    matrix = np.asarray(matrix, dtype=float)
+    rates = np.full(matrix.shape, np.nan)
+    rates[:, lag:] = (matrix[:, lag:] - matrix[:, :-lag]) * sample_rate / lag
+    return rates
+
+# Run all detectors over a (rides x samples) matrix. Returns a dict with the
+# raw scores and a boolean flag matrix per detector.
+def detect_anomalies(matrix, sample_rate=1.0, window=zscore_window, z_limit=zscore_limit,
+                     baseline=cusum_baseline, slack=cusum_slack, limit=cusum_limit,
+                     max_rate=rate_limit, lag=rate_lag):
+    matrix = np.asarray(matrix, dtype=float)
+    zscores = rolling_zscore(matrix, window)
+    upper, lower = cusum(matrix, baseline, slack)
+    rates = rate_of_change(matrix, sample_rate, lag)
+    valid = ~np.isnan(matrix)
+    with np.errstate(invalid='ignore'):
+        return {
+            'zscore': zscores,
+            'cusum_upper': upper,
+            'cusum_lower': lower,
+            'rate': rates,
+            'zscore_flags': valid & (np.abs(zscores) > z_limit),
+            'cusum_flags': valid & ((upper > limit) | (lower > limit)),
+            'rate_flags': valid & (np.abs(rates) > max_rate),
+        }
+
+# One summary row per ride: number of flagged samples per detector, largest
+# |z|, largest CUSUM value and first CUSUM change point (-1 if none)
+def summarize_anomalies(anomalies):
+    cusum_flags = anomalies['cusum_flags']
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # Rides too short for a z-score
+        max_zscore = np.nanmax(np.abs(anomalies['zscore']), axis=1)
+    return {
+        'zscore_count': anomalies['zscore_flags'].sum(axis=1),
+        'cusum_count': cusum_flags.sum(axis=1),
+        'rate_count': anomalies['rate_flags'].sum(axis=1),
+        'max_zscore': max_zscore,
+        'max_cusum': np.maximum(anomalies['cusum_upper'], anomalies['cusum_lower']).max(axis=1, initial=0.0),
+        'change_point': np.where(cusum_flags.any(axis=1), cusum_flags.argmax(axis=1), -1),
+    }
+
+# Score every ride and occupant of a recording (a fleet shard or a single ride)
+def score_fleet(recording, **kwargs):
+    scores = {}
+    for occupant in ('driver', 'passenger'):
+        ride_ids, matrix = ride_matrix(recording, occupant)
+        scores[occupant] = summarize_anomalies(detect_anomalies(matrix, recording.sample_rate, **kwargs))
+    return ride_ids, scores
+
+class StreamingAnomalyDetector:
+    # Live version of detect_anomalies for a fixed set of num_rides rides; update()
+    # takes one new sample per ride (NaN for rides without a new sample)
+    def __init__(self, num_rides, sample_rate=1.0, window=zscore_window, z_limit=zscore_limit,
+                 baseline=cusum_baseline, slack=cusum_slack, limit=cusum_limit,
+                 max_rate=rate_limit, lag=rate_lag):
+        self.num_rides = num_rides
+        self.sample_rate = sample_rate
+        self.window = window
+        self.z_limit = z_limit
+        self.baseline = baseline
+        self.slack = slack
+        self.limit = limit
+        self.max_rate = max_rate
+        self.lag = lag
+
+        self.count = 0
+        self._recent = np.zeros((num_rides, window))  # Last `window` samples per ride
+        self._sum = np.zeros(num_rides)
+        self._sum_squares = np.zeros(num_rides)
+        self._recent_valid = np.zeros((num_rides, window))  # 1 where the sample in _recent was not NaN
+        self._valid_count = np.zeros(num_rides)
+        self._previous = np.full((num_rides, lag), np.nan)  # Last `lag` samples per ride
+
+        self._baseline_sum = np.zeros(num_rides)
+        self._baseline_sum_squares = np.zeros(num_rides)
+        self._baseline_count = np.zeros(num_rides)
+        self.baseline_mean = None
+        self.baseline_std = None
+        self.upper = np.zeros(num_rides)
+        self.lower = np.zeros(num_rides)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        valid = ~np.isnan(values)
+        filled = np.where(valid, values, 0.0)
+        result = {}
+
+        # Rolling z-score against the valid samples among the previous `window`
+        if self.count >= self.window:
+            mean, std = window_stats(self._sum, self._sum_squares, self._valid_count)
+            zscores = window_zscores(values, mean, std)
+        else:
+            zscores = np.full(self.num_rides, np.nan)
+        slot = self.count % self.window
+        oldest = self._recent[:, slot]
+        self._sum += filled - oldest
+        self._sum_squares += filled * filled - oldest * oldest
+        self._valid_count += valid.astype(float) - self._recent_valid[:, slot]
+        self._recent[:, slot] = filled
+        self._recent_valid[:, slot] = valid
+
+        # CUSUM once the baseline is known
+        if self.count < self.baseline:
+            self._baseline_sum += filled
+            self._baseline_sum_squares += filled * filled
+            self._baseline_count += valid
+        if self.baseline_mean is None and self.count + 1 >= self.baseline:
+            count = np.maximum(self._baseline_count, 1)
+            self.baseline_mean = self._baseline_sum / count
+            std = np.sqrt(np.maximum(self._baseline_sum_squares / count - self.baseline_mean ** 2, 0.0))
+            self.baseline_std = np.where(std > 0, std, 1.0)
+        if self.baseline_mean is not None:
+            standardised = np.where(valid, (filled - self.baseline_mean) / self.baseline_std, self.slack)
+            self.upper = np.maximum(0.0, self.upper + standardised - self.slack)
+            self.lower = np.maximum(0.0, self.lower - standardised - self.slack)
+
+        # Rate of change over `lag` samples
+        previous = self._previous[:, self.count % self.lag]
+        rates = (values - previous) * self.sample_rate / self.lag
+        self._previous[:, self.count % self.lag] = values
+
+        self.count += 1
+        with np.errstate(invalid='ignore'):
+            result['zscore'] = zscores
+            result['rate'] = rates
+            result['zscore_flags'] = valid & (np.abs(zscores) > self.z_limit)
+            result['cusum_flags'] = valid & ((self.upper > self.limit) | (self.lower > self.limit))
+            result['rate_flags'] = valid & (np.abs(rates) > self.max_rate)
+        return result
+
+def main():
+    import argparse
+    from heartrate_storage import load_heart_rate_data
+
+    parser = argparse.ArgumentParser(description="Score every ride in heart rate files for anomalies.")
+    parser.add_argument('files', nargs='+', help="heart rate files (.hrb fleet shards, single rides or CSV)")
+    args = parser.parse_args()
+
+    print("file,ride_id,occupant,zscore_count,cusum_count,rate_count,max_zscore,max_cusum,change_point")
+    for path in args.files:
+        ride_ids, scores = score_fleet(load_heart_rate_data(path))
+        for occupant, summary in scores.items():
+            for row, ride_id in enumerate(ride_ids.tolist()):
+                print(f"{path},{ride_id},{occupant},{summary['zscore_count'][row]},{summary['cusum_count'][row]},"
+                      f"{summary['rate_count'][row]},{summary['max_zscore'][row]:.2f},"
+                      f"{summary['max_cusum'][row]:.2f},{summary['change_point'][row]}")
+
+if __name__ == "__main__":
+    main()
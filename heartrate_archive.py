@@ -0,0 +1,279 @@
+import argparse
+import json
+import os
+import struct
+import zlib
+import numpy as np
+from heartrate_storage import FORMAT_VERSION, HeartRateRecording, load_heart_rate_data
+
+"""
+Compressed, chunked archive of heart rate recordings (.hra files) for
+long-term retention.
+
+Every ride is cut into chunks of chunk_size samples. In a chunk each column is
+quantised to an integer number of quanta (0.01 BPM for heart rates, 1 ms for
+times) and delta-encoded: the first value goes to the index and only the
+differences between neighbours are stored, which are small for heart rates
+and constant for times. The deltas use the narrowest integer type that holds
+them and the chunk is compressed with zlib.
+Quantising is the only loss: values come back within half a quantum. NaN
+samples are kept with a bit mask.
+
+Layout: the 4-byte magic b'HRA1', the compressed chunks one after another,
+then a JSON index and a trailer of the index offset (little-endian uint64)
+and the magic again. The index holds the header of the original recording
+(sample rate, start time, columns, ages, rides) and, for every chunk, its
+ride, first row, length, first and last time, file offset and size. Reading
+a time range or some rides only decompresses the chunks that overlap them;
+iter_archive_chunks() streams them one at a time.
+
+load_heart_rate_data() in heartrate_storage reads archives as well, so all
+scripts accept .hra files.
+"""
+
+ARCHIVE_MAGIC = b'HRA1'
+TRAILER = struct.Struct('<Q4s')
+DEFAULT_ARCHIVE_FILE = 'heart_rate_data.hra'
+chunk_size = 3600  # Samples per chunk (an hour at 1 Hz)
+compression_level = 6
+
+# Quantum per column (values are stored as multiples of it); other columns use default_quantum
+COLUMN_QUANTA = {'passenger': 0.01, 'driver': 0.01, 'time': 0.001, 'ride_id': 1.0}
+default_quantum = 0.001
+
+DELTA_DTYPES = (np.dtype('<i1'), np.dtype('<i2'), np.dtype('<i4'), np.dtype('<i8'))
+
+# Check whether a file starts with the archive magic bytes
+def is_archive_file(path):
+    with open(path, 'rb') as file:
+        return file.read(len(ARCHIVE_MAGIC)) == ARCHIVE_MAGIC
+
+# Narrowest integer type holding every value of an int64 array
+def _delta_dtype(deltas):
+    if len(deltas) == 0:
+        return DELTA_DTYPES[0]
+    low, high = int(deltas.min()), int(deltas.max())
+    for dtype in DELTA_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return dtype
+    return DELTA_DTYPES[-1]
+
+# Quantise and delta-encode one column of a chunk. Returns the bytes and the
+# column's entry for the chunk index.
+def _encode_column(values, quantum):
+    values = np.asarray(values, dtype=float)
+    missing = np.isnan(values)
+    quantised = np.rint(np.where(missing, 0.0, values) / quantum).astype(np.int64)
+    first = int(quantised[0]) if len(quantised) else 0
+    deltas = np.diff(quantised, prepend=np.int64(first))
+    dtype = _delta_dtype(deltas)
+    encoded = deltas.astype(dtype).tobytes()
+    entry = {'dtype': dtype.str, 'quantum': quantum, 'first': first, 'nan': bool(missing.any())}
+    if entry['nan']:
+        encoded += np.packbits(missing).tobytes()
+    return encoded, entry
+
+def _decode_column(buffer, offset, length, entry):
+    dtype = np.dtype(entry['dtype'])
+    deltas = np.frombuffer(buffer, dtype=dtype, count=length, offset=offset)
+    offset += length * dtype.itemsize
+    values = (entry['first'] + np.cumsum(deltas, dtype=np.int64)) * entry['quantum']
+    if entry['nan']:
+        mask_size = (length + 7) // 8
+        missing = np.unpackbits(np.frombuffer(buffer, dtype=np.uint8, count=mask_size, offset=offset),
+                                count=length).astype(bool)
+        values[missing] = np.nan
+        offset += mask_size
+    return values, offset
+
+# Rides of a recording as (ride info, first row, length); a single ride is ride 0
+def _ride_rows(recording):
+    rides = recording.header.get('rides')
+    if rides:
+        return [(ride, ride['start'], ride['length']) for ride in rides]
+    return [({'ride_id': 0}, 0, len(recording))]
+
+# Write a recording (or a file readable by load_heart_rate_data) to an archive.
+# Returns the archive index.
+def write_archive(path, recording, chunk_size=chunk_size, quanta=None, level=compression_level):
+    if not isinstance(recording, HeartRateRecording):
+        recording = load_heart_rate_data(recording)
+    quanta = dict(COLUMN_QUANTA, **(quanta or {}))
+    column_names = recording.column_names
+    times = np.asarray(recording.time, dtype=float)
+    chunks = []
+    with open(path, 'wb') as file:
+        file.write(ARCHIVE_MAGIC)
+        for ride, first_row, length in _ride_rows(recording):
+            for start in range(first_row, first_row + length, chunk_size):
+                stop = min(start + chunk_size, first_row + length)
+                parts, columns = [], {}
+                for name in column_names:
+                    encoded, columns[name] = _encode_column(recording[name][start:stop],
+                                                            quanta.get(name, default_quantum))
+                    parts.append(encoded)
+                data = zlib.compress(b''.join(parts), level)
+                chunks.append({
+                    'ride_id': ride.get('ride_id', 0),
+                    'start': start,
+                    'length': stop - start,
+                    'first_time': float(times[start]),
+                    'last_time': float(times[stop - 1]),
+                    'offset': file.tell(),
+                    'size': len(data),
+                    'columns': columns,
+                })
+                file.write(data)
+
+        header = {key: value for key, value in recording.header.items() if key not in ('columns', 'dtype')}
+        index = {'version': FORMAT_VERSION, 'header': header, 'columns': column_names, 'chunks': chunks}
+        index_offset = file.tell()
+        file.write(json.dumps(index).encode('utf-8'))
+        file.write(TRAILER.pack(index_offset, ARCHIVE_MAGIC))
+    return index
+
+# Read the chunk index of an archive
+def read_archive_index(path):
+    with open(path, 'rb') as file:
+        if file.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+            raise ValueError(f"{path} is not a heart rate archive.")
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        if size < len(ARCHIVE_MAGIC) + TRAILER.size:
+            raise ValueError(f"{path} is truncated.")
+        file.seek(size - TRAILER.size)
+        index_offset, magic = TRAILER.unpack(file.read(TRAILER.size))
+        if magic != ARCHIVE_MAGIC or index_offset > size - TRAILER.size:
+            raise ValueError(f"{path} is truncated.")
+        file.seek(index_offset)
+        index = json.loads(file.read(size - TRAILER.size - index_offset).decode('utf-8'))
+    if index.get('version') != FORMAT_VERSION:
+        raise ValueError(f"{path}: unsupported archive version {index.get('version')}.")
+    return index
+
+# Chunks of the index that overlap the time range [start, stop] (seconds since
+# the start of each ride, None for open ends) and belong to one of ride_ids
+def select_chunks(index, start=None, stop=None, ride_ids=None):
+    ride_ids = None if ride_ids is None else set(ride_ids)
+    return [chunk for chunk in index['chunks']
+            if (ride_ids is None or chunk['ride_id'] in ride_ids)
+            and (start is None or chunk['last_time'] >= start)
+            and (stop is None or chunk['first_time'] <= stop)]
+
+# Decompress the chunks one at a time, yielding (chunk entry, dict of columns).
+# Rows outside [start, stop] are cut from the first and last chunks; when the
+# archive has no time column the times of the rows that are kept are added as one.
+def iter_archive_chunks(path, start=None, stop=None, ride_ids=None, index=None):
+    index = index or read_archive_index(path)
+    time_column = 'time' in index['columns']
+    sample_rate = index['header'].get('sample_rate', 1.0)
+    with open(path, 'rb') as file:
+        for chunk in select_chunks(index, start, stop, ride_ids):
+            file.seek(chunk['offset'])
+            buffer = zlib.decompress(file.read(chunk['size']))
+            columns, offset = {}, 0
+            for name in index['columns']:
+                columns[name], offset = _decode_column(buffer, offset, chunk['length'], chunk['columns'][name])
+
+            if start is not None or stop is not None:
+                if not time_column:
+                    columns['time'] = chunk['first_time'] + np.arange(chunk['length']) / sample_rate
+                times = columns['time']
+                keep = np.ones(chunk['length'], dtype=bool)
+                if start is not None:
+                    keep &= times >= start
+                if stop is not None:
+                    keep &= times <= stop
+                if not keep.all():
+                    first = int(np.argmax(keep)) if keep.any() else 0
+                    columns = {name: values[keep] for name, values in columns.items()}
+                    chunk = dict(chunk, start=chunk['start'] + first, length=int(keep.sum()),
+                                 first_time=float(times[keep][0]) if keep.any() else chunk['first_time'])
+            yield chunk, columns
+
+# Read an archive (or the part in a time range and/or of some rides) as a
+# recording like read_heart_rate_file gives. The ride table is rebuilt for the
+# rows that were read.
+def read_archive(path, start=None, stop=None, ride_ids=None):
+    index = read_archive_index(path)
+    column_names = list(index['columns'])
+    if (start is not None or stop is not None) and 'time' not in column_names:
+        column_names.append('time')
+    parts = {name: [] for name in column_names}
+    lengths = {}
+    for chunk, columns in iter_archive_chunks(path, start, stop, ride_ids, index):
+        for name, values in columns.items():
+            parts[name].append(values)
+        lengths[chunk['ride_id']] = lengths.get(chunk['ride_id'], 0) + chunk['length']
+    columns = {name: np.concatenate(values) if values else np.empty(0) for name, values in parts.items()}
+
+    header = dict(index['header'], columns=column_names, length=sum(lengths.values()))
+    if 'rides' in header:
+        rides, row = [], 0
+        for ride in header['rides']:
+            if ride['ride_id'] in lengths:
+                rides.append(dict(ride, start=row, length=lengths[ride['ride_id']]))
+                row += lengths[ride['ride_id']]
+        header['rides'] = rides
+    return HeartRateRecording(header, columns)
+
+# Sizes of an archive: samples, chunks and compressed bytes per sample
+def archive_info(path):
+    index = read_archive_index(path)
+    samples = sum(chunk['length'] for chunk in index['chunks'])
+    size = os.path.getsize(path)
+    return {
+        'samples': samples,
+        'columns': len(index['columns']),
+        'rides': len({chunk['ride_id'] for chunk in index['chunks']}),
+        'chunks': len(index['chunks']),
+        'bytes': size,
+        'bytes_per_value': size / max(1, samples * len(index['columns'])),
+    }
+
+def main():
+    from heartrate_storage import export_csv, write_heart_rate_file
+
+    parser = argparse.ArgumentParser(description="Pack heart rate files into compressed archives and read them back.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    pack = subparsers.add_parser('pack', help="archive .hrb or CSV files (each to the same name with .hra)")
+    pack.add_argument('files', nargs='+')
+    pack.add_argument('--chunk', type=int, default=chunk_size, help="samples per chunk")
+
+    unpack = subparsers.add_parser('unpack', help="extract (part of) an archive to .hrb or CSV")
+    unpack.add_argument('archive')
+    unpack.add_argument('output', help="output file (.hrb, anything else is written as CSV)")
+    unpack.add_argument('--start', type=float, help="first second of each ride to extract")
+    unpack.add_argument('--stop', type=float, help="last second of each ride to extract")
+    unpack.add_argument('--ride', type=int, action='append', help="ride id to extract (repeatable)")
+
+    info = subparsers.add_parser('info', help="show the size of archives")
+    info.add_argument('files', nargs='+')
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        if args.chunk <= 0:
+            parser.error("--chunk must be positive")
+        for path in args.files:
+            output = os.path.splitext(path)[0] + '.hra'
+            write_archive(output, path, args.chunk)
+            print(f"{path} ({os.path.getsize(path):,} bytes) -> {output} ({os.path.getsize(output):,} bytes)")
+    elif args.command == 'unpack':
+        recording = read_archive(args.archive, args.start, args.stop, args.ride)
+        if args.output.endswith('.hrb'):
+            header = recording.header
+            write_heart_rate_file(args.output, recording.columns, recording.sample_rate, recording.start_time,
+                                  recording.ages, header.get('rides'))
+        else:
+            export_csv(recording, args.output)
+        print(f"Extracted {len(recording)} samples to '{args.output}'.")
+    else:
+        for path in args.files:
+            sizes = archive_info(path)
+            print(f"{path}: {sizes['samples']:,} samples of {sizes['columns']} columns in {sizes['rides']} rides, "
+                  f"{sizes['chunks']} chunks, {sizes['bytes']:,} bytes ({sizes['bytes_per_value']:.2f} bytes per value)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import argparse
+import csv
+import fnmatch
+import os
+import sys
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from heartrate_analytics import window_size
+from heartrate_anomaly import ride_matrix
+from heartrate_detection import OCCUPANTS, control_threshold, threshold
+from heartrate_storage import load_heart_rate_data, parse_csv_header
+
+"""
+Batch analysis of a directory of ride files, e.g. the nightly review of a
+day's rides.
+
+Every file (.hrb fleet shards and single rides, .hra archives or CSV) is analysed in a
+worker process; .hrb files are memory-mapped, so only file names travel to
+the workers and only summary rows come back. Within a file all rides are
+analysed together as one NaN-padded (rides x samples) matrix per occupant
+(see heartrate_anomaly.ride_matrix). Files are handed out largest first so
+one big shard does not finish last on its own. When a directory is searched,
+CSV exports of an .hrb or .hra file and CSV files that are not recordings
+(fleet specs, earlier summaries) are skipped.
+
+For each ride and occupant the summary has the peak heart rate and when it
+happened, the peak of the smoothed series (moving average as in
+timeseries_analysis), the time above the anxious (140) and control (160 BPM)
+thresholds, and the number of episodes in which both occupants were above
+140 BPM at the same time (the both_high mask of rideshare.py).
+"""
+
+FILE_PATTERNS = ('*.hrb', '*.hra', '*.csv', '*.txt')
+BINARY_EXTENSIONS = ('.hrb', '.hra')
+SUMMARY_COLUMNS = ('file', 'ride_id', 'occupant', 'samples', 'duration', 'mean', 'peak', 'peak_time',
+                   'smoothed_peak', f'time_above_{threshold}', f'time_above_{control_threshold}',
+                   'both_high_time', 'both_high_episodes')
+
+# Whether a CSV file is a heart rate recording: its header has driver and
+# passenger columns (fleet specs and summaries do not)
+def is_recording_csv(path):
+    try:
+        with open(path, 'r') as file:
+            column_names = parse_csv_header(file.readline())
+    except (OSError, UnicodeDecodeError):
+        return False
+    return all(occupant in column_names for occupant in OCCUPANTS)
+
+# Ride files under directory (recursively), sorted by name. A CSV export next
+# to an .hrb or .hra file of the same name (heartrate_bpm.py --csv) is left out,
+# as are CSV files that are not recordings.
+def find_ride_files(directory, patterns=FILE_PATTERNS):
+    paths = []
+    for folder, _, names in os.walk(directory):
+        binary_stems = {stem for stem, extension in map(os.path.splitext, names) if extension in BINARY_EXTENSIONS}
+        for name in names:
+            if not any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+                continue
+            stem, extension = os.path.splitext(name)
+            path = os.path.join(folder, name)
+            if extension not in BINARY_EXTENSIONS and (stem in binary_stems or not is_recording_csv(path)):
+                continue
+            paths.append(path)
+    return sorted(paths)
+
+# Moving average of every row of a (rides x samples) matrix ('valid' part,
+# NaN where the window reaches into the padding)
+def smooth_rows(matrix, window=window_size):
+    if matrix.shape[1] < window:
+        return np.empty((len(matrix), 0))
+    sums = np.zeros((len(matrix), matrix.shape[1] + 1))
+    np.cumsum(matrix, axis=1, out=sums[:, 1:])
+    return (sums[:, window:] - sums[:, :-window]) / window
+
+# Number of runs of True along each row of a boolean matrix
+def count_episodes(mask):
+    if mask.shape[1] == 0:
+        return np.zeros(len(mask), dtype=int)
+    return mask[:, 0] + (mask[:, 1:] & ~mask[:, :-1]).sum(axis=1)
+
+# Summary rows for every ride and occupant of one recording
+def analyze_recording(recording, name=''):
+    sample_interval = 1 / recording.sample_rate
+    matrices = {}
+    for occupant in OCCUPANTS:
+        if occupant not in recording.columns:
+            raise ValueError(f"no {occupant} column")
+        ride_ids, matrices[occupant] = ride_matrix(recording, occupant)
+    valid = ~np.isnan(matrices['driver'])
+    samples = valid.sum(axis=1)
+
+    # NaN padding compares as False, so it never counts as time above a threshold
+    with np.errstate(invalid='ignore'):
+        both_high = (matrices['driver'] > threshold) & (matrices['passenger'] > threshold)
+    both_high_time = both_high.sum(axis=1) * sample_interval
+    both_high_episodes = count_episodes(both_high)
+
+    rows = []
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # Empty rides and rides shorter than the window
+        for occupant in OCCUPANTS:
+            matrix = matrices[occupant]
+            with np.errstate(invalid='ignore'):
+                above = (matrix > threshold).sum(axis=1) * sample_interval
+                above_control = (matrix > control_threshold).sum(axis=1) * sample_interval
+            mean = np.nanmean(matrix, axis=1)
+            peak = np.nanmax(matrix, axis=1, initial=-np.inf)
+            peak_index = np.argmax(np.nan_to_num(matrix, nan=-np.inf), axis=1)
+            smoothed_peak = np.nanmax(smooth_rows(matrix), axis=1, initial=-np.inf)
+            for row, ride_id in enumerate(ride_ids.tolist()):
+                rows.append({
+                    'file': name,
+                    'ride_id': ride_id,
+                    'occupant': occupant,
+                    'samples': int(samples[row]),
+                    'duration': samples[row] * sample_interval,
+                    'mean': mean[row],
+                    'peak': peak[row] if samples[row] else np.nan,
+                    'peak_time': peak_index[row] * sample_interval if samples[row] else np.nan,
+                    'smoothed_peak': smoothed_peak[row] if np.isfinite(smoothed_peak[row]) else np.nan,
+                    f'time_above_{threshold}': above[row],
+                    f'time_above_{control_threshold}': above_control[row],
+                    'both_high_time': both_high_time[row],
+                    'both_high_episodes': int(both_high_episodes[row]),
+                })
+    return rows
+
+# Worker: analyse one file. Returns (path, rows, error message or None).
+def analyze_file(path):
+    try:
+        return path, analyze_recording(load_heart_rate_data(path), path), None
+    except (OSError, ValueError) as e:
+        return path, [], str(e)
+
+# Analyse files across a process pool, largest first; results come back in
+# the order of paths. progress(path, error) is called as each file finishes.
+def analyze_files(paths, num_workers=None, progress=None):
+    paths = list(paths)
+    num_workers = max(1, min(num_workers or os.cpu_count() or 1, len(paths) or 1))
+    order = sorted(range(len(paths)), key=lambda index: -os.path.getsize(paths[index]))
+    results = [None] * len(paths)
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for index, result in zip(order, executor.map(analyze_file, [paths[index] for index in order])):
+            results[index] = result
+            if progress is not None:
+                progress(result[0], result[2])
+    return results
+
+def format_value(value):
+    if isinstance(value, float):
+        return '' if np.isnan(value) else f'{value:.6g}'
+    return value
+
+# Write the summary table as CSV
+def write_summary(rows, file):
+    writer = csv.DictWriter(file, SUMMARY_COLUMNS, lineterminator='\n')
+    writer.writeheader()
+    for row in rows:
+        writer.writerow({name: format_value(value) for name, value in row.items()})
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise every ride in a directory of heart rate files.")
+    parser.add_argument('paths', nargs='+', help="ride files or directories to search for ride files")
+    parser.add_argument('--output', help="summary CSV file (default: standard output)")
+    parser.add_argument('--workers', type=int, help="number of worker processes (default: CPU count)")
+    args = parser.parse_args()
+
+    paths = []
+    for path in args.paths:
+        if not os.path.exists(path):
+            parser.error(f"{path} does not exist")
+        paths.extend(find_ride_files(path) if os.path.isdir(path) else [path])
+    if not paths:
+        parser.error("no ride files found")
+
+    def progress(path, error):
+        if error is not None:
+            print(f"Skipped {path}: {error}", file=sys.stderr)
+
+    results = analyze_files(paths, args.workers, progress)
+    rows = [row for _, file_rows, _ in results for row in file_rows]
+    if args.output:
+        with open(args.output, 'w', newline='') as file:
+            write_summary(rows, file)
+    else:
+        write_summary(rows, sys.stdout)
+    rides = len({(row['file'], row['ride_id']) for row in rows})
+    print(f"Analysed {rides} rides in {len(paths)} files.", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
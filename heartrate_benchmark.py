@@ -0,0 +1,339 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+import numpy as np
+
+"""
+Benchmarks for the hot paths: simulation, file loading, threshold checks,
+moving averages, monitor frames, ride reports and the shared-memory sample
+bus.
+
+Every case is timed with time.perf_counter over several repeats after a
+warm-up call, and all random data comes from a fixed seed, so runs on the same
+machine are comparable. Results are written as JSON together with the Python,
+NumPy and machine details. Pass an earlier result file to --compare to print
+the ratio of every case against it and flag regressions.
+
+    python heartrate_benchmark.py --output baseline.json
+    python heartrate_benchmark.py --compare baseline.json
+
+check_anxious_heart_rate only queues its alerts, and the monitor is driven
+on a plain Agg canvas without a Tk window, so the suite runs headless.
+"""
+
+BENCHMARKS = ('simulation', 'load', 'detection', 'analysis', 'render', 'bus')
+FULL_SIZES = {
+    'rides': (1, 100, 1000),  # Rides per simulate_rides call
+    'samples': (360, 3600, 36000),  # Samples per file or series
+    'frames': 300,  # Monitor frames per repeat
+    'retention': (60, 300, 3600),  # Seconds of history shown by the monitor
+}
+QUICK_SIZES = {
+    'rides': (1, 100),
+    'samples': (360, 3600),
+    'frames': 60,
+    'retention': (300,),
+}
+regression_tolerance = 1.2  # Slowdown ratio reported as a regression by --compare
+
+# Time fn() `repeat` times after `warmup` untimed calls; returns the timings in seconds
+def time_call(fn, repeat=5, warmup=1):
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.fmean(timings),
+        'max': max(timings),
+        'repeat': repeat,
+    }
+
+# One result entry; rate is `items` per second at the median time
+def make_result(benchmark, case, params, seconds, items, unit):
+    return {
+        'benchmark': benchmark,
+        'case': case,
+        'params': params,
+        'seconds': seconds,
+        'rate': items / seconds['median'] if seconds['median'] > 0 else float('inf'),
+        'unit': unit,
+    }
+
+def result_key(result):
+    return (result['benchmark'], result['case'], json.dumps(result['params'], sort_keys=True))
+
+# One simulated ride of the given length (time, passenger, driver)
+def make_ride(samples, seed):
+    from heartrate_bpm import simulate_ride
+    return simulate_ride('adult', 'adult', ride_duration=samples, seed=seed, start_time=0)
+
+# Simulator throughput for batches of rides
+def bench_simulation(sizes, repeat, seed):
+    from heartrate_bpm import simulate_rides
+
+    results = []
+    duration = 6 * 60
+    for rides in sizes['rides']:
+        groups = ['adult'] * rides
+        seconds = time_call(lambda: simulate_rides(groups, groups, duration, seed=seed, start_time=0), repeat)
+        results.append(make_result('simulation', 'simulate_rides', {'rides': rides, 'duration': duration},
+                                   seconds, 2 * rides * duration, 'samples/s'))
+    return results
+
+# Load time of the same ride as CSV (np.loadtxt and read_heart_rate_data), as .hrb
+# and as a compressed .hra archive. Every case reads all values, since .hrb columns
+# are only memory-mapped on load.
+def bench_load(sizes, repeat, seed):
+    from heartrate_archive import write_archive
+    from heartrate_storage import export_csv, write_heart_rate_file, load_heart_rate_data
+    from timeseries_analysis import read_heart_rate_data
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for samples in sizes['samples']:
+            _, passenger, driver = make_ride(samples, seed)
+            columns = {'passenger': passenger, 'driver': driver}
+            csv_file = os.path.join(directory, f'ride-{samples}.txt')
+            data_file = os.path.join(directory, f'ride-{samples}.hrb')
+            archive_file = os.path.join(directory, f'ride-{samples}.hra')
+            export_csv(columns, csv_file)
+            write_heart_rate_file(data_file, columns)
+            write_archive(archive_file, load_heart_rate_data(data_file))
+
+            def loadtxt():
+                return np.loadtxt(csv_file, delimiter=',', skiprows=1).sum()
+
+            def read(path):
+                recording = read_heart_rate_data(path)
+                return recording['driver'].sum() + recording['passenger'].sum()
+
+            cases = (('np.loadtxt', csv_file, loadtxt),
+                     ('read_heart_rate_data csv', csv_file, lambda: read(csv_file)),
+                     ('read_heart_rate_data hrb', data_file, lambda: read(data_file)),
+                     ('read_heart_rate_data hra', archive_file, lambda: read(archive_file)))
+            for case, path, fn in cases:
+                params = {'samples': samples, 'bytes': os.path.getsize(path)}
+                results.append(make_result('load', case, params, time_call(fn, repeat), samples, 'samples/s'))
+    return results
+
+# Threshold checks of a whole ride with rideshare.check_anxious_heart_rate
+def bench_detection(sizes, repeat, seed):
+    from heartrate_alerts import AlertDispatcher
+    from heartrate_detection import HeartRateDetector
+    from rideshare import check_anxious_heart_rate
+
+    results = []
+    for samples in sizes['samples']:
+        time_array, passenger, driver = make_ride(samples, seed)
+        seconds = time_call(lambda: check_anxious_heart_rate(HeartRateDetector(), time_array, driver, passenger,
+                                                             AlertDispatcher()), repeat)
+        results.append(make_result('detection', 'check_anxious_heart_rate', {'samples': samples},
+                                   seconds, samples, 'samples/s'))
+    return results
+
+# Moving averages with timeseries_analysis.analyze_heart_rate_data, the batch
+# spectrogram of a fleet and live spectral updates one sample at a time
+def bench_analysis(sizes, repeat, seed):
+    from heartrate_bpm import simulate_rides
+    from heartrate_spectral import SpectralStream, stft
+    from timeseries_analysis import analyze_heart_rate_data
+
+    results = []
+    for samples in sizes['samples']:
+        time_array, passenger, driver = make_ride(samples, seed)
+        seconds = time_call(lambda: analyze_heart_rate_data(time_array, driver, passenger), repeat)
+        results.append(make_result('analysis', 'analyze_heart_rate_data', {'samples': samples},
+                                   seconds, samples, 'samples/s'))
+
+    samples = sizes['samples'][0]
+    for rides in sizes['rides']:
+        groups = ['adult'] * rides
+        _, passenger, _ = simulate_rides(groups, groups, samples, seed=seed, start_time=0)
+        seconds = time_call(lambda: stft(passenger), repeat)
+        results.append(make_result('analysis', 'stft', {'rides': rides, 'samples': samples},
+                                   seconds, rides * samples, 'samples/s'))
+
+        def stream():
+            spectral = SpectralStream(rides)
+            for index in range(samples):
+                spectral.update(passenger[:, index])
+
+        seconds = time_call(stream, repeat)
+        results.append(make_result('analysis', 'SpectralStream.update', {'rides': rides, 'samples': samples},
+                                   seconds, rides * samples, 'samples/s'))
+    return results
+
+# A HeartRateMonitorApp drawing on an Agg canvas instead of a Tk window
+def headless_monitor(retention_window):
+    from theMonitorApp import HeartRateMonitorApp
+
+    return HeartRateMonitorApp(None, retention_window=retention_window)
+
+# Frames per second of HeartRateMonitorApp.plot_heart_rate_data with one new
+# sample per frame, after the history has been filled to the retention window
+def bench_render(sizes, repeat, seed):
+    results = []
+    frames = sizes['frames']
+    for retention in sizes['retention']:
+        time_array, passenger, driver = make_ride(retention + frames * (repeat + 1), seed)
+        samples = iter(zip(time_array.tolist(), driver.tolist(), passenger.tolist()))
+        app = headless_monitor(retention)
+        for _ in range(retention):
+            app.plot_queue.put(next(samples))
+        app.plot_heart_rate_data()
+
+        def draw_frames():
+            for _ in range(frames):
+                app.plot_queue.put(next(samples))
+                app.plot_heart_rate_data()
+
+        full_draws = app.renderer.full_draws
+        seconds = time_call(draw_frames, repeat)
+        params = {'retention': retention, 'frames': frames}
+        result = make_result('render', 'plot_heart_rate_data', params, seconds, frames, 'frames/s')
+        result['full_draws'] = app.renderer.full_draws - full_draws
+        results.append(result)
+
+    # Headless ride reports, one reused figure for every ride
+    from heartrate_report import RideReport
+
+    report = RideReport()
+    with tempfile.TemporaryDirectory() as directory:
+        for samples in sizes['samples']:
+            time_array, passenger, driver = make_ride(samples, seed)
+            for format in ('png', 'svg'):
+                path = os.path.join(directory, f'report.{format}')
+
+                def render():
+                    report.update(time_array, driver, passenger, 'Ride 0')
+                    report.save(path)
+
+                results.append(make_result('render', f'RideReport {format}', {'samples': samples},
+                                           time_call(render, repeat), 1, 'reports/s'))
+    return results
+
+# One tick of live samples for a fleet published on a heartrate_bus.SampleBus
+# and read back, in one process (a reader in another process sees the same cost)
+def bench_bus(sizes, repeat, seed):
+    from heartrate_bpm import simulate_rides
+    from heartrate_bus import SampleBus
+    from heartrate_server import make_records
+
+    results = []
+    for rides in sizes['rides']:
+        groups = ['adult'] * rides
+        time_array, passenger, driver = simulate_rides(groups, groups, 60, seed=seed, start_time=0)
+        ticks = [make_records(np.arange(rides), seq, time_array[seq], passenger[:, seq], driver[:, seq])
+                 for seq in range(len(time_array))]
+        bus = SampleBus.create(f'heartrate-benchmark-{os.getpid()}', capacity=max(1 << 12, 4 * rides))
+        reader = bus.reader()
+        try:
+            def publish_and_read():
+                total = 0.0
+                for records in ticks:
+                    bus.publish(records)
+                    total += reader.read()['driver'].sum()
+                return total
+
+            seconds = time_call(publish_and_read, repeat)
+            results.append(make_result('bus', 'publish + read', {'rides': rides, 'ticks': len(ticks)},
+                                       seconds, rides * len(ticks), 'samples/s'))
+        finally:
+            reader.close()
+            bus.close()
+    return results
+
+def run_benchmarks(names=BENCHMARKS, sizes=FULL_SIZES, repeat=5, seed=0, progress=None):
+    benchmarks = {
+        'simulation': bench_simulation,
+        'load': bench_load,
+        'detection': bench_detection,
+        'analysis': bench_analysis,
+        'render': bench_render,
+        'bus': bench_bus,
+    }
+    results = []
+    for name in names:
+        for result in benchmarks[name](sizes, repeat, seed):
+            if progress is not None:
+                progress(result)
+            results.append(result)
+    return {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'repeat': repeat,
+        'seed': seed,
+        'results': results,
+    }
+
+def format_result(result):
+    params = ", ".join(f"{name}={value}" for name, value in result['params'].items())
+    return (f"{result['benchmark']:<10} {result['case']:<26} {params:<30} "
+            f"{result['seconds']['median'] * 1000:10.3f} ms {result['rate']:14,.0f} {result['unit']}")
+
+# Compare the median times of two runs; returns the number of regressions
+def compare_runs(baseline, current, tolerance=regression_tolerance, out=sys.stdout):
+    previous = {result_key(result): result for result in baseline['results']}
+    regressions = 0
+    for result in current['results']:
+        old = previous.get(result_key(result))
+        if old is None:
+            continue
+        ratio = result['seconds']['median'] / old['seconds']['median']
+        flag = "REGRESSION" if ratio > tolerance else "faster" if ratio < 1 / tolerance else ""
+        regressions += ratio > tolerance
+        print(f"{format_result(result)}  x{ratio:.2f} {flag}", file=out)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark simulation, loading, detection, analysis and rendering.")
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument('--quick', action='store_true', help="smaller sizes for a fast check")
+    parser.add_argument('--repeat', type=int, default=5, help="timed repeats per case")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="earlier JSON results to compare against")
+    parser.add_argument('--tolerance', type=float, default=regression_tolerance,
+                        help="slowdown ratio reported as a regression")
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    # Headless rendering; must be selected before pyplot is imported anywhere
+    import matplotlib
+    matplotlib.use('Agg')
+
+    names = args.benchmarks or BENCHMARKS
+    sizes = QUICK_SIZES if args.quick else FULL_SIZES
+    report = run_benchmarks(names, sizes, args.repeat, args.seed,
+                            progress=None if args.compare else lambda result: print(format_result(result)))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if compare_runs(baseline, report, args.tolerance):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
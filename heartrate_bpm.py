@@ -1,116 +1,346 @@
-import random
-import math
-from datetime import datetime
-
-"""
-In the program, the decision was made to omit the inclusion of Heart Rate Variability (HRV). HRV is a method for measuring the time gap between heartbeats. When simulating realistic heart rates, it is crucial to account for HRV as it mirrors the natural fluctuations in heart rate.
-
-However, incorporating HRV requires the use of algorithms that replicate real-life patterns of heart rate variation based on factors such as age, fitness, and stress. The rationale behind not including HRV in this program is that it could potentially increase the program's execution time.
-
-The prolonged execution time is partially attributed to the random intervals of sleep introduced between each step in the program. These random pauses introduce unpredictable delays, leading to an overall increase in the program's runtime. To enhance the program's speed, one solution is to use fixed intervals for these pauses instead of random ones. This adjustment makes the program more predictable and results in faster execution.
-"""
-
-# Resting and stressed heart rate ranges for different age groups
-age_groups = {
-    'child': {'relaxed': (80, 100), 'stressed': (120, 160)},
-    'adult': {'relaxed': (60, 80), 'stressed': (100, 150)},
-    'elderly': {'relaxed': (70, 90), 'stressed': (110, 140)}
-}
-
-# Get age and age group for the passenger and driver
-def get_age_group(age, is_driver=False):
-    if (is_driver and (age < 18 or age > 100)) or (not is_driver and age < 18):
-        raise ValueError("Invalid age for driver/passenger.")
-    elif age < 65:
-        return 'adult'
-    elif age < 100:
-        return 'elderly'
-    else:
-        raise ValueError("Invalid age for driver/passenger.")
-
-# Function to simulate heart rate with a sine wave and time-of-day variations
-def simulate_heart_rate(base_rate, amplitude, frequency, time, time_of_day_factor):
-    return base_rate + amplitude * math.sin(2 * math.pi * frequency * time) * time_of_day_factor
-
-# Function to introduce emotional context
-def get_emotional_factor():
-    return random.uniform(0.5, 1.5)
-
-# Function to get time of day factor (adjustment based on circadian rhythm)
-def get_time_of_day_factor(time):
-    # Mimic natural variations in heart rate based on the time of day
-    hour = datetime.fromtimestamp(time).hour
-    if 6 <= hour < 12:  # Morning
-        return 1.2
-    elif 12 <= hour < 18:  # Afternoon
-        return 1.0
-    elif 18 <= hour < 24:  # Evening
-        return 1.1
-    else:  # Night
-        return 0.9
-
-# Prompt the user to enter the age of the passenger and validate it
-while True:
-    try:
-        passenger_age = int(input("Enter the age of the passenger: "))
-        passenger_age_group = get_age_group(passenger_age)
-        break
-    except ValueError as e:
-        print(str(e))
-
-# Prompt the user to enter the age of the driver and validate it
-while True:
-    try:
-        driver_age = int(input("Enter the age of the driver: "))
-        driver_age_group = get_age_group(driver_age, is_driver=True)
-        break
-    except ValueError as e:
-        print(str(e))
-
-passenger_heart_rate_data = []
-driver_heart_rate_data = []
-
-ride_duration = 6 * 60  # 6 minutes in seconds
-time_interval = 1  # 1 second between heart rate measurements
-frequency = 1/10  # Frequency of the heart rate simulation
-
-for t in range(ride_duration):
-    # Determine whether the passenger and driver start the trip calmly or not
-    start_state = random.random() < 0.5
-
-    # Introduce emotional context factors
-    emotional_factor_passenger = get_emotional_factor()
-    emotional_factor_driver = get_emotional_factor()
-
-    # Get time of day factor
-    time_of_day_factor = get_time_of_day_factor(t)
-
-    # Simulate heart rate for the passenger
-    passenger_hr_range = age_groups[passenger_age_group]['relaxed'] if start_state else age_groups[passenger_age_group]['stressed']
-    passenger_heart_rate = simulate_heart_rate(
-        emotional_factor_passenger * random.uniform(*passenger_hr_range),  # base_rate
-        random.uniform(5, 15),  # amplitude
-        frequency,
-        t,
-        time_of_day_factor
-    )
-    passenger_heart_rate_data.append(passenger_heart_rate)
-
-    # Simulate heart rate for the driver
-    driver_hr_range = age_groups[driver_age_group]['relaxed'] if start_state else age_groups[driver_age_group]['stressed']
-    driver_heart_rate = simulate_heart_rate(
-        emotional_factor_driver * random.uniform(*driver_hr_range),  # base_rate
-        random.uniform(5, 15),  # amplitude
-        frequency,
-        t,
-        time_of_day_factor
-    )
-    driver_heart_rate_data.append(driver_heart_rate)
-
-# Save heart rate data to a file
-with open('heart_rate_data.txt', 'w') as file:
-    file.write("Passenger Heart Rate, Driver Heart Rate\n")
-    for passenger_hr, driver_hr in zip(passenger_heart_rate_data, driver_heart_rate_data):
-        file.write(f"{passenger_hr},{driver_hr}\n")
-
-print("Heart rate data generated and saved to 'heart_rate_data.txt'.")
+import random
+import argparse
+import csv
+import heapq
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+from heartrate_storage import DEFAULT_CSV_FILE, DEFAULT_DATA_FILE, create_heart_rate_file, export_csv, write_heart_rate_file
+from heartrate_hrv import heart_rate_from_rr, simulate_rr_intervals, windowed_hrv
+from heartrate_clock import parse_start_time
+
+"""
+Heart Rate Variability (HRV) is a method for measuring the time gap between heartbeats. When simulating realistic heart rates, it is crucial to account for HRV as it mirrors the natural fluctuations in heart rate.
+
+HRV was originally left out of this program because it could increase the program's execution time. It is now available as an option (--hrv, or hrv=True in simulate_rides): each occupant gets a smooth heart rate trend for the ride, and beat-to-beat RR intervals are generated around it with breathing, blood pressure and random variation scaled by age group and stress state (see heartrate_hrv.py). The per-second heart rates are then read from those beats. Everything is vectorised across rides (about 25 ms for a hundred 6-minute rides, a few times the cost of the plain simulation), so the option can stay on for fleet-scale generation.
+
+Without --hrv every sample is drawn independently as before.
+"""
+
+# Resting and stressed heart rate ranges for different age groups
+age_groups = {
+    'child': {'relaxed': (80, 100), 'stressed': (120, 160)},
+    'adult': {'relaxed': (60, 80), 'stressed': (100, 150)},
+    'elderly': {'relaxed': (70, 90), 'stressed': (110, 140)}
+}
+
+# Get age and age group for the passenger and driver
+def get_age_group(age, is_driver=False):
+    if (is_driver and (age < 18 or age > 100)) or (not is_driver and age < 18):
+        raise ValueError("Invalid age for driver/passenger.")
+    elif age < 65:
+        return 'adult'
+    elif age < 100:
+        return 'elderly'
+    else:
+        raise ValueError("Invalid age for driver/passenger.")
+
+# Function to simulate heart rate with a sine wave and time-of-day variations
+# (works on plain numbers as well as NumPy arrays)
+def simulate_heart_rate(base_rate, amplitude, frequency, time, time_of_day_factor):
+    return base_rate + amplitude * np.sin(2 * np.pi * frequency * time) * time_of_day_factor
+
+# Function to introduce emotional context
+def get_emotional_factor():
+    return random.uniform(0.5, 1.5)
+
+# Function to get time of day factor (adjustment based on circadian rhythm)
+def get_time_of_day_factor(time):
+    # Mimic natural variations in heart rate based on the time of day
+    hour = datetime.fromtimestamp(time).hour
+    if 6 <= hour < 12:  # Morning
+        return 1.2
+    elif 12 <= hour < 18:  # Afternoon
+        return 1.0
+    elif 18 <= hour < 24:  # Evening
+        return 1.1
+    else:  # Night
+        return 0.9
+
+# Vectorised version of get_time_of_day_factor for an array of timestamps
+def get_time_of_day_factors(times):
+    times = np.asarray(times, dtype=float)
+    if times.size == 0:
+        return np.empty_like(times)
+    # The local UTC offset is looked up once instead of calling fromtimestamp per sample
+    offset = datetime.fromtimestamp(times.min()).astimezone().utcoffset().total_seconds()
+    hours = ((times + offset) // 3600) % 24
+    return np.select([hours < 6, hours < 12, hours < 18], [0.9, 1.2, 1.0], default=1.1)
+
+# Relaxed/stressed heart rate ranges as (low, high) arrays, one row per age group name
+def get_heart_rate_ranges(age_group_names, state):
+    ranges = np.array([age_groups[name][state] for name in age_group_names], dtype=float)
+    return ranges[:, 0], ranges[:, 1]
+
+# Start timestamp of the rides of a command line run (epoch seconds): the given
+# one, else now for an unseeded run and the epoch for a seeded one, so the same
+# seed always gives the same rides
+def get_start_time(start_time=None, seed=None):
+    if start_time is not None:
+        return float(start_time)
+    return 0.0 if seed is not None else datetime.now().timestamp()
+
+# Simulate a batch of rides in one call. Returns the sample times (seconds
+# since start_time) and two (rides x samples) arrays for the passengers and
+# drivers. start_time is the epoch time the rides start (default 0), which
+# sets the time-of-day factor. The same seed and start time always produce the
+# same rides. With hrv=True the heart rates come from simulated heartbeats (see simulate_rides_hrv).
+def simulate_rides(passenger_age_groups, driver_age_groups, ride_duration=6 * 60, time_interval=1,
+                   frequency=1/10, start_time=0, seed=None, hrv=False):
+    if hrv:
+        return simulate_rides_hrv(passenger_age_groups, driver_age_groups, ride_duration, time_interval,
+                                  frequency, start_time, seed)[:3]
+    if len(passenger_age_groups) != len(driver_age_groups):
+        raise ValueError("Passenger and driver age groups must have the same length.")
+    rng = np.random.default_rng(seed)
+    time = np.arange(0, ride_duration, time_interval, dtype=float)
+    shape = (len(passenger_age_groups), len(time))
+
+    # Whether the passenger and driver are calm is drawn once per sample for both
+    start_state = rng.random(shape) < 0.5
+    time_of_day_factor = get_time_of_day_factors(start_time + time)
+
+    heart_rate_data = []
+    for age_group_names in (passenger_age_groups, driver_age_groups):
+        relaxed_low, relaxed_high = get_heart_rate_ranges(age_group_names, 'relaxed')
+        stressed_low, stressed_high = get_heart_rate_ranges(age_group_names, 'stressed')
+        low = np.where(start_state, relaxed_low[:, None], stressed_low[:, None])
+        high = np.where(start_state, relaxed_high[:, None], stressed_high[:, None])
+
+        emotional_factor = rng.uniform(0.5, 1.5, shape)
+        base_rate = emotional_factor * rng.uniform(low, high)
+        amplitude = rng.uniform(5, 15, shape)
+        heart_rate_data.append(simulate_heart_rate(base_rate, amplitude, frequency, time, time_of_day_factor))
+
+    passenger_heart_rate_data, driver_heart_rate_data = heart_rate_data
+    return time, passenger_heart_rate_data, driver_heart_rate_data
+
+# Simulate a batch of rides with heart rate variability. Each occupant is calm
+# or stressed for the whole ride and follows a smooth heart rate trend (same
+# ranges, sine wave and time-of-day factor as simulate_rides); heartbeats are
+# simulated around it and the per-sample heart rates are read from the beats.
+# Returns time, passenger and driver like simulate_rides, plus a dict with the
+# (beat_times, rr_intervals) matrices of each occupant.
+def simulate_rides_hrv(passenger_age_groups, driver_age_groups, ride_duration=6 * 60, time_interval=1,
+                       frequency=1/10, start_time=0, seed=None):
+    if len(passenger_age_groups) != len(driver_age_groups):
+        raise ValueError("Passenger and driver age groups must have the same length.")
+    rng = np.random.default_rng(seed)
+    time = np.arange(0, ride_duration, time_interval, dtype=float)
+    rides = len(passenger_age_groups)
+    time_of_day_factor = get_time_of_day_factors(start_time + time)
+
+    heart_rate_data = []
+    beats = {}
+    for occupant, age_group_names in (('passenger', passenger_age_groups), ('driver', driver_age_groups)):
+        stressed = rng.random(rides) >= 0.5
+        relaxed_low, relaxed_high = get_heart_rate_ranges(age_group_names, 'relaxed')
+        stressed_low, stressed_high = get_heart_rate_ranges(age_group_names, 'stressed')
+        low = np.where(stressed, stressed_low, relaxed_low)
+        high = np.where(stressed, stressed_high, relaxed_high)
+
+        emotional_factor = rng.uniform(0.5, 1.5, rides)
+        base_rate = emotional_factor * rng.uniform(low, high)
+        amplitude = rng.uniform(5, 15, rides)
+        trend = simulate_heart_rate(base_rate[:, None], amplitude[:, None], frequency, time, time_of_day_factor)
+
+        beat_times, rr = simulate_rr_intervals(trend, age_group_names, stressed, time_interval, rng)
+        beats[occupant] = (beat_times, rr)
+        heart_rate_data.append(heart_rate_from_rr(time, beat_times, rr))
+
+    passenger_heart_rate_data, driver_heart_rate_data = heart_rate_data
+    return time, passenger_heart_rate_data, driver_heart_rate_data, beats
+
+# Simulate a single ride, returning 1-D time, passenger and driver arrays
+def simulate_ride(passenger_age_group, driver_age_group, ride_duration=6 * 60, time_interval=1,
+                  frequency=1/10, start_time=0, seed=None, hrv=False):
+    time, passenger_heart_rate_data, driver_heart_rate_data = simulate_rides(
+        [passenger_age_group], [driver_age_group], ride_duration, time_interval, frequency, start_time, seed, hrv)
+    return time, passenger_heart_rate_data[0], driver_heart_rate_data[0]
+
+# Read a fleet spec file. It is a CSV with a header row and the columns
+# ride_id, passenger_age, driver_age and duration (seconds); the optional
+# passenger_age_group and driver_age_group columns override the groups derived
+# from the ages, and the optional start_time column (epoch seconds or ISO date
+# and time) sets when the ride starts.
+def read_fleet_spec(spec_file):
+    rides = []
+    with open(spec_file, newline='') as file:
+        for line_number, row in enumerate(csv.DictReader(file), start=2):
+            try:
+                passenger_age = int(row['passenger_age'])
+                driver_age = int(row['driver_age'])
+                ride = {
+                    'ride_id': int(row['ride_id']),
+                    'passenger_age': passenger_age,
+                    'driver_age': driver_age,
+                    'passenger_age_group': row.get('passenger_age_group') or get_age_group(passenger_age),
+                    'driver_age_group': row.get('driver_age_group') or get_age_group(driver_age, is_driver=True),
+                    'duration': int(row['duration']),
+                }
+                if row.get('start_time'):
+                    ride['start_time'] = parse_start_time(row['start_time'])
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError(f"{spec_file}, line {line_number}: {e}") from None
+            for key in ('passenger_age_group', 'driver_age_group'):
+                if ride[key] not in age_groups:
+                    raise ValueError(f"{spec_file}, line {line_number}: unknown age group '{ride[key]}'")
+            if ride['duration'] <= 0:
+                raise ValueError(f"{spec_file}, line {line_number}: duration must be positive")
+            rides.append(ride)
+    return rides
+
+# Split rides into shards with roughly equal total duration (longest rides are
+# placed first, each on the currently lightest shard). Rides keep their spec order within a shard.
+def shard_rides(rides, num_shards):
+    num_shards = max(1, min(num_shards, len(rides)))
+    shards = [[] for _ in range(num_shards)]
+    loads = [(0, shard_index) for shard_index in range(num_shards)]
+    for ride_index in sorted(range(len(rides)), key=lambda i: -rides[i]['duration']):
+        load, shard_index = heapq.heappop(loads)
+        shards[shard_index].append(ride_index)
+        heapq.heappush(loads, (load + rides[ride_index]['duration'], shard_index))
+    return [[rides[i] for i in sorted(shard)] for shard in shards]
+
+# Simulate every ride in one shard with the shard's own random stream and write
+# them to a single .hrb file (see heartrate_storage.py), filled in place one
+# ride at a time. Rides without a start_time start at start_time. Runs inside a worker process.
+def simulate_shard(rides, seed, shard_file, time_interval=1, frequency=1/10, csv_export=False, hrv=False,
+                   start_time=0):
+    rng = np.random.default_rng(seed)
+    ride_table = []
+    start = 0
+    for ride in rides:
+        length = len(np.arange(0, ride['duration'], time_interval))
+        ride_table.append(dict(ride, start=start, length=length, start_time=ride.get('start_time', start_time)))
+        start += length
+
+    # The file starts with its earliest ride; each ride's own start is in the ride table
+    recording = create_heart_rate_file(shard_file, ['ride_id', 'time', 'passenger', 'driver'], start,
+                                       sample_rate=1 / time_interval,
+                                       start_time=min((ride['start_time'] for ride in ride_table), default=start_time),
+                                       rides=ride_table)
+    for ride in ride_table:
+        rows = slice(ride['start'], ride['start'] + ride['length'])
+        time, passenger_heart_rate_data, driver_heart_rate_data = simulate_ride(
+            ride['passenger_age_group'], ride['driver_age_group'], ride['duration'],
+            time_interval, frequency, ride['start_time'], seed=rng, hrv=hrv)
+        recording['ride_id'][rows] = ride['ride_id']
+        recording['time'][rows] = time
+        recording['passenger'][rows] = passenger_heart_rate_data
+        recording['driver'][rows] = driver_heart_rate_data
+    for column in recording.columns.values():
+        if isinstance(column, np.memmap):
+            column.flush()
+
+    if csv_export:
+        export_csv(recording, os.path.splitext(shard_file)[0] + '.csv')
+    return shard_file, len(rides)
+
+# Simulate a whole fleet of rides across a process pool. Each shard gets an
+# independent seed spawned from one SeedSequence, so a run is reproducible for
+# a given seed, start time and shard count. Rides without their own start time
+# start at start_time (default 0).
+def simulate_fleet(rides, out_dir, num_workers=None, num_shards=None, seed=None,
+                   time_interval=1, frequency=1/10, csv_export=False, hrv=False, start_time=0):
+    num_workers = num_workers or os.cpu_count() or 1
+    shards = shard_rides(rides, num_shards or num_workers)
+    seeds = np.random.SeedSequence(seed).spawn(len(shards))
+    os.makedirs(out_dir, exist_ok=True)
+    shard_files = [os.path.join(out_dir, f"shard-{shard_index:05d}.hrb") for shard_index in range(len(shards))]
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        results = list(executor.map(simulate_shard, shards, seeds, shard_files,
+                                    [time_interval] * len(shards), [frequency] * len(shards),
+                                    [csv_export] * len(shards), [hrv] * len(shards),
+                                    [start_time] * len(shards)))
+    return results
+
+# Prompt the user to enter an age until it is valid for the passenger/driver
+def prompt_age(occupant, is_driver=False):
+    while True:
+        try:
+            age = int(input(f"Enter the age of the {occupant}: "))
+            get_age_group(age, is_driver=is_driver)
+            return age
+        except ValueError as e:
+            print(str(e))
+
+# Simulate a single ride starting at start_time (default 0) and write it to
+# data_file (and heart_rate_data.txt when a CSV export is requested). Ages that
+# are not given are prompted for. With hrv=True the HRV metrics of the ride are printed as well.
+def run_single_ride(passenger_age=None, driver_age=None, ride_duration=6 * 60, seed=None,
+                    data_file=DEFAULT_DATA_FILE, csv_export=False, hrv=False, start_time=0):
+    if passenger_age is None:
+        passenger_age = prompt_age('passenger')
+    if driver_age is None:
+        driver_age = prompt_age('driver', is_driver=True)
+    passenger_age_group = get_age_group(passenger_age)
+    driver_age_group = get_age_group(driver_age, is_driver=True)
+
+    time_interval = 1  # 1 second between heart rate measurements
+    frequency = 1/10  # Frequency of the heart rate simulation
+
+    # Simulate the whole ride at once
+    if hrv:
+        _, passenger_heart_rate_data, driver_heart_rate_data, beats = simulate_rides_hrv(
+            [passenger_age_group], [driver_age_group], ride_duration, time_interval, frequency, start_time, seed)
+        passenger_heart_rate_data, driver_heart_rate_data = passenger_heart_rate_data[0], driver_heart_rate_data[0]
+        for occupant, (beat_times, rr) in beats.items():
+            metrics = windowed_hrv(beat_times, rr, ride_duration, window=ride_duration)
+            print(f"{occupant.title()} HRV: SDNN {metrics['sdnn'][0, 0]:.1f} ms, "
+                  f"RMSSD {metrics['rmssd'][0, 0]:.1f} ms")
+    else:
+        _, passenger_heart_rate_data, driver_heart_rate_data = simulate_ride(
+            passenger_age_group, driver_age_group, ride_duration, time_interval, frequency, start_time, seed)
+
+    # Save heart rate data to a file
+    columns = {'passenger': passenger_heart_rate_data, 'driver': driver_heart_rate_data}
+    write_heart_rate_file(data_file, columns, sample_rate=1 / time_interval, start_time=start_time,
+                          ages={'passenger': passenger_age, 'driver': driver_age})
+    print(f"Heart rate data generated and saved to '{data_file}'.")
+
+    if csv_export:
+        export_csv(columns, DEFAULT_CSV_FILE)
+        print(f"Heart rate data exported to '{DEFAULT_CSV_FILE}'.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate passenger and driver heart rates.")
+    parser.add_argument('--passenger-age', type=int, help="age of the passenger (prompted for when missing)")
+    parser.add_argument('--driver-age', type=int, help="age of the driver (prompted for when missing)")
+    parser.add_argument('--duration', type=int, default=6 * 60, help="ride duration in seconds")
+    parser.add_argument('--output', default=DEFAULT_DATA_FILE, help="output file for a single ride")
+    parser.add_argument('--fleet', metavar='SPEC', help="CSV spec file of rides to simulate in fleet mode")
+    parser.add_argument('--out-dir', default='fleet_data', help="directory for the fleet shard files")
+    parser.add_argument('--workers', type=int, help="number of worker processes (default: CPU count)")
+    parser.add_argument('--shards', type=int, help="number of shard files (default: number of workers)")
+    parser.add_argument('--seed', type=int, help="random seed for reproducible output")
+    parser.add_argument('--csv', action='store_true', help="also export the data as CSV")
+    parser.add_argument('--hrv', action='store_true', help="simulate heartbeats with heart rate variability")
+    parser.add_argument('--start', help="start time of the rides (epoch seconds or YYYY-MM-DDTHH:MM:SS, "
+                             "default now, or the epoch with --seed)")
+    args = parser.parse_args()
+
+    try:
+        start_time = get_start_time(None if args.start is None else parse_start_time(args.start), args.seed)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.fleet is None:
+        try:
+            run_single_ride(args.passenger_age, args.driver_age, args.duration, args.seed, args.output, args.csv,
+                            args.hrv, start_time)
+        except ValueError as e:
+            parser.error(str(e))
+        return
+
+    rides = read_fleet_spec(args.fleet)
+    if not rides:
+        parser.error(f"no rides in {args.fleet}")
+    results = simulate_fleet(rides, args.out_dir, args.workers, args.shards, args.seed,
+                             csv_export=args.csv, hrv=args.hrv, start_time=start_time)
+    print(f"Simulated {len(rides)} rides into {len(results)} shards in '{args.out_dir}'.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import numpy as np
+
+"""
+Fixed-capacity ring buffer for live heart rate samples.
+
+All storage is allocated up front, so memory use stays flat however long a
+monitor runs. Every sample is written twice, at its slot and at the slot plus
+the capacity; the most recent n samples are therefore always one contiguous
+slice of the backing array and can be handed out as views without copying.
+Appending a sample is O(1) and appending a chunk of k samples is O(k).
+"""
+
+class SampleRingBuffer:
+    def __init__(self, capacity, channels=('time', 'driver', 'passenger'), dtype=float):
+        if capacity <= 0:
+            raise ValueError("Ring buffer capacity must be positive.")
+        self.capacity = int(capacity)
+        self.channels = tuple(channels)
+        self._index = {name: i for i, name in enumerate(self.channels)}
+        self._data = np.full((len(self.channels), 2 * self.capacity), np.nan, dtype=dtype)
+        self._head = 0  # Slot the next sample is written to
+        self._count = 0
+        self.total = 0  # Number of samples ever appended
+
+    # Buffer sized to keep retention_window seconds of samples at sample_rate Hz
+    @classmethod
+    def for_retention(cls, retention_window, sample_rate=1.0, channels=('time', 'driver', 'passenger'), dtype=float):
+        return cls(max(1, int(np.ceil(retention_window * sample_rate))), channels, dtype)
+
+    def __len__(self):
+        return self._count
+
+    def clear(self):
+        self._head = 0
+        self._count = 0
+        self.total = 0
+
+    # Append one sample, given as one value per channel in channel order
+    def append(self, *values):
+        head = self._head
+        self._data[:, head] = values
+        self._data[:, head + self.capacity] = values
+        self._head = (head + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+        self.total += 1
+
+    # Append a chunk of samples given as a dict of equally long arrays per channel.
+    # Only the last `capacity` samples of an oversized chunk are kept.
+    def extend(self, columns):
+        length = len(columns[self.channels[0]])
+        if length == 0:
+            return
+        skipped = max(0, length - self.capacity)
+        slots = (self._head + skipped + np.arange(length - skipped)) % self.capacity
+        for name, row in self._index.items():
+            values = np.asarray(columns[name])[skipped:]
+            self._data[row, slots] = values
+            self._data[row, slots + self.capacity] = values
+        self._head = (self._head + length) % self.capacity
+        self._count = min(self._count + length, self.capacity)
+        self.total += length
+
+    # Read-only views of the most recent n samples (all retained samples by
+    # default), oldest first, as a dict of channel name to array
+    def window(self, n=None):
+        n = self._count if n is None else max(0, min(int(n), self._count))
+        end = self._head + self.capacity
+        view = self._data[:, end - n:end]
+        view.flags.writeable = False
+        return {name: view[row] for name, row in self._index.items()}
+
+    # Read-only view of one channel over the most recent n samples
+    def channel(self, name, n=None):
+        return self.window(n)[name]
+
+    # Most recent sample as a dict, or None when the buffer is empty
+    def latest(self):
+        if self._count == 0:
+            return None
+        slot = self._head - 1 + self.capacity
+        return {name: self._data[row, slot] for name, row in self._index.items()}
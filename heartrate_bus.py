@@ -0,0 +1,337 @@
+import argparse
+import os
+from multiprocessing import shared_memory
+import numpy as np
+from heartrate_clock import make_clock
+from heartrate_server import RECORD_DTYPE, make_records
+
+"""
+Live sample bus between processes on one machine, in shared memory.
+
+One producer (the simulator or a device adapter) publishes heart rate samples
+as fixed-size records (heartrate_server.RECORD_DTYPE: ride id, seq, time,
+passenger and driver) into a ring in a multiprocessing.shared_memory block.
+Any number of readers (up to max_readers, e.g. monitors and analysis
+processes) follow it at their own pace. There is no lock: the producer owns
+the write index and each reader owns its read index in its own cache line,
+and a counter is only published after the records it covers are written.
+
+Readers get NumPy views straight into the ring, no copies. A view stays
+valid until the reader's next read() or release(): the producer does not
+overwrite records a reader has not released (backpressure). If a reader
+falls more than `timeout` seconds behind (or has died), the producer writes
+over its unread records anyway and marks the reader stale: it no longer waits
+for it, so a dead reader costs one timeout, not one per publish. When a
+stale reader reads again it is waited for again; it skips to the oldest
+record still in the ring and counts the lost records as overruns. Published,
+backpressure waits and overwritten records are counted in the shared block
+too, so any process can report them.
+
+    bus = SampleBus.create('hr-bus')        # simulator process
+    bus.publish(records)
+    reader = SampleBus.attach('hr-bus').reader()   # monitor process
+    records = reader.read()
+"""
+
+BUS_MAGIC = 0x48524255  # 'HRBU'
+BUS_VERSION = 1
+DEFAULT_BUS_NAME = 'heartrate-bus'
+bus_capacity = 1 << 16  # Records in the ring
+max_readers = 8
+backpressure_timeout = 1.0  # Seconds the producer waits for a slow reader before writing over its records
+poll_interval = 0.001  # Seconds between checks while waiting
+
+# The control block is int64 words, 8 (one cache line) per group
+LINE = 8
+HEADER_LINE, PRODUCER_LINE, READERS_LINE = 0, 1, 2
+MAGIC, VERSION, CAPACITY, RECORD_SIZE, MAX_READERS = range(5)  # Words of the header line
+WRITE_INDEX, PUBLISHED, WAITS, OVERWRITTEN, CLOSED = range(5)  # Words of the producer line
+OWNER, READ_INDEX, RECEIVED, OVERRUNS, STALE = range(5)  # Words of a reader line
+
+# Attach to an existing block without this process's resource tracker
+# removing it when the process exits (only the creator unlinks it)
+def _attach_shared_memory(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python before 3.13
+        from multiprocessing import resource_tracker
+
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+class SampleBus:
+    def __init__(self, memory, owner):
+        self.memory = memory
+        self.owner = owner
+        header = np.ndarray(LINE, dtype=np.int64, buffer=memory.buf)
+        if header[MAGIC] != BUS_MAGIC or header[VERSION] != BUS_VERSION:
+            raise ValueError(f"Shared memory '{memory.name}' is not a heart rate bus.")
+        if header[RECORD_SIZE] != RECORD_DTYPE.itemsize:
+            raise ValueError(f"Bus '{memory.name}' has records of another size.")
+        self.capacity = int(header[CAPACITY])
+        self.max_readers = int(header[MAX_READERS])
+        control_words = LINE * (READERS_LINE + self.max_readers)
+        self.control = np.ndarray(control_words, dtype=np.int64, buffer=memory.buf)
+        self.producer = self.control[LINE * PRODUCER_LINE:LINE * (PRODUCER_LINE + 1)]
+        self.readers = self.control[LINE * READERS_LINE:].reshape(self.max_readers, LINE)
+        self.ring = np.ndarray(self.capacity, dtype=RECORD_DTYPE, buffer=memory.buf, offset=control_words * 8)
+        self.clock = make_clock()
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    # Create a new bus (the producer side)
+    @classmethod
+    def create(cls, name=DEFAULT_BUS_NAME, capacity=bus_capacity, max_readers=max_readers):
+        if capacity <= 0 or max_readers <= 0:
+            raise ValueError("Capacity and number of readers must be positive.")
+        control_words = LINE * (READERS_LINE + max_readers)
+        memory = shared_memory.SharedMemory(name=name, create=True,
+                                            size=control_words * 8 + capacity * RECORD_DTYPE.itemsize)
+        control = np.ndarray(control_words, dtype=np.int64, buffer=memory.buf)
+        control[:] = 0
+        control[[CAPACITY, RECORD_SIZE, MAX_READERS, VERSION]] = (capacity, RECORD_DTYPE.itemsize, max_readers,
+                                                                 BUS_VERSION)
+        control[MAGIC] = BUS_MAGIC  # Written last: the bus is ready
+        return cls(memory, owner=True)
+
+    # Open an existing bus (the reader side)
+    @classmethod
+    def attach(cls, name=DEFAULT_BUS_NAME):
+        return cls(_attach_shared_memory(name), owner=False)
+
+    @property
+    def closed(self):
+        return bool(self.producer[CLOSED])
+
+    # Read index of the slowest reader the producer waits for (the write index when there are none)
+    def _slowest_read_index(self):
+        active = (self.readers[:, OWNER] != 0) & (self.readers[:, STALE] == 0)
+        write_index = int(self.producer[WRITE_INDEX])
+        return int(self.readers[active, READ_INDEX].min()) if active.any() else write_index
+
+    # Publish a structured array of RECORD_DTYPE records. Waits while the ring is
+    # full of records a reader has not released, at most timeout seconds per
+    # chunk; after that the oldest unread records are overwritten. Returns the
+    # number of records published.
+    def publish(self, records, timeout=backpressure_timeout):
+        records = np.asarray(records, dtype=RECORD_DTYPE)
+        for start in range(0, len(records), self.capacity):
+            self._publish_chunk(records[start:start + self.capacity], timeout)
+        return len(records)
+
+    def _publish_chunk(self, records, timeout):
+        count = len(records)
+        write_index = int(self.producer[WRITE_INDEX])
+        waited = 0.0
+        while write_index + count - self._slowest_read_index() > self.capacity:
+            if waited >= timeout:
+                self.producer[OVERWRITTEN] += min(count, write_index + count - self._slowest_read_index() - self.capacity)
+                # Stop waiting for the readers that are being lapped until they read again
+                lapped = ((self.readers[:, OWNER] != 0) &
+                          (self.readers[:, READ_INDEX] < write_index + count - self.capacity))
+                self.readers[lapped, STALE] = 1
+                break
+            if waited == 0.0:
+                self.producer[WAITS] += 1
+            self.clock.sleep(poll_interval)
+            waited += poll_interval
+
+        # Records written over the unread records of stale readers count as overwritten too
+        stale = (self.readers[:, OWNER] != 0) & (self.readers[:, STALE] != 0)
+        if waited < timeout and stale.any():
+            self.producer[OVERWRITTEN] += max(0, min(count, write_index + count - self.capacity
+                                                     - int(self.readers[stale, READ_INDEX].min())))
+
+        # Write the records (in two parts at the end of the ring), then publish the new write index
+        slot = write_index % self.capacity
+        first = min(count, self.capacity - slot)
+        self.ring[slot:slot + first] = records[:first]
+        self.ring[:count - first] = records[first:]
+        self.producer[PUBLISHED] += count
+        self.producer[WRITE_INDEX] = write_index + count
+
+    # Publish one sample for each of several rides
+    def publish_samples(self, ride_ids, seq, time, passenger, driver, timeout=backpressure_timeout):
+        return self.publish(make_records(ride_ids, seq, time, passenger, driver), timeout)
+
+    # Tell readers that no more records will come
+    def close_stream(self):
+        self.producer[CLOSED] = 1
+
+    # A reader in a free slot. With from_start=True it starts at the oldest
+    # record still in the ring, otherwise at the next record published.
+    def reader(self, from_start=False):
+        return BusReader(self, from_start)
+
+    def counters(self):
+        readers = self.readers[self.readers[:, OWNER] != 0]
+        return {
+            'published': int(self.producer[PUBLISHED]),
+            'backpressure_waits': int(self.producer[WAITS]),
+            'overwritten': int(self.producer[OVERWRITTEN]),
+            'readers': len(readers),
+            'stale_readers': int(readers[:, STALE].sum()),
+            'received': int(readers[:, RECEIVED].sum()),
+            'overruns': int(readers[:, OVERRUNS].sum()),
+            'lag': int(self.producer[WRITE_INDEX]) - self._slowest_read_index(),
+        }
+
+    def summary(self):
+        return ", ".join(f"{count} {name.replace('_', ' ')}" for name, count in self.counters().items())
+
+    # Detach from the bus; the creator also removes it
+    def close(self):
+        self.control = self.producer = self.readers = self.ring = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+class BusReader:
+    def __init__(self, bus, from_start=False):
+        self.bus = bus
+        # Slots are claimed without a lock: readers should attach one at a time
+        free = np.flatnonzero(bus.readers[:, OWNER] == 0)
+        if not len(free):
+            raise RuntimeError(f"Bus '{bus.name}' already has {bus.max_readers} readers.")
+        self.slot = int(free[0])
+        self.line = bus.readers[self.slot]
+        write_index = int(bus.producer[WRITE_INDEX])
+        self.position = max(0, write_index - bus.capacity) if from_start else write_index
+        self.line[READ_INDEX] = self.position
+        self.line[RECEIVED] = self.line[OVERRUNS] = self.line[STALE] = 0
+        # The producer only waits for the reader once its read index is set
+        self.line[OWNER] = int.from_bytes(os.urandom(7), 'little') | 1
+
+    @property
+    def overruns(self):
+        return int(self.line[OVERRUNS])
+
+    @property
+    def received(self):
+        return int(self.line[RECEIVED])
+
+    # Let the producer reuse the records returned by the last read()
+    def release(self):
+        self.line[READ_INDEX] = self.position
+
+    # Records published since the last read, as a read-only view into the ring
+    # (at most max_records, and only up to the end of the ring: call again for
+    # the rest). The view stays valid until the next read() or release().
+    def read(self, max_records=None):
+        bus = self.bus
+        while True:
+            write_index = int(bus.producer[WRITE_INDEX])
+            oldest = write_index - bus.capacity
+            if self.position < oldest:
+                # The producer wrote over records this reader had not read
+                self.line[OVERRUNS] += oldest - self.position
+                self.position = oldest
+            self.release()
+            self.line[STALE] = 0  # Reading again: the producer waits for this reader again
+            slot = self.position % bus.capacity
+            count = min(write_index - self.position, bus.capacity - slot)
+            if max_records is not None:
+                count = min(count, max_records)
+            records = bus.ring[slot:slot + count]
+            # Only records the producer has not overwritten meanwhile are returned
+            if int(bus.producer[WRITE_INDEX]) - bus.capacity <= self.position:
+                break
+        records = records.view()
+        records.flags.writeable = False
+        self.position += count
+        self.line[RECEIVED] += count
+        return records
+
+    # Wait up to timeout seconds (forever if None) for records; returns an empty
+    # view at the timeout or once the stream is closed and drained
+    def wait(self, timeout=None, max_records=None, stop_event=None):
+        waited = 0.0
+        while True:
+            records = self.read(max_records)
+            if len(records) or self.bus.closed or (timeout is not None and waited >= timeout):
+                return records
+            if stop_event is not None and stop_event.is_set():
+                return records
+            self.bus.clock.sleep(poll_interval)
+            waited += poll_interval
+
+    # Free the reader's slot
+    def close(self):
+        self.line[OWNER] = 0
+
+# Simulate num_rides rides with heartrate_bpm and publish them on the bus, one
+# sample per ride every 1 / speed seconds of `clock` (as fast as the readers
+# take them with speed=None)
+def publish_simulated_rides(bus, num_rides=100, ride_duration=6 * 60, speed=1.0, seed=None, clock=None,
+                            first_ride_id=0, stop_event=None):
+    from heartrate_bpm import simulate_rides
+
+    clock = clock or make_clock()
+    groups = ['adult'] * num_rides
+    time, passenger, driver = simulate_rides(groups, groups, ride_duration, seed=seed)
+    ride_ids = np.arange(first_ride_id, first_ride_id + num_rides)
+    started = clock()
+    for seq in range(len(time)):
+        if stop_event is not None and stop_event.is_set():
+            break
+        bus.publish_samples(ride_ids, seq, time[seq], passenger[:, seq], driver[:, seq])
+        if speed:
+            clock.sleep(started + (seq + 1) / speed - clock())
+    bus.close_stream()
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared-memory bus for live heart rate samples.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    publish = subparsers.add_parser('publish', help="simulate rides and publish them on a new bus")
+    publish.add_argument('--name', default=DEFAULT_BUS_NAME, help="name of the shared memory block")
+    publish.add_argument('--rides', type=int, default=100)
+    publish.add_argument('--duration', type=int, default=6 * 60, help="ride duration in seconds")
+    publish.add_argument('--speed', type=float, default=1.0, help="samples per second per ride (0 for max)")
+    publish.add_argument('--capacity', type=int, default=bus_capacity, help="records in the ring")
+    publish.add_argument('--seed', type=int)
+    publish.add_argument('--virtual', action='store_true', help="pace the rides on a virtual clock")
+
+    watch = subparsers.add_parser('watch', help="read a bus and print its counters")
+    watch.add_argument('--name', default=DEFAULT_BUS_NAME)
+    watch.add_argument('--interval', type=float, default=1.0, help="seconds between status lines")
+    args = parser.parse_args()
+
+    if args.command == 'publish':
+        bus = SampleBus.create(args.name, args.capacity)
+        try:
+            publish_simulated_rides(bus, args.rides, args.duration, args.speed or None, args.seed,
+                                    make_clock(args.virtual))
+            print(bus.summary())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            bus.close()
+        return
+
+    bus = SampleBus.attach(args.name)
+    reader = bus.reader()
+    clock = make_clock()
+    next_report = clock() + args.interval
+    try:
+        while True:
+            records = reader.wait(args.interval)
+            if clock() >= next_report or (bus.closed and not len(records)):
+                print(f"{reader.received} received, {reader.overruns} overruns; bus: {bus.summary()}")
+                next_report = clock() + args.interval
+            if bus.closed and not len(records):
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
+        bus.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime
+
+"""
+Pluggable clocks and a scheduler for pacing simulations, replays and monitors.
+
+Code that waits takes a clock instead of calling time.sleep directly:
+
+- RealClock follows the wall clock; sleep() and wait() really wait.
+- VirtualClock only moves when someone waits on it: sleep(60) returns at once
+  with the clock 60 s later, so a ride replays as fast as the CPU allows while
+  every timestamp, cooldown and interval still comes out as in real time.
+
+A clock is also a callable returning monotonic seconds, so it plugs straight
+into the `clock=` parameter of ReplayEngine and AlertDispatcher. time() gives
+epoch seconds (for ride start timestamps); a virtual clock starts at the
+given epoch time, or now.
+
+Scheduler runs callbacks at given clock times, once or repeatedly, and
+replaces hand-written `while ...: work(); time.sleep(1)` loops:
+
+    scheduler = Scheduler(make_clock(virtual=True))
+    scheduler.call_every(1, update_plot)
+    scheduler.run_for(60)
+"""
+
+class Clock:
+    # Monotonic seconds
+    def __call__(self):
+        return self.monotonic()
+
+class RealClock(Clock):
+    virtual = False
+
+    def monotonic(self):
+        return time.monotonic()
+
+    # Epoch seconds
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    # Wait up to `timeout` seconds for event; True if it was set
+    def wait(self, event, timeout):
+        return event.wait(max(0.0, timeout))
+
+class VirtualClock(Clock):
+    virtual = True
+
+    def __init__(self, start_time=None):
+        self.start_time = time.time() if start_time is None else float(start_time)
+        self.elapsed = 0.0
+        self.lock = threading.Lock()
+
+    def monotonic(self):
+        return self.elapsed
+
+    def time(self):
+        return self.start_time + self.elapsed
+
+    # Jump forward instead of waiting. Threads sleeping at the same time share
+    # the jump (the clock ends at the latest wake-up time, not at the sum).
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.advance_to(self.elapsed + seconds)
+
+    def advance_to(self, when):
+        with self.lock:
+            if when > self.elapsed:
+                self.elapsed = when
+
+    def wait(self, event, timeout):
+        if event.is_set():
+            return True
+        self.sleep(timeout)
+        return event.is_set()
+
+# A real clock, or a virtual one starting at start_time (epoch seconds, default now)
+def make_clock(virtual=False, start_time=None):
+    return VirtualClock(start_time) if virtual else RealClock()
+
+# Wait on event with any clock: Clock objects may advance virtually, a plain
+# callable such as time.monotonic means real time
+def wait_event(clock, event, timeout):
+    if isinstance(clock, Clock):
+        return clock.wait(event, timeout)
+    return event.wait(max(0.0, timeout))
+
+# Epoch seconds from a command line value: a number, or an ISO 8601 date and
+# time (local time unless it has an offset)
+def parse_start_time(text):
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise ValueError(f"invalid start time '{text}' (use epoch seconds or YYYY-MM-DDTHH:MM:SS)") from None
+
+class ScheduledCall:
+    __slots__ = ('when', 'interval', 'callback', 'args', 'cancelled')
+
+    def __init__(self, when, interval, callback, args):
+        self.when = when
+        self.interval = interval
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class Scheduler:
+    def __init__(self, clock=None):
+        self.clock = clock or RealClock()
+        self.calls = []  # Heap of (when, sequence number, ScheduledCall)
+        self._sequence = itertools.count()
+        self.lock = threading.Lock()
+        self.missed = 0  # Runs of repeating calls skipped because the callbacks fell behind
+
+    def _push(self, call):
+        with self.lock:
+            heapq.heappush(self.calls, (call.when, next(self._sequence), call))
+        return call
+
+    # Run callback(*args) at clock time `when`
+    def call_at(self, when, callback, *args):
+        return self._push(ScheduledCall(when, None, callback, args))
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self.clock() + delay, callback, *args)
+
+    # Run callback(*args) every `interval` seconds, first after `delay` (default
+    # at once). The schedule does not drift; runs that are already late by a
+    # whole interval are skipped and counted in `missed`.
+    def call_every(self, interval, callback, *args, delay=0.0):
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        return self._push(ScheduledCall(self.clock() + delay, interval, callback, args))
+
+    # Clock time of the next call that is not cancelled, or None
+    def next_due(self):
+        with self.lock:
+            while self.calls and self.calls[0][2].cancelled:
+                heapq.heappop(self.calls)
+            return self.calls[0][0] if self.calls else None
+
+    # Run every call that is due now, without waiting. Returns how many ran.
+    # Calls that fall due while the callbacks run wait for the next pass.
+    def run_pending(self):
+        ran = 0
+        now = self.clock()
+        while True:
+            with self.lock:
+                if not self.calls or self.calls[0][0] > now:
+                    return ran
+                _, _, call = heapq.heappop(self.calls)
+            if call.cancelled:
+                continue
+            call.callback(*call.args)
+            ran += 1
+            if call.interval is not None and not call.cancelled:
+                call.when += call.interval
+                late = self.clock() - call.when
+                if late >= call.interval:
+                    skipped = int(late // call.interval)
+                    self.missed += skipped
+                    call.when += skipped * call.interval
+                self._push(call)
+
+    # Run calls as they fall due until clock time `until` (forever if None), until
+    # nothing is left to run or until stop_event is set
+    def run(self, until=None, stop_event=None):
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            self.run_pending()
+            due = self.next_due()
+            if due is None:
+                return
+            if until is not None and due > until:
+                wait_event(self.clock, stop_event, until - self.clock())
+                return
+            wait_event(self.clock, stop_event, due - self.clock())
+
+    def run_for(self, duration, stop_event=None):
+        self.run(self.clock() + duration, stop_event)
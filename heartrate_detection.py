@@ -0,0 +1,137 @@
+from collections import namedtuple
+from heartrate_bpm import age_groups, get_age_group
+
+"""
+Streaming threshold detection shared by theMonitorApp.py, rideshare.py and
+time-series analysis.py.
+
+Each occupant has an "anxious" and a "control" level. A level only becomes
+active once the heart rate has stayed above its threshold for min_duration
+seconds, and it only clears once the heart rate drops below the threshold
+minus the hysteresis. After an alert, the same level cannot raise another one
+for debounce seconds. Every sample costs the same small amount of work
+however long the ride has been running, because no history is scanned.
+"""
+
+threshold = 140  # Default threshold heart rate for anxiety
+control_threshold = 160  # Default threshold heart rate for control
+control_margin = control_threshold - threshold  # Control threshold above the anxious one for age groups
+hysteresis = 5  # BPM below the threshold before a level clears
+min_duration = 3  # Seconds above the threshold before a level becomes active
+debounce = 30  # Seconds between two alerts for the same occupant and level
+
+OCCUPANTS = ('driver', 'passenger')
+LEVELS = ('anxious', 'control')
+
+AlertEvent = namedtuple('AlertEvent', ['time', 'occupant', 'level', 'kind', 'heart_rate'])
+
+# Thresholds per age group: the anxious threshold is the top of the group's
+# stressed range in heartrate_bpm.age_groups, and control is a fixed margin above it
+age_group_thresholds = {
+    name: {'anxious': ranges['stressed'][1], 'control': ranges['stressed'][1] + control_margin}
+    for name, ranges in age_groups.items()
+}
+default_thresholds = {'anxious': threshold, 'control': control_threshold}
+
+# Thresholds for an age group, falling back to the defaults for unknown groups
+def get_thresholds(age_group=None):
+    return dict(age_group_thresholds.get(age_group, default_thresholds))
+
+# Age group for an age, or None when the age is missing or invalid
+def get_optional_age_group(age, is_driver=False):
+    if age is None:
+        return None
+    try:
+        return get_age_group(int(age), is_driver=is_driver)
+    except ValueError:
+        return None
+
+class ThresholdDetector:
+    def __init__(self, threshold, hysteresis=hysteresis, min_duration=min_duration, debounce=debounce):
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.min_duration = min_duration
+        self.debounce = debounce
+        self.reset()
+
+    def reset(self):
+        self.active = False
+        self.above_since = None
+        self.last_alert = None
+
+    # Feed one sample; returns 'start' when the level becomes active, 'end'
+    # when it clears and None otherwise
+    def update(self, t, value):
+        if self.active:
+            if value < self.threshold - self.hysteresis:
+                self.active = False
+                self.above_since = None
+                return 'end'
+            return None
+
+        if value > self.threshold:
+            if self.above_since is None:
+                self.above_since = t
+            if t - self.above_since >= self.min_duration and (
+                    self.last_alert is None or t - self.last_alert >= self.debounce):
+                self.active = True
+                self.last_alert = t
+                return 'start'
+        else:
+            self.above_since = None
+        return None
+
+class HeartRateDetector:
+    def __init__(self, thresholds=None, hysteresis=hysteresis, min_duration=min_duration, debounce=debounce):
+        # thresholds maps each occupant to {'anxious': bpm, 'control': bpm}
+        thresholds = thresholds or {}
+        self.thresholds = {occupant: thresholds.get(occupant, get_thresholds()) for occupant in OCCUPANTS}
+        self.detectors = {
+            (occupant, level): ThresholdDetector(self.thresholds[occupant][level], hysteresis, min_duration, debounce)
+            for occupant in OCCUPANTS for level in LEVELS
+        }
+
+    # Detector using the thresholds of the driver's and passenger's age groups
+    @classmethod
+    def from_age_groups(cls, driver_age_group=None, passenger_age_group=None, **kwargs):
+        thresholds = {'driver': get_thresholds(driver_age_group), 'passenger': get_thresholds(passenger_age_group)}
+        return cls(thresholds, **kwargs)
+
+    # Detector for the ages ({'driver': age, 'passenger': age}) of a ride; missing
+    # or invalid ages get the default thresholds
+    @classmethod
+    def for_ages(cls, ages=None, **kwargs):
+        ages = ages or {}
+        return cls.from_age_groups(get_optional_age_group(ages.get('driver'), is_driver=True),
+                                   get_optional_age_group(ages.get('passenger')), **kwargs)
+
+    # Detector for a recording, using the ages stored in its header when present
+    @classmethod
+    def for_recording(cls, recording, **kwargs):
+        return cls.for_ages(recording.ages, **kwargs)
+
+    def reset(self):
+        for detector in self.detectors.values():
+            detector.reset()
+
+    # Feed one sample for both occupants and return the resulting alert events
+    def update(self, t, driver_heart_rate, passenger_heart_rate):
+        events = []
+        for occupant, heart_rate in (('driver', driver_heart_rate), ('passenger', passenger_heart_rate)):
+            for level in LEVELS:
+                kind = self.detectors[occupant, level].update(t, heart_rate)
+                if kind is not None:
+                    events.append(AlertEvent(t, occupant, level, kind, heart_rate))
+        return events
+
+    # Feed a chunk of samples (e.g. the rows read since the last poll)
+    def update_many(self, times, driver_data, passenger_data):
+        events = []
+        for t, driver_heart_rate, passenger_heart_rate in zip(times, driver_data, passenger_data):
+            events.extend(self.update(float(t), float(driver_heart_rate), float(passenger_heart_rate)))
+        return events
+
+    # Whether a level is currently active for an occupant, or for either occupant
+    def is_active(self, level='anxious', occupant=None):
+        occupants = OCCUPANTS if occupant is None else (occupant,)
+        return any(self.detectors[name, level].active for name in occupants)
@@ -0,0 +1,192 @@
+import numpy as np
+from heartrate_detection import HeartRateDetector
+
+"""
+Compact per-ride state for the multi-ride dashboard.
+
+Every ride gets a slot (a row) in a set of preallocated arrays: recent driver
+and passenger history, latest and peak heart rates, alarm level and contacted
+flags. As in SampleRingBuffer, each history row is mirrored, so a ride's most
+recent samples are one contiguous view. The "worst rides first" ranking is a
+single np.lexsort over the slot arrays. Only the streaming detectors, which
+carry hysteresis state, are Python objects (one per ride). Their alert events
+are submitted to an optional AlertDispatcher under the ride's id. A ride's
+detector uses the thresholds of its occupants' age groups once their ages are
+known (set_ages, e.g. from the ride table of a fleet shard).
+
+When all max_rides slots are taken, a new ride takes over the slot of the
+ride that has gone longest without samples (preferring rides not in alarm),
+so a busy fleet never stops the dashboard; such rides are counted in evicted.
+"""
+
+ALARM_OK = 0
+ALARM_ANXIOUS = 1
+ALARM_CONTROL = 2
+ALARM_NAMES = {ALARM_OK: 'OK', ALARM_ANXIOUS: 'ANXIOUS', ALARM_CONTROL: 'CONTROL'}
+
+class FleetState:
+    def __init__(self, max_rides=256, capacity=300, alerts=None):
+        self.max_rides = max_rides
+        self.capacity = capacity
+        self.alerts = alerts
+        self.slots = {}
+        self.ride_ids = np.full(max_rides, -1, dtype=np.int64)
+        self.detectors = []
+        self.ages = {}  # Occupant ages of each ride id, when known
+        self.updates = 0  # Number of add/add_many calls so far
+        self.last_update = np.zeros(max_rides, dtype=np.int64)  # Value of updates when each slot last got samples
+        self.evicted = 0  # Rides dropped to make room for new ones
+
+        self.time = np.full((max_rides, 2 * capacity), np.nan)
+        self.driver = np.full((max_rides, 2 * capacity), np.nan, dtype=np.float32)
+        self.passenger = np.full((max_rides, 2 * capacity), np.nan, dtype=np.float32)
+        self.heads = np.zeros(max_rides, dtype=np.int64)
+        self.counts = np.zeros(max_rides, dtype=np.int64)
+
+        self.latest_driver = np.full(max_rides, np.nan, dtype=np.float32)
+        self.latest_passenger = np.full(max_rides, np.nan, dtype=np.float32)
+        self.peak = np.zeros(max_rides, dtype=np.float32)
+        self.alarm = np.zeros(max_rides, dtype=np.int8)
+        self.driver_contacted = np.zeros(max_rides, dtype=bool)
+        self.passenger_contacted = np.zeros(max_rides, dtype=bool)
+        self.response_unit_contacted = np.zeros(max_rides, dtype=bool)
+
+    def __len__(self):
+        return len(self.slots)
+
+    # Set the occupant ages ({'driver': age, 'passenger': age}) of a ride; a ride
+    # that already has a slot gets a new detector with its age-group thresholds
+    def set_ages(self, ride_id, ages):
+        self.ages[ride_id] = dict(ages)
+        slot = self.slots.get(ride_id)
+        if slot is not None:
+            self.detectors[slot] = HeartRateDetector.for_ages(ages)
+            self._update_alarm(slot)
+
+    # Anxious threshold of each occupant of the ride in a slot
+    def anxious_thresholds(self, slot):
+        return {occupant: levels['anxious'] for occupant, levels in self.detectors[slot].thresholds.items()}
+
+    # Slot of a ride, allocating one on first sight (taking over the stalest
+    # ride's slot when all are in use)
+    def slot(self, ride_id):
+        slot = self.slots.get(ride_id)
+        if slot is None:
+            if len(self.slots) < self.max_rides:
+                slot = len(self.slots)
+                self.detectors.append(HeartRateDetector.for_ages(self.ages.get(ride_id)))
+            else:
+                slot = self._evict()
+                self.detectors[slot] = HeartRateDetector.for_ages(self.ages.get(ride_id))
+            self.slots[ride_id] = slot
+            self.ride_ids[slot] = ride_id
+            self.last_update[slot] = self.updates
+        return slot
+
+    # Free the slot of the ride that has gone longest without samples, preferring
+    # rides that are not in alarm; returns the slot
+    def _evict(self):
+        slot = int(np.lexsort((self.last_update, self.alarm != ALARM_OK))[0])
+        del self.slots[int(self.ride_ids[slot])]
+        for rows in (self.time, self.driver, self.passenger):
+            rows[slot] = np.nan
+        self.heads[slot] = self.counts[slot] = 0
+        self.latest_driver[slot] = self.latest_passenger[slot] = np.nan
+        self.peak[slot] = 0
+        self.alarm[slot] = ALARM_OK
+        self.driver_contacted[slot] = self.passenger_contacted[slot] = self.response_unit_contacted[slot] = False
+        self.evicted += 1
+        return slot
+
+    # Add a chunk of samples for one ride; returns the detector's alert events
+    def add(self, ride_id, times, driver_data, passenger_data):
+        self.updates += 1
+        slot = self.slot(ride_id)
+        self.last_update[slot] = self.updates
+        length = len(times)
+        if length == 0:
+            return []
+        skipped = max(0, length - self.capacity)
+        positions = (self.heads[slot] + skipped + np.arange(length - skipped)) % self.capacity
+        for rows, values in ((self.time, times), (self.driver, driver_data), (self.passenger, passenger_data)):
+            values = np.asarray(values)[skipped:]
+            rows[slot, positions] = values
+            rows[slot, positions + self.capacity] = values
+        self.heads[slot] = (self.heads[slot] + length) % self.capacity
+        self.counts[slot] = min(self.counts[slot] + length, self.capacity)
+
+        self.latest_driver[slot] = driver_data[-1]
+        self.latest_passenger[slot] = passenger_data[-1]
+        self.peak[slot] = max(self.peak[slot], np.max(driver_data), np.max(passenger_data))
+
+        events = self.detectors[slot].update_many(times, driver_data, passenger_data)
+        self._update_alarm(slot)
+        if self.alerts is not None:
+            self.alerts.submit_many(events, ride_id)
+        return events
+
+    # Add one sample for each of several different rides with vectorised writes
+    # (the usual case for a replay step or a server frame); returns the alert events
+    def add_many(self, ride_ids, times, driver_data, passenger_data):
+        ride_ids = np.asarray(ride_ids)
+        slots = None
+        if len(np.unique(ride_ids)) == len(ride_ids):
+            self.updates += 1
+            slots = np.array([self.slot(ride_id) for ride_id in ride_ids.tolist()], dtype=np.int64)
+            if len(np.unique(slots)) != len(slots):
+                slots = None  # More new rides than slots: rides of this batch took over each other's slots
+        if slots is None:
+            events = []
+            for index, ride_id in enumerate(ride_ids.tolist()):
+                rows = slice(index, index + 1)
+                events += self.add(ride_id, times[rows], driver_data[rows], passenger_data[rows])
+            return events
+
+        self.last_update[slots] = self.updates
+        positions = self.heads[slots]
+        for rows, values in ((self.time, times), (self.driver, driver_data), (self.passenger, passenger_data)):
+            rows[slots, positions] = values
+            rows[slots, positions + self.capacity] = values
+        self.heads[slots] = (positions + 1) % self.capacity
+        self.counts[slots] = np.minimum(self.counts[slots] + 1, self.capacity)
+
+        self.latest_driver[slots] = driver_data
+        self.latest_passenger[slots] = passenger_data
+        self.peak[slots] = np.fmax(self.peak[slots], np.fmax(driver_data, passenger_data))
+
+        events = []
+        for slot, t, driver_heart_rate, passenger_heart_rate in zip(
+                slots.tolist(), np.asarray(times).tolist(), np.asarray(driver_data).tolist(),
+                np.asarray(passenger_data).tolist()):
+            ride_events = self.detectors[slot].update(t, driver_heart_rate, passenger_heart_rate)
+            self._update_alarm(slot)
+            if ride_events:
+                if self.alerts is not None:
+                    self.alerts.submit_many(ride_events, int(self.ride_ids[slot]))
+                events += ride_events
+        return events
+
+    def _update_alarm(self, slot):
+        detector = self.detectors[slot]
+        if detector.is_active('control'):
+            self.alarm[slot] = ALARM_CONTROL
+        elif detector.is_active('anxious'):
+            self.alarm[slot] = ALARM_ANXIOUS
+        else:
+            self.alarm[slot] = ALARM_OK
+
+    # Views of a ride's recent (time, driver, passenger) samples, oldest first
+    def window(self, slot):
+        end = self.heads[slot] + self.capacity
+        start = end - self.counts[slot]
+        return self.time[slot, start:end], self.driver[slot, start:end], self.passenger[slot, start:end]
+
+    # Slots ordered worst first: highest alarm level, then highest current heart rate
+    def ranking(self):
+        used = len(self.slots)
+        latest = np.fmax(self.latest_driver[:used], self.latest_passenger[:used])
+        return np.lexsort((-np.nan_to_num(latest, nan=-np.inf), -self.alarm[:used]))
+
+    # Slots currently in alarm
+    def alarmed(self):
+        return np.flatnonzero(self.alarm[:len(self.slots)] != ALARM_OK)
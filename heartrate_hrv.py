@@ -0,0 +1,154 @@
+import numpy as np
+
+"""
+Heart rate variability (HRV): beat-to-beat RR-interval simulation and metrics.
+
+The RR intervals of a whole batch of rides are generated at once as a
+NaN-padded (rides x beats) matrix. Beats are placed by integrating a
+per-second heart rate trend (one np.interp call for all rides), then each
+interval is modulated the way a real heart varies:
+
+- respiratory sinus arrhythmia: a sine at the breathing rate (faster and
+  weaker under stress),
+- a slower ~0.1 Hz (Mayer wave) oscillation of blood pressure regulation,
+- white beat-to-beat noise.
+
+The amplitudes come from hrv_profiles by age group and stress state: HRV is
+highest in children, drops with age and is roughly halved under stress.
+The metrics (SDNN, RMSSD and both over fixed windows) are computed with
+np.bincount over all rides and windows together.
+"""
+
+# Target short-term SDNN (ms) and breathing rate (Hz) per age group and state
+hrv_profiles = {
+    'child': {'relaxed': (60.0, 0.30), 'stressed': (30.0, 0.40)},
+    'adult': {'relaxed': (50.0, 0.25), 'stressed': (25.0, 0.35)},
+    'elderly': {'relaxed': (30.0, 0.25), 'stressed': (15.0, 0.33)},
+}
+mayer_frequency = 0.1  # Hz
+# Share of the SDNN target carried by each component (standard deviations, added in quadrature)
+rsa_share = 0.6
+mayer_share = 0.5
+noise_share = 0.6
+hrv_window = 60  # Seconds per window for windowed HRV metrics
+
+# SDNN targets and breathing rates as arrays, one entry per ride
+def get_hrv_profiles(age_group_names, stressed):
+    profiles = np.array([[hrv_profiles[name]['relaxed'], hrv_profiles[name]['stressed']]
+                         for name in age_group_names], dtype=float).reshape(-1, 2, 2)
+    chosen = profiles[np.arange(len(profiles)), np.asarray(stressed, dtype=int)]
+    return chosen[:, 0], chosen[:, 1]
+
+# Nominal beat times for a (rides x samples) heart rate trend sampled every
+# sample_interval seconds: beat k falls where the integrated rate reaches k beats.
+# Returns a NaN-padded (rides x beats) matrix of times in seconds.
+def nominal_beat_times(heart_rate, sample_interval=1.0):
+    heart_rate = np.maximum(np.atleast_2d(np.asarray(heart_rate, dtype=float)), 1.0)
+    rides, samples = heart_rate.shape
+    phase = np.zeros((rides, samples + 1))
+    np.cumsum(heart_rate * (sample_interval / 60), axis=1, out=phase[:, 1:])
+    times = np.arange(samples + 1) * sample_interval
+
+    # Shift every ride's phase past the previous one, so one interp call serves all rides
+    span = np.ceil(phase[:, -1].max()) + 1
+    offsets = np.arange(rides)[:, None] * span
+    beats = np.arange(1, int(span))
+    beat_times = np.interp((beats[None, :] + offsets).ravel(), (phase + offsets).ravel(),
+                           np.tile(times, rides)).reshape(rides, -1)
+    beat_times[beats[None, :] > phase[:, -1:]] = np.nan
+    return beat_times
+
+# Simulate RR intervals (ms) for a (rides x samples) heart rate trend. Returns
+# NaN-padded (rides x beats) matrices of beat times (s) and RR intervals (ms).
+def simulate_rr_intervals(heart_rate, age_group_names, stressed, sample_interval=1.0, seed=None):
+    rng = np.random.default_rng(seed)
+    heart_rate = np.atleast_2d(np.asarray(heart_rate, dtype=float))
+    rides, samples = heart_rate.shape
+    duration = samples * sample_interval
+    sdnn_target, breathing_rate = get_hrv_profiles(age_group_names, stressed)
+
+    # NaN padding stays NaN through the arithmetic below
+    nominal_times = nominal_beat_times(heart_rate, sample_interval)
+    nominal_rr = np.diff(nominal_times, axis=1, prepend=0.0) * 1000
+
+    # The modulation is a few tens of ms, so it is computed in float32, where
+    # np.sin is many times faster. A sine of standard deviation s has amplitude s * sqrt(2).
+    breathing_rate = breathing_rate * rng.uniform(0.9, 1.1, rides)
+    t = nominal_times.astype(np.float32)
+    modulation = rng.standard_normal(t.shape, dtype=np.float32)
+    modulation *= (noise_share * sdnn_target).astype(np.float32)[:, None]
+    for share, frequency in ((rsa_share, breathing_rate[:, None]), (mayer_share, mayer_frequency)):
+        phase = np.float32(2 * np.pi) * np.asarray(frequency, dtype=np.float32) * t
+        phase += rng.uniform(0, 2 * np.pi, (rides, 1)).astype(np.float32)
+        np.sin(phase, out=phase)
+        phase *= (np.sqrt(2) * share * sdnn_target).astype(np.float32)[:, None]
+        modulation += phase
+    rr = np.maximum(nominal_rr + modulation, 250.0)  # At most 240 BPM
+
+    # Beats follow from the modulated intervals; drop those past the end of the ride
+    beat_times = np.cumsum(rr, axis=1) / 1000
+    ended = beat_times > duration
+    rr[ended] = np.nan
+    beat_times[ended] = np.nan
+    return beat_times, rr
+
+# Per-sample heart rate (BPM) from beats: at each sample time the rate of the
+# RR interval in progress (the last complete one after the final beat)
+def heart_rate_from_rr(time, beat_times, rr):
+    beat_times = np.atleast_2d(beat_times)
+    rr = np.atleast_2d(rr)
+    rides, beats = beat_times.shape
+    time = np.asarray(time, dtype=float)
+    if beats == 0:
+        return np.full((rides, len(time)), np.nan)
+    span = (time[-1] if len(time) else 0.0) + np.nanmax(beat_times, initial=0.0) + 1
+    offsets = np.arange(rides)[:, None] * span
+    counts = (~np.isnan(beat_times)).sum(axis=1)
+
+    # Padding sorts after the last beat of its ride and before the next ride
+    flat_times = np.where(np.isnan(beat_times), offsets + span - 0.5, beat_times + offsets).ravel()
+    index = np.searchsorted(flat_times, (time[None, :] + offsets).ravel()).reshape(rides, -1)
+    last = np.arange(rides) * beats + np.maximum(counts - 1, 0)
+    index = np.minimum(index, last[:, None])
+    return 60000 / rr.ravel()[index]
+
+def sdnn(rr, axis=-1):
+    rr = np.asarray(rr, dtype=float)
+    return np.nanstd(rr, axis=axis, ddof=1)
+
+def rmssd(rr, axis=-1):
+    successive = np.diff(np.asarray(rr, dtype=float), axis=axis)
+    return np.sqrt(np.nanmean(successive * successive, axis=axis))
+
+# SDNN, RMSSD and mean heart rate per window of `window` seconds for every ride.
+# Returns a dict of (rides x windows) arrays (NaN for windows with too few beats).
+def windowed_hrv(beat_times, rr, duration, window=hrv_window):
+    beat_times = np.atleast_2d(beat_times)
+    rr = np.atleast_2d(rr)
+    rides = len(rr)
+    windows = max(1, int(np.ceil(duration / window)))
+    valid = ~np.isnan(rr)
+    window_index = np.minimum(np.nan_to_num(beat_times) // window, windows - 1).astype(np.int64)
+    keys = np.arange(rides)[:, None] * windows + window_index
+    size = rides * windows
+
+    values = np.where(valid, rr, 0.0)
+    count = np.bincount(keys[valid], minlength=size)
+    total = np.bincount(keys[valid], values[valid], minlength=size)
+    total_squares = np.bincount(keys[valid], values[valid] ** 2, minlength=size)
+
+    # Successive differences only count within one window
+    pairs = valid[:, 1:] & valid[:, :-1] & (keys[:, 1:] == keys[:, :-1])
+    differences = np.diff(values, axis=1)[pairs]
+    pair_count = np.bincount(keys[:, 1:][pairs], minlength=size)
+    pair_squares = np.bincount(keys[:, 1:][pairs], differences ** 2, minlength=size)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / count
+        variance = (total_squares - count * mean * mean) / (count - 1)
+        result = {
+            'sdnn': np.where(count > 1, np.sqrt(np.maximum(variance, 0.0)), np.nan),
+            'rmssd': np.where(pair_count > 0, np.sqrt(pair_squares / pair_count), np.nan),
+            'heart_rate': np.where(count > 0, 60000 / mean, np.nan),
+        }
+    return {name: values.reshape(rides, windows) for name, values in result.items()}
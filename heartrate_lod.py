@@ -0,0 +1,108 @@
+import numpy as np
+
+"""
+Level-of-detail downsampling for plotting long heart rate series.
+
+A line never needs more than a few points per pixel column. LodPyramid
+precomputes, once per series, the index of the minimum and maximum sample of
+every block of 2, 4, 8, ... samples (each level is built from the one below,
+so the whole pyramid costs O(n)). A view of any time range then picks the
+level whose blocks are about one pixel wide and returns only the min and max
+sample of each block, in time order: between 2 and 4 points per pixel
+whatever the zoom. Because the extremes of every block are kept, peaks and
+threshold crossings stay visible exactly as in the full-resolution line.
+
+LodLine draws a series through a pyramid and recomputes its points whenever
+the x-limits change, so zooming and panning stay fast on multi-hour rides;
+set_data swaps in another series without creating a new artist. Times must
+be increasing.
+"""
+
+min_blocks = 64  # The coarsest level still has at least this many blocks
+default_pixels = 1000  # Pixel width assumed before a line is on a drawn axis
+
+class LodPyramid:
+    def __init__(self, x, y):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        # levels[k] holds the argmin and argmax sample indices of every block of 2 ** (k + 1) samples
+        self.levels = []
+        mins = maxes = np.arange(len(self.y))
+        while len(mins) > min_blocks:
+            if len(mins) % 2:
+                # The last block is shorter; repeat its last index to make a pair
+                mins = np.append(mins, mins[-1])
+                maxes = np.append(maxes, maxes[-1])
+            left, right = mins[0::2], mins[1::2]
+            mins = np.where(self.y[right] < self.y[left], right, left)
+            left, right = maxes[0::2], maxes[1::2]
+            maxes = np.where(self.y[right] > self.y[left], right, left)
+            self.levels.append((mins, maxes))
+
+    def __len__(self):
+        return len(self.y)
+
+    # Sample indices to draw between x_min and x_max on a line `pixels` wide,
+    # plus one sample beyond each end so the line reaches the axis edges
+    def view_indices(self, x_min, x_max, pixels=default_pixels):
+        length = len(self.x)
+        start = max(0, int(np.searchsorted(self.x, x_min, 'left')) - 1)
+        stop = min(length, int(np.searchsorted(self.x, x_max, 'right')) + 1)
+        count = stop - start
+        pixels = max(1, int(pixels))
+        if count <= 2 * pixels or not self.levels:
+            return np.arange(start, stop)
+
+        level = min(int(np.log2(count / pixels)), len(self.levels))
+        size = 2 ** level
+        mins, maxes = self.levels[level - 1]
+        first, last = start // size, (stop - 1) // size + 1
+        blocks = np.stack([mins[first:last], maxes[first:last]])
+        indices = np.concatenate([[start], blocks.min(axis=0), blocks.max(axis=0), [stop - 1]])
+        return np.unique(np.clip(indices, start, stop - 1))
+
+    def view(self, x_min, x_max, pixels=default_pixels):
+        indices = self.view_indices(x_min, x_max, pixels)
+        return self.x[indices], self.y[indices]
+
+# Downsample a whole series to about `pixels` columns with min/max per bucket
+def minmax_downsample(x, y, pixels=default_pixels):
+    pyramid = LodPyramid(x, y)
+    if not len(pyramid):
+        return pyramid.x, pyramid.y
+    return pyramid.view(pyramid.x[0], pyramid.x[-1], pixels)
+
+class LodLine:
+    # Plot y against x on ax like ax.plot(x, y, *args, **kwargs), drawing only the
+    # points the current x-limits and axis width need
+    def __init__(self, ax, x, y, *args, **kwargs):
+        self.ax = ax
+        self.pyramid = LodPyramid(x, y)
+        if len(self.pyramid):
+            x, y = self.pyramid.view(self.pyramid.x[0], self.pyramid.x[-1], self.pixels())
+        else:
+            x, y = self.pyramid.x, self.pyramid.y
+        self.line, = ax.plot(x, y, *args, **kwargs)
+        # A plain function is held strongly by the callback registry, which keeps this object alive
+        ax.callbacks.connect('xlim_changed', lambda ax: self.update())
+
+    # Width of the axis in display pixels
+    def pixels(self):
+        return max(1, self.ax.get_window_extent().width) if self.ax.figure is not None else default_pixels
+
+    # Show a new series on the same line (a new pyramid, the same artist)
+    def set_data(self, x, y):
+        self.pyramid = LodPyramid(x, y)
+        if len(self.pyramid):
+            self.line.set_data(*self.pyramid.view(self.pyramid.x[0], self.pyramid.x[-1], self.pixels()))
+        else:
+            self.line.set_data([], [])
+
+    def update(self):
+        if len(self.pyramid):
+            x_min, x_max = sorted(self.ax.get_xlim())
+            self.line.set_data(*self.pyramid.view(x_min, x_max, self.pixels()))
+
+# Convenience wrapper returning the matplotlib line, like ax.plot
+def plot_lod(ax, x, y, *args, **kwargs):
+    return LodLine(ax, x, y, *args, **kwargs).line
@@ -0,0 +1,163 @@
+import bisect
+import json
+import time
+from contextlib import nullcontext
+
+"""
+Lightweight timing and counters for the monitor hot paths.
+
+PerfCounters keeps one latency histogram per stage (e.g. load, detect, draw),
+plus plain counters (dropped frames) and gauges (queue depth, with their
+maximum). Histograms use fixed power-of-two buckets from 10 us to about 10 s,
+so recording a latency is one bisect and an increment, and percentiles are
+read from the buckets (accurate to a factor of two, the exact maximum is
+kept as well).
+
+    perf = PerfCounters(enabled=True)
+    with perf.stage('draw'):
+        ...
+    perf.export('perf.json')
+
+With enabled=False every method returns at once and stage() hands out a
+shared no-op context manager, so the calls can stay in the hot paths.
+"""
+
+LATENCY_BUCKETS = tuple(1e-5 * 2 ** i for i in range(21))  # Upper bucket edges in seconds
+PERCENTILES = (50, 95, 99)
+
+class LatencyHistogram:
+    def __init__(self, edges=LATENCY_BUCKETS):
+        self.edges = edges
+        self.counts = [0] * (len(edges) + 1)  # The last bucket holds everything above the largest edge
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(self.edges, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    # Upper edge of the bucket holding the q-th percentile (the maximum for the last bucket)
+    def percentile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.edges[index], self.max) if index < len(self.edges) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'max': self.max,
+            **{f'p{q}': self.percentile(q) for q in PERCENTILES},
+            'buckets': {f'{edge:.6g}': count for edge, count in zip(self.edges + (float('inf'),), self.counts)
+                        if count},
+        }
+
+class _Stage:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.record(time.perf_counter() - self.start)
+        return False
+
+_NULL_STAGE = nullcontext()
+
+class PerfCounters:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}  # name -> [last value, maximum]
+        self.started = time.perf_counter()
+        self._last_frame = None
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = LatencyHistogram()
+        return histogram
+
+    # Context manager timing one pass through a stage
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self.histogram(name))
+
+    def record(self, name, seconds):
+        if self.enabled:
+            self.histogram(name).record(seconds)
+
+    def increment(self, name, amount=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge(self, name, value):
+        if not self.enabled:
+            return
+        gauge = self.gauges.get(name)
+        if gauge is None:
+            self.gauges[name] = [value, value]
+        else:
+            gauge[0] = value
+            if value > gauge[1]:
+                gauge[1] = value
+
+    # Call once per frame of a loop scheduled every `interval` seconds. Records the
+    # actual frame interval and counts a dropped frame for every whole interval missed.
+    def frame(self, interval):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if self._last_frame is not None:
+            elapsed = now - self._last_frame
+            self.histogram('frame_interval').record(elapsed)
+            missed = int(elapsed / interval) - 1
+            if missed > 0:
+                self.increment('dropped_frames', missed)
+        self._last_frame = now
+
+    # Short text for a status panel: one line per stage, then the counters and gauges
+    def summary_lines(self):
+        lines = []
+        for name, histogram in self.histograms.items():
+            lines.append(f"{name}: p50 {histogram.percentile(50) * 1000:.2f} ms, "
+                         f"p95 {histogram.percentile(95) * 1000:.2f} ms, "
+                         f"max {histogram.max * 1000:.2f} ms ({histogram.count})")
+        for name, (value, maximum) in self.gauges.items():
+            lines.append(f"{name.replace('_', ' ')}: {value} (max {maximum})")
+        for name, value in self.counters.items():
+            lines.append(f"{name.replace('_', ' ')}: {value}")
+        return lines
+
+    def to_dict(self):
+        return {
+            'elapsed': time.perf_counter() - self.started,
+            'stages': {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+            'counters': dict(self.counters),
+            'gauges': {name: {'last': value, 'max': maximum} for name, (value, maximum) in self.gauges.items()},
+        }
+
+    # Write the counters as JSON
+    def export(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.to_dict(), file, indent=2)
@@ -0,0 +1,84 @@
+"""
+Blitted line rendering for live heart rate plots.
+
+The line artists are created once and marked as animated, so a normal canvas
+draw renders only the static parts (axes, ticks, titles, legends, threshold
+lines). That background is cached after every full draw. A frame then only
+restores the background, updates the lines with set_data, draws them and
+blits the figure. A full redraw is needed only when the data leaves the
+current axis limits. The x-axis scrolls in steps of a quarter of the visible
+span, so this happens rarely.
+"""
+
+class BlitRenderer:
+    def __init__(self, fig, canvas, x_span=60, y_limits=(40, 200)):
+        self.fig = fig
+        self.canvas = canvas
+        self.x_span = x_span
+        self.y_limits = y_limits
+        self.lines = []
+        self.background = None
+        self.full_draws = 0
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    # Create an (initially empty) animated line on ax and register it with the renderer
+    def add_line(self, ax, *args, **kwargs):
+        line, = ax.plot([], [], *args, animated=True, **kwargs)
+        ax.set_xlim(0, self.x_span)
+        ax.set_ylim(*self.y_limits)
+        self.lines.append(line)
+        return line
+
+    # A full draw just happened: cache the static background and put the lines back on top
+    def _on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.full_draws += 1
+        self._draw_lines()
+
+    def _draw_lines(self):
+        for line in self.lines:
+            line.axes.draw_artist(line)
+
+    # Widen the axis limits of ax when the lines on it no longer fit. Returns
+    # True if a limit changed (and the background must be redrawn).
+    def _fit_limits(self, ax, x_max, y_min, y_max):
+        changed = False
+        x_low, x_high = ax.get_xlim()
+        if x_max > x_high:
+            step = self.x_span / 4
+            x_high = x_high + step * -(-(x_max - x_high) // step)
+            ax.set_xlim(max(0, x_high - self.x_span), x_high)
+            changed = True
+        y_low, y_high = ax.get_ylim()
+        if y_min < y_low or y_max > y_high:
+            ax.set_ylim(min(y_low, y_min - 5), max(y_high, y_max + 5))
+            changed = True
+        return changed
+
+    # Reset every axis to its initial limits (e.g. when a replay starts over)
+    def reset_limits(self):
+        for ax in {line.axes for line in self.lines}:
+            ax.set_xlim(0, self.x_span)
+            ax.set_ylim(*self.y_limits)
+        self.background = None
+
+    # Draw one frame. data maps each line to its (x, y) arrays.
+    def update(self, data):
+        extents = {}
+        for line, (x, y) in data.items():
+            line.set_data(x, y)
+            if len(x):
+                x_max, y_min, y_max = extents.get(line.axes, (x[-1], y.min(), y.max()))
+                extents[line.axes] = (max(x_max, x[-1]), min(y_min, y.min()), max(y_max, y.max()))
+
+        rescaled = False
+        for ax, (x_max, y_min, y_max) in extents.items():
+            rescaled = self._fit_limits(ax, x_max, y_min, y_max) or rescaled
+
+        if rescaled or self.background is None:
+            # The draw_event handler caches the new background and draws the lines
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.background)
+            self._draw_lines()
+        self.canvas.blit(self.fig.bbox)
@@ -0,0 +1,179 @@
+import threading
+import time
+import numpy as np
+from heartrate_clock import wait_event
+
+"""
+Seekable replay of stored rides.
+
+TimeIndex finds the first sample at or after any timestamp in O(1): for a
+regular sample rate it is plain arithmetic, otherwise a table of bucket start
+positions (one bucket per typical sample interval, built once with a single
+np.searchsorted) narrows the search to the few samples of one bucket.
+
+ReplayEngine maps playback (wall-clock) time to ride time. Playback is
+anchored at a (wall time, ride time) pair and ride time advances at `speed`
+times the wall clock; seeking or changing the speed only moves the anchor, so
+both are O(1) and never scan the recording. due() returns the samples that
+have become due since the last call. With speed=None the replay runs as fast
+as the consumer takes the samples. At the end the replay loops to the start
+or stops. The clock may be a heartrate_clock clock: with a VirtualClock the
+waits between samples take no real time.
+"""
+
+SPEEDS = (1, 10, 100, None)  # Speeds offered by the monitor; None is as fast as possible
+max_chunk = 4096  # Samples returned by one due() call when running as fast as possible
+
+class TimeIndex:
+    def __init__(self, times, sample_rate=None):
+        self.times = np.asarray(times, dtype=float)
+        self.start = float(self.times[0]) if len(self.times) else 0.0
+        self.end = float(self.times[-1]) if len(self.times) else 0.0
+        self.sample_rate = sample_rate
+        self.buckets = None
+        if len(self.times) > 1 and not self._is_regular():
+            self.bucket_width = max(float(np.median(np.diff(self.times))), 1e-9)
+            count = int((self.end - self.start) / self.bucket_width) + 2
+            self.buckets = np.searchsorted(self.times, self.start + np.arange(count) * self.bucket_width)
+
+    def __len__(self):
+        return len(self.times)
+
+    # True if sample i sits exactly at start + i / sample_rate
+    def _is_regular(self):
+        if not self.sample_rate:
+            return False
+        expected = self.start + np.arange(len(self.times)) / self.sample_rate
+        return np.allclose(self.times, expected, rtol=0, atol=1e-9 * max(1.0, abs(self.end)))
+
+    # Index of the first sample at or after time t (len(self) if there is none)
+    def seek(self, t):
+        length = len(self.times)
+        if length == 0 or t <= self.start:
+            return 0
+        if t > self.end:
+            return length
+        if self.buckets is None:
+            if self.sample_rate:
+                return min(length, int(np.ceil((t - self.start) * self.sample_rate - 1e-9)))
+            return 1  # A single sample
+        index = int(self.buckets[min(int((t - self.start) / self.bucket_width), len(self.buckets) - 1)])
+        while index < length and self.times[index] < t:
+            index += 1
+        return index
+
+    # Index of the first sample strictly after time t
+    def seek_after(self, t):
+        index = self.seek(t)
+        length = len(self.times)
+        while index < length and self.times[index] <= t:
+            index += 1
+        return index
+
+class ReplayEngine:
+    def __init__(self, times, sample_rate=None, speed=1.0, loop=True, clock=time.monotonic):
+        self.index = times if isinstance(times, TimeIndex) else TimeIndex(times, sample_rate)
+        self.clock = clock
+        self.loop = loop
+        self.lock = threading.Lock()
+        self.speed = speed
+        self.position = 0  # Next sample to emit
+        self.paused = False
+        self.finished = False
+        self.restarted = True  # Set when the consumer should start from an empty history
+        self._anchor(self.index.start)
+
+    # Playback continues from ride time t as of now
+    def _anchor(self, ride_time):
+        self.anchor_wall = self.clock()
+        self.anchor_ride = ride_time
+
+    # Ride time the playback has reached
+    def ride_time(self):
+        with self.lock:
+            return self._current_time()
+
+    def _ride_time(self):
+        if self.paused or not self.speed:
+            return self.anchor_ride
+        return self.anchor_ride + (self.clock() - self.anchor_wall) * self.speed
+
+    # Jump to ride time t; the samples before it are skipped
+    def seek(self, t):
+        with self.lock:
+            self.position = self.index.seek(t)
+            self.finished = False
+            self.restarted = True
+            self._anchor(t)
+
+    # Change the speed (None for as fast as possible) without a jump in ride time
+    def set_speed(self, speed):
+        with self.lock:
+            self._anchor(self._current_time())
+            self.speed = speed
+
+    def pause(self):
+        with self.lock:
+            if not self.paused:
+                self._anchor(self._current_time())
+                self.paused = True
+
+    def resume(self):
+        with self.lock:
+            if self.paused:
+                self.paused = False
+                self._anchor(self.anchor_ride)
+
+    # Ride time of playback, or of the next sample when running as fast as possible
+    def _current_time(self):
+        if not self.speed and not self.paused:
+            return self.index.times[self.position] if self.position < len(self.index) else self.index.end
+        return self._ride_time()
+
+    # Samples that became due since the last call, as (start, stop, restarted).
+    # restarted is True for the first chunk after a seek or a loop.
+    def due(self):
+        with self.lock:
+            if self.finished or self.paused:
+                return self.position, self.position, False
+            start = self.position
+            if self.speed:
+                stop = self.index.seek_after(self._ride_time())
+            else:
+                stop = min(start + max_chunk, len(self.index))
+            self.position = stop
+            restarted, self.restarted = self.restarted, False
+
+            if stop >= len(self.index):
+                if self.loop:
+                    self.position = 0
+                    self.restarted = True
+                    self._anchor(self.index.start)
+                else:
+                    self.finished = True
+            return start, stop, restarted
+
+    # Seconds until the next sample is due (0 when running as fast as possible)
+    def wait_time(self, limit=0.1):
+        with self.lock:
+            if self.finished or self.paused:
+                return limit
+            if not self.speed:
+                return 0.0
+            if self.position >= len(self.index):
+                return 0.0
+            ahead = (self.index.times[self.position] - self._ride_time()) / self.speed
+            return min(limit, max(0.0, ahead))
+
+    # Replay on the calling thread until stop_event is set or the replay ends,
+    # calling emit(start, stop, restarted) for every chunk of due samples
+    def run(self, emit, stop_event, limit=0.1):
+        while not stop_event.is_set():
+            start, stop, restarted = self.due()
+            if stop > start or restarted:
+                emit(start, stop, restarted)
+            if self.finished:
+                return
+            wait = self.wait_time(limit)
+            if wait and wait_event(self.clock, stop_event, wait):
+                return
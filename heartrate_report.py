@@ -0,0 +1,321 @@
+import argparse
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import numpy as np
+from heartrate_analytics import rolling_mean, window_size
+from heartrate_detection import OCCUPANTS, HeartRateDetector, threshold
+from heartrate_lod import LodLine
+from heartrate_spectral import SpectralConfig, stft
+from heartrate_storage import load_heart_rate_data
+
+"""
+Per-ride report figures, drawn headless for a whole day of rides and reused
+by the interactive plots.
+
+RideReport builds its figure, axes, lines, legends and spectrogram images
+once; update() only swaps the data into the existing artists (set_data on
+the lines, which are downsampled to the axis width as in heartrate_lod, and
+set_data on the images) and rescales the axes. The same figure is then saved
+or redrawn for every ride, so there is no per-ride figure to leak and no
+layout to recompute. Without a figure it draws on a plain Agg canvas, so
+neither pyplot nor a display is involved.
+
+render_reports writes a PNG and/or SVG report for every ride of a set of
+files across a process pool. Each worker owns one RideReport for its whole
+life; .hrb shards are memory-mapped and split into jobs of rides_per_job
+rides, so only file names and ride ids travel to the workers and only output
+names come back. At most two jobs per worker are queued at any time, which
+keeps memory bounded however many rides there are.
+
+    python heartrate_report.py fleet/ --output-dir reports --format png svg --incidents
+"""
+
+# Panels of the report, two per row
+REPORT_PANELS = ('driver', 'passenger', 'smoothed', 'both_high', 'driver_spectrogram', 'passenger_spectrogram')
+REPORT_FORMATS = ('png', 'svg')
+report_size = (10, 9)  # Inches
+report_dpi = 100
+rides_per_job = 32  # Rides of one shard rendered by one worker task
+
+class RideReport:
+    def __init__(self, fig=None, panels=REPORT_PANELS, figsize=report_size, dpi=report_dpi):
+        if fig is None:
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            from matplotlib.figure import Figure
+
+            fig = Figure(figsize=figsize, dpi=dpi)
+            FigureCanvasAgg(fig)
+        self.fig = fig
+        self.panels = tuple(panels)
+        axs = fig.subplots(-(-len(self.panels) // 2), 2, squeeze=False).ravel()
+        for ax in axs[len(self.panels):]:
+            ax.set_visible(False)
+        self.title = fig.suptitle('Ride')  # Placeholder so the layout leaves room for titles
+        self.lines = []  # (LodLine, series name)
+        self.markers = []  # (Line2D, occupant) of the both_high panel
+        self.images = []  # (AxesImage, occupant index)
+        self.series_axes = []  # Axes whose limits follow the data
+        self.threshold_lines = []  # (Line2D, occupant) of the anxious thresholds
+        self.spectral_config = None
+        for ax, panel in zip(axs, self.panels):
+            getattr(self, f'_add_{panel}')(ax)
+        self.renders = 0
+
+        # The layout is computed once, with limits like those of a typical ride
+        for ax in self.series_axes:
+            ax.set_xlim(0, 6 * 60, auto=None)
+            ax.set_ylim(40, 200, auto=None)
+        fig.tight_layout()
+        fig.set_layout_engine('none')  # Otherwise every savefig draws the figure twice
+
+    # Axes of heart rate series with the anxious threshold of each occupant shown
+    def _add_series_axes(self, ax, occupants=OCCUPANTS, xlabel='Time (seconds)'):
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel('Heart Rate (BPM)')
+        for occupant, color in zip(occupants, ('r', 'm')):
+            label = 'Anxious threshold BPM' if len(occupants) == 1 else f'{occupant.title()} anxious threshold BPM'
+            line = ax.axhline(y=threshold, color=color, linestyle='--', label=label)
+            self.threshold_lines.append((line, occupant))
+        self.series_axes.append(ax)
+
+    def _add_line(self, ax, name, label):
+        self.lines.append((LodLine(ax, [], [], label=label), name))
+
+    def _add_driver(self, ax):
+        self._add_line(ax, 'driver', 'Driver')
+        self._add_series_axes(ax, ('driver',))
+        ax.legend(loc='upper right')
+
+    def _add_passenger(self, ax):
+        self._add_line(ax, 'passenger', 'Passenger')
+        self._add_series_axes(ax, ('passenger',))
+        ax.legend(loc='upper right')
+
+    def _add_smoothed(self, ax):
+        self._add_line(ax, 'driver_smooth', 'Driver (Smoothed)')
+        self._add_line(ax, 'passenger_smooth', 'Passenger (Smoothed)')
+        self._add_series_axes(ax)
+        ax.legend(loc='upper right')
+
+    def _add_combined(self, ax):
+        self._add_line(ax, 'driver', 'Driver')
+        self._add_line(ax, 'passenger', 'Passenger')
+        self._add_series_axes(ax)
+        ax.legend(loc='upper right')
+
+    # Samples where both occupants are above their thresholds
+    def _add_both_high(self, ax):
+        for occupant, style in zip(OCCUPANTS, ('ro', 'go')):
+            marker, = ax.plot([], [], style, label=f'High BPM ({occupant.title()})')
+            self.markers.append((marker, occupant))
+        self._add_series_axes(ax)
+        ax.legend(loc='upper right')
+
+    def _add_spectrogram(self, ax, index):
+        image = ax.imshow(np.zeros((1, 1)), aspect='auto', origin='lower', interpolation='nearest')
+        ax.set_title(f'{OCCUPANTS[index].title()} spectrogram')
+        ax.set_xlabel('Time (seconds)')
+        ax.set_ylabel('Frequency (Hz)')
+        self.images.append((image, index))
+
+    def _add_driver_spectrogram(self, ax):
+        self._add_spectrogram(ax, OCCUPANTS.index('driver'))
+
+    def _add_passenger_spectrogram(self, ax):
+        self._add_spectrogram(ax, OCCUPANTS.index('passenger'))
+
+    # Show a ride: times in seconds and the driver and passenger heart rates.
+    # thresholds maps occupants to their anxious threshold in BPM (see
+    # anxious_thresholds); occupants not in it use the default threshold.
+    def update(self, time, driver_data, passenger_data, title='', sample_rate=1.0, thresholds=None):
+        time = np.asarray(time, dtype=float)
+        values = {'driver': np.asarray(driver_data, dtype=float),
+                  'passenger': np.asarray(passenger_data, dtype=float)}
+        series = {name: (time, data) for name, data in values.items()}
+        for occupant, data in values.items():
+            # Moving average ('valid' part only, as in timeseries_analysis)
+            series[f'{occupant}_smooth'] = (time[window_size - 1:], rolling_mean(data, window_size)[window_size - 1:])
+        for lod_line, name in self.lines:
+            lod_line.set_data(*series[name])
+
+        thresholds = {occupant: (thresholds or {}).get(occupant, threshold) for occupant in OCCUPANTS}
+        for line, occupant in self.threshold_lines:
+            line.set_ydata([thresholds[occupant]] * 2)
+
+        if self.markers:
+            both_high = (values['driver'] > thresholds['driver']) & (values['passenger'] > thresholds['passenger'])
+            for marker, occupant in self.markers:
+                marker.set_data(time[both_high], values[occupant][both_high])
+
+        for ax in self.series_axes:
+            ax.relim()
+            ax.autoscale_view(scalex=False)
+            if len(time) > 1:
+                ax.set_xlim(time[0], time[-1])
+
+        if self.images:
+            self._update_spectrograms(time, values, sample_rate)
+        self.title.set_text(title)
+
+    def _update_spectrograms(self, time, values, sample_rate):
+        if self.spectral_config is None or self.spectral_config.sample_rate != sample_rate:
+            self.spectral_config = SpectralConfig(sample_rate=sample_rate)
+        config = self.spectral_config
+        frequencies, frame_times, psd = stft(np.stack([values[occupant] for occupant in OCCUPANTS]), config=config)
+        for image, index in self.images:
+            image.set_visible(len(frame_times) > 0)
+            if not len(frame_times):
+                continue
+            # Power in dB; each frame covers hop samples around its centre time
+            image.set_data(10 * np.log10(psd[index].T + 1e-12))
+            half_hop = config.hop / config.sample_rate / 2
+            half_bin = config.sample_rate / config.nfft / 2
+            image.set_extent((time[0] + frame_times[0] - half_hop, time[0] + frame_times[-1] + half_hop,
+                              frequencies[0] - half_bin, frequencies[-1] + half_bin))
+            image.autoscale()
+
+    # Save the current ride (format from the file name unless given)
+    def save(self, path, format=None):
+        self.fig.savefig(path, format=format)
+        self.renders += 1
+
+# Rides of a recording as (ride id, recording) pairs; a recording without a
+# ride table is one ride with id 0
+def iter_rides(recording, ride_ids=None):
+    rides = [(ride['ride_id'], ride_recording) for ride, ride_recording in recording.rides()] or [(0, recording)]
+    if ride_ids is not None:
+        wanted = set(ride_ids)
+        rides = [(ride_id, ride_recording) for ride_id, ride_recording in rides if ride_id in wanted]
+    return rides
+
+# Anxious threshold of each occupant of a recording, from the age groups of
+# the ages in its header (the default threshold without them)
+def anxious_thresholds(recording):
+    thresholds = HeartRateDetector.for_recording(recording).thresholds
+    return {occupant: thresholds[occupant]['anxious'] for occupant in OCCUPANTS}
+
+# Whether either occupant went above their anxious threshold during the ride
+def is_incident(recording, thresholds=None):
+    thresholds = thresholds or anxious_thresholds(recording)
+    return any(np.nanmax(recording[occupant], initial=-np.inf) > thresholds[occupant] for occupant in OCCUPANTS)
+
+def report_name(path, ride_id, format):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return f'{stem}-ride{ride_id:05d}.{format}'
+
+# Render the reports of some rides of one file with `report`. Returns
+# (path, [(ride id, output files)], error message or None).
+def render_file(report, path, ride_ids, output_dir, formats=('png',), incidents_only=False):
+    try:
+        recording = load_heart_rate_data(path)
+        written = []
+        for ride_id, ride_recording in iter_rides(recording, ride_ids):
+            thresholds = anxious_thresholds(ride_recording)
+            if incidents_only and not is_incident(ride_recording, thresholds):
+                continue
+            report.update(ride_recording.time, ride_recording['driver'], ride_recording['passenger'],
+                          f'{os.path.basename(path)}, ride {ride_id}', ride_recording.sample_rate, thresholds)
+            outputs = [os.path.join(output_dir, report_name(path, ride_id, format)) for format in formats]
+            for output in outputs:
+                report.save(output)
+            written.append((ride_id, outputs))
+        return path, written, None
+    except (OSError, ValueError, KeyError) as e:
+        return path, [], str(e)
+
+# The report of a worker process, created once by its initializer
+_worker_report = None
+
+def _init_worker(panels, figsize, dpi):
+    global _worker_report
+    _worker_report = RideReport(panels=panels, figsize=figsize, dpi=dpi)
+
+def _render_job(job):
+    return render_file(_worker_report, *job)
+
+# Jobs for the given files: .hrb shards are split into groups of rides (their
+# ride table is read from the memory-mapped header), other files are one job
+def make_jobs(paths, output_dir, formats, incidents_only=False, group_size=rides_per_job):
+    jobs = []
+    for path in paths:
+        ride_ids = None
+        if path.endswith('.hrb'):
+            try:
+                ride_ids = [ride['ride_id'] for ride in load_heart_rate_data(path).header.get('rides', [])]
+            except (OSError, ValueError):
+                pass
+        if not ride_ids:
+            jobs.append((path, None, output_dir, formats, incidents_only))
+            continue
+        for start in range(0, len(ride_ids), group_size):
+            jobs.append((path, ride_ids[start:start + group_size], output_dir, formats, incidents_only))
+    return jobs
+
+# Render reports for every ride of the given files into output_dir across a
+# process pool (in this process with one worker). progress(path, written,
+# error) is called as each job finishes. Returns the list of job results.
+def render_reports(paths, output_dir, formats=('png',), num_workers=None, incidents_only=False,
+                   panels=REPORT_PANELS, figsize=report_size, dpi=report_dpi, progress=None):
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = make_jobs(paths, output_dir, tuple(formats), incidents_only)
+    num_workers = max(1, min(num_workers or os.cpu_count() or 1, len(jobs) or 1))
+    results = []
+
+    def finished(result):
+        results.append(result)
+        if progress is not None:
+            progress(*result)
+
+    if num_workers == 1:
+        report = RideReport(panels=panels, figsize=figsize, dpi=dpi)
+        for job in jobs:
+            finished(render_file(report, *job))
+        return results
+
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker,
+                             initargs=(panels, figsize, dpi)) as executor:
+        pending = set()
+        for job in jobs:
+            if len(pending) >= 2 * num_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished(future.result())
+            pending.add(executor.submit(_render_job, job))
+        for future in wait(pending).done:
+            finished(future.result())
+    return results
+
+def main():
+    from heartrate_batch import find_ride_files
+
+    parser = argparse.ArgumentParser(description="Render a report figure for every ride in heart rate files.")
+    parser.add_argument('paths', nargs='+', help="ride files or directories to search for ride files")
+    parser.add_argument('--output-dir', default='reports', help="directory for the report files")
+    parser.add_argument('--format', nargs='+', choices=REPORT_FORMATS, default=['png'], help="report file formats")
+    parser.add_argument('--workers', type=int, help="number of worker processes (default: CPU count)")
+    parser.add_argument('--incidents', action='store_true',
+                        help="only rides where an occupant went above the anxious threshold of their "
+                             f"age group ({threshold} BPM without ages)")
+    parser.add_argument('--dpi', type=int, default=report_dpi, help="resolution of PNG reports")
+    args = parser.parse_args()
+
+    paths = []
+    for path in args.paths:
+        if not os.path.exists(path):
+            parser.error(f"{path} does not exist")
+        paths.extend(find_ride_files(path) if os.path.isdir(path) else [path])
+    if not paths:
+        parser.error("no ride files found")
+
+    def progress(path, written, error):
+        if error is not None:
+            print(f"Skipped {path}: {error}", file=sys.stderr)
+
+    results = render_reports(paths, args.output_dir, args.format, args.workers, args.incidents,
+                             dpi=args.dpi, progress=progress)
+    rides = sum(len(written) for _, written, _ in results)
+    print(f"Rendered {rides} ride reports from {len(paths)} files into {args.output_dir}.", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
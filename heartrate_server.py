@@ -0,0 +1,326 @@
+import argparse
+import asyncio
+import struct
+import time
+from collections import deque
+import numpy as np
+from heartrate_buffer import SampleRingBuffer
+from heartrate_detection import HeartRateDetector
+
+"""
+Asyncio ingestion service for live heart rate samples from many vehicles.
+
+Wire protocol (little-endian): a frame is a 4-byte header, the magic 0x4852
+('HR') as uint16 followed by the record count as uint16, then that many
+24-byte records of ride_id (uint32), seq (uint32), time (float64, seconds
+since the start of the ride), passenger and driver heart rate (float32). Over
+TCP frames are sent back to back on the stream; over UDP every datagram holds
+exactly one frame, of at most MAX_RECORDS_PER_DATAGRAM records.
+
+Samples are routed to one RideState per ride id, which keeps a ring buffer of
+recent samples, its latest alert events and a streaming detector (with the
+thresholds of the occupants' age groups when their ages were registered with
+set_ride_ages, e.g. from a fleet spec). A frame costs work proportional to its
+number of records, so latency stays bounded however many rides are connected.
+Rides that send nothing for ride_timeout seconds are dropped, so a long-running
+server does not keep every ride it has ever seen. Listeners (e.g. the monitor)
+are called with every decoded chunk.
+
+Run `python heartrate_server.py serve` for the server and
+`python heartrate_server.py loadgen --rides 200` for a local load generator
+built on the heartrate_bpm simulator.
+"""
+
+FRAME_MAGIC = 0x4852
+FRAME_HEADER = struct.Struct('<HH')
+RECORD_DTYPE = np.dtype([('ride_id', '<u4'), ('seq', '<u4'), ('time', '<f8'),
+                         ('passenger', '<f4'), ('driver', '<f4')])
+MAX_RECORDS_PER_FRAME = 0xFFFF
+MAX_DATAGRAM_SIZE = 65507  # Largest UDP payload over IPv4
+MAX_RECORDS_PER_DATAGRAM = (MAX_DATAGRAM_SIZE - FRAME_HEADER.size) // RECORD_DTYPE.itemsize  # 2729
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 9750
+
+retention_window = 10 * 60  # Seconds of history kept per ride
+max_events = 1000  # Latest alert events kept per ride
+ride_timeout = 10 * 60  # Seconds without samples before a ride is dropped
+sweep_interval = 10  # Seconds between checks for idle rides
+
+# Encode a structured array of RECORD_DTYPE records (at most 65535) as one frame
+def encode_frame(records):
+    records = np.asarray(records, dtype=RECORD_DTYPE)
+    if len(records) > MAX_RECORDS_PER_FRAME:
+        raise ValueError("Too many records for one frame.")
+    return FRAME_HEADER.pack(FRAME_MAGIC, len(records)) + records.tobytes()
+
+# Records for one sample per ride, ready for encode_frame
+def make_records(ride_ids, seq, time, passenger, driver):
+    records = np.empty(len(ride_ids), dtype=RECORD_DTYPE)
+    records['ride_id'] = ride_ids
+    records['seq'] = seq
+    records['time'] = time
+    records['passenger'] = passenger
+    records['driver'] = driver
+    return records
+
+# Decode a whole frame (header included), as received in a UDP datagram
+def decode_frame(frame):
+    if len(frame) < FRAME_HEADER.size:
+        raise ValueError("Frame too short.")
+    magic, count = FRAME_HEADER.unpack_from(frame)
+    if magic != FRAME_MAGIC or len(frame) != FRAME_HEADER.size + count * RECORD_DTYPE.itemsize:
+        raise ValueError("Malformed frame.")
+    return np.frombuffer(frame, dtype=RECORD_DTYPE, offset=FRAME_HEADER.size)
+
+class RideState:
+    # ages ({'driver': age, 'passenger': age}) select the detector's thresholds
+    def __init__(self, ride_id, retention_window=retention_window, sample_rate=1.0, ages=None):
+        self.ride_id = ride_id
+        self.history = SampleRingBuffer.for_retention(retention_window, sample_rate)
+        self.detector = HeartRateDetector.for_ages(ages)
+        self.last_seq = None
+        self.missing = 0  # Samples lost according to gaps in seq
+        self.events = deque(maxlen=max_events)
+        self.last_seen = None
+
+    def ingest(self, records, received_at):
+        if self.last_seq is not None:
+            gaps = np.diff(np.concatenate([[self.last_seq], records['seq'].astype(np.int64)])) - 1
+            self.missing += int(gaps[gaps > 0].sum())
+        self.last_seq = int(records['seq'][-1])
+        self.last_seen = received_at
+        self.history.extend({'time': records['time'], 'driver': records['driver'],
+                             'passenger': records['passenger']})
+        events = self.detector.update_many(records['time'], records['driver'], records['passenger'])
+        self.events.extend(events)
+        return events
+
+class IngestionServer:
+    def __init__(self, retention_window=retention_window, sample_rate=1.0, ride_timeout=ride_timeout):
+        self.retention_window = retention_window
+        self.sample_rate = sample_rate
+        self.ride_timeout = ride_timeout
+        self.rides = {}
+        self.ages = {}  # Occupant ages of each ride id, when registered
+        self.listeners = []
+        self.evicted = 0  # Rides dropped after ride_timeout seconds without samples
+        self.last_sweep = time.perf_counter()
+        self.frames = 0
+        self.records = 0
+        self.bad_frames = 0
+        self.max_latency = 0.0  # Longest time spent handling one frame, in seconds
+        self._servers = []
+        self._transports = []
+
+    # Register a callable(ride_id, records, events) called for every chunk of samples
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    # Register the occupant ages ({'driver': age, 'passenger': age}) of a ride, so
+    # its detector uses their age-group thresholds
+    def set_ride_ages(self, ride_id, ages):
+        self.ages[ride_id] = dict(ages)
+        ride = self.rides.get(ride_id)
+        if ride is not None:
+            ride.detector = HeartRateDetector.for_ages(ages)
+
+    def get_ride(self, ride_id):
+        ride = self.rides.get(ride_id)
+        if ride is None:
+            ride = self.rides[ride_id] = RideState(ride_id, self.retention_window, self.sample_rate,
+                                                   self.ages.get(ride_id))
+        return ride
+
+    # Drop the rides that have sent nothing for ride_timeout seconds
+    def evict_idle_rides(self, now=None):
+        now = time.perf_counter() if now is None else now
+        idle = [ride_id for ride_id, ride in self.rides.items() if now - ride.last_seen > self.ride_timeout]
+        for ride_id in idle:
+            del self.rides[ride_id]
+        self.evicted += len(idle)
+        self.last_sweep = now
+        return idle
+
+    # Route decoded records to their rides
+    def ingest(self, records):
+        received_at = time.perf_counter()
+        self.frames += 1
+        self.records += len(records)
+        if len(records) == 0:
+            return
+        ride_ids = records['ride_id']
+        if (ride_ids == ride_ids[0]).all():
+            groups = [(int(ride_ids[0]), records)]
+        else:
+            order = np.argsort(ride_ids, kind='stable')
+            sorted_records = records[order]
+            starts = np.flatnonzero(np.diff(sorted_records['ride_id'])) + 1
+            groups = [(int(chunk['ride_id'][0]), chunk) for chunk in np.split(sorted_records, starts)]
+        for ride_id, chunk in groups:
+            events = self.get_ride(ride_id).ingest(chunk, received_at)
+            for listener in self.listeners:
+                listener(ride_id, chunk, events)
+        if received_at - self.last_sweep >= sweep_interval:
+            self.evict_idle_rides(received_at)
+        self.max_latency = max(self.max_latency, time.perf_counter() - received_at)
+
+    async def _handle_tcp(self, reader, writer):
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                magic, count = FRAME_HEADER.unpack(header)
+                if magic != FRAME_MAGIC:
+                    self.bad_frames += 1
+                    break
+                payload = await reader.readexactly(count * RECORD_DTYPE.itemsize)
+                self.ingest(np.frombuffer(payload, dtype=RECORD_DTYPE))
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    # Start listening on TCP and/or UDP; pass None for a port to skip that protocol
+    async def start(self, host=DEFAULT_HOST, tcp_port=DEFAULT_PORT, udp_port=DEFAULT_PORT):
+        loop = asyncio.get_running_loop()
+        if tcp_port is not None:
+            self._servers.append(await asyncio.start_server(self._handle_tcp, host, tcp_port))
+        if udp_port is not None:
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: _DatagramProtocol(self), local_addr=(host, udp_port))
+            self._transports.append(transport)
+
+    # Ports actually bound (useful when started with port 0)
+    def ports(self):
+        tcp = [server.sockets[0].getsockname()[1] for server in self._servers]
+        udp = [transport.get_extra_info('sockname')[1] for transport in self._transports]
+        return tcp, udp
+
+    async def stop(self):
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        for transport in self._transports:
+            transport.close()
+        self._servers, self._transports = [], []
+
+    # Short text summary of the server counters
+    def summary(self):
+        alerts = sum(ride.detector.is_active() for ride in self.rides.values())
+        missing = sum(ride.missing for ride in self.rides.values())
+        return (f"{len(self.rides)} rides ({self.evicted} idle rides dropped), {self.records} samples in {self.frames} frames, "
+                f"{self.bad_frames} bad frames, {missing} missing samples, {alerts} rides in alarm, "
+                f"max frame latency {self.max_latency * 1000:.2f} ms")
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        try:
+            records = decode_frame(data)
+        except ValueError:
+            self.server.bad_frames += 1
+            return
+        self.server.ingest(records)
+
+# Load generator: simulate num_rides rides with heartrate_bpm and stream them to
+# the server, one sample per ride every interval / speed seconds. Over TCP every
+# ride has its own connection; over UDP all rides share one socket.
+async def run_load_generator(host=DEFAULT_HOST, port=DEFAULT_PORT, num_rides=100, ride_duration=6 * 60,
+                             speed=1.0, protocol='tcp', seed=None, first_ride_id=0):
+    from heartrate_bpm import simulate_rides
+
+    groups = ['adult'] * num_rides
+    time, passenger, driver = simulate_rides(groups, groups, ride_duration, seed=seed)
+    ride_ids = np.arange(first_ride_id, first_ride_id + num_rides)
+    interval = 1 / speed if speed else 0
+
+    if protocol == 'udp':
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol, remote_addr=(host, port))
+        try:
+            for seq in range(len(time)):
+                for start in range(0, num_rides, MAX_RECORDS_PER_DATAGRAM):
+                    rides = slice(start, start + MAX_RECORDS_PER_DATAGRAM)
+                    transport.sendto(encode_frame(make_records(
+                        ride_ids[rides], seq, time[seq], passenger[rides, seq], driver[rides, seq])))
+                await asyncio.sleep(interval)
+        finally:
+            transport.close()
+        return
+
+    async def send_ride(index):
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for seq in range(len(time)):
+                writer.write(encode_frame(make_records(
+                    ride_ids[index:index + 1], seq, time[seq], passenger[index, seq], driver[index, seq])))
+                await writer.drain()
+                await asyncio.sleep(interval)
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+    await asyncio.gather(*(send_ride(index) for index in range(num_rides)))
+
+# Run the server until interrupted; ride_ages maps ride ids to their occupant ages
+async def _serve(args, ride_ages):
+    server = IngestionServer(args.retention, ride_timeout=args.ride_timeout)
+    for ride_id, ages in ride_ages.items():
+        server.set_ride_ages(ride_id, ages)
+    await server.start(args.host, args.port, args.port)
+    print(f"Listening on {args.host}:{args.port} (TCP and UDP).")
+    try:
+        while True:
+            await asyncio.sleep(args.report_interval)
+            server.evict_idle_rides()  # Also when no samples arrive at all
+            print(server.summary())
+    finally:
+        await server.stop()
+
+# Occupant ages of each ride of a fleet spec file
+def read_ride_ages(spec_file, parser):
+    from heartrate_bpm import read_fleet_spec
+
+    try:
+        rides = read_fleet_spec(spec_file)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    return {ride['ride_id']: {'driver': ride['driver_age'], 'passenger': ride['passenger_age']} for ride in rides}
+
+def main():
+    parser = argparse.ArgumentParser(description="Heart rate ingestion server and load generator.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve = subparsers.add_parser('serve', help="run the ingestion server")
+    serve.add_argument('--host', default=DEFAULT_HOST)
+    serve.add_argument('--port', type=int, default=DEFAULT_PORT)
+    serve.add_argument('--retention', type=float, default=retention_window, help="seconds of history per ride")
+    serve.add_argument('--report-interval', type=float, default=5, help="seconds between status lines")
+    serve.add_argument('--ride-timeout', type=float, default=ride_timeout,
+                       help="seconds without samples before a ride is dropped")
+    serve.add_argument('--fleet', metavar='SPEC',
+                       help="fleet spec CSV (see heartrate_bpm.py) with the occupant ages of each ride")
+
+    loadgen = subparsers.add_parser('loadgen', help="stream simulated rides to a server")
+    loadgen.add_argument('--host', default=DEFAULT_HOST)
+    loadgen.add_argument('--port', type=int, default=DEFAULT_PORT)
+    loadgen.add_argument('--rides', type=int, default=100)
+    loadgen.add_argument('--duration', type=int, default=6 * 60, help="ride duration in seconds")
+    loadgen.add_argument('--speed', type=float, default=1.0, help="playback speed (0 for as fast as possible)")
+    loadgen.add_argument('--protocol', choices=['tcp', 'udp'], default='tcp')
+    loadgen.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'serve':
+            asyncio.run(_serve(args, read_ride_ages(args.fleet, parser) if args.fleet else {}))
+        else:
+            asyncio.run(run_load_generator(args.host, args.port, args.rides, args.duration,
+                                           args.speed, args.protocol, args.seed))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+from collections import deque
+from functools import lru_cache
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+"""
+Sliding-window spectral analysis (STFT / Welch) of heart rate series, for a
+batch of rides at once, computed incrementally for live monitoring and in
+batch for stored recordings.
+
+Heart rate is not stationary, so instead of one periodogram over the whole
+ride the series is cut into overlapping segments (segment_length samples,
+every hop samples). Each segment has its mean removed, is multiplied by a
+window and transformed with one rfft call for all rides and segments. The
+spectra over time form the spectrogram; their average is the Welch estimate.
+Band powers (the integral of the spectrum over each frequency band) are
+features for alerting, e.g. a surge of low-frequency power when a heart rate
+starts oscillating.
+
+SpectralStream computes the same frames as stft() while samples arrive: each
+update only transforms the segments completed by the new samples, and the
+Welch average over the last `history` frames is kept as a running sum, so
+the cost per tick does not grow with the length of the ride. Windows are
+cached per (name, length) and the FFT size is fixed per stream.
+
+The spectra are one-sided power spectral densities in BPM^2/Hz, scaled like
+scipy.signal.welch(scaling='density').
+"""
+
+segment_length = 64  # Samples per segment
+hop_length = 16  # Samples between the starts of consecutive segments
+spectral_history = 16  # Frames averaged into the live Welch estimate
+
+# Frequency bands (Hz) of the heart rate series, after the usual HRV bands
+BANDS = {
+    'very_low': (0.0, 0.04),
+    'low': (0.04, 0.15),
+    'high': (0.15, 0.5),
+}
+
+# Window of a given length, computed once per (name, length); read-only
+@lru_cache(maxsize=None)
+def get_window(name, length):
+    windows = {'hann': np.hanning, 'hamming': np.hamming, 'blackman': np.blackman, 'boxcar': np.ones}
+    if name not in windows:
+        raise ValueError(f"Unknown window '{name}'.")
+    window = np.asarray(windows[name](length), dtype=float)
+    window.flags.writeable = False
+    return window
+
+# FFT size for a segment: the next power of two
+def fft_size(length):
+    return 1 << max(0, int(length) - 1).bit_length()
+
+class SpectralConfig:
+    def __init__(self, segment=segment_length, hop=hop_length, sample_rate=1.0, window='hann', nfft=None):
+        if segment <= 1 or hop <= 0:
+            raise ValueError("Segment length must be above 1 and hop positive.")
+        self.segment = int(segment)
+        self.hop = int(hop)
+        self.sample_rate = float(sample_rate)
+        self.window = get_window(window, self.segment)
+        self.nfft = int(nfft) if nfft else fft_size(self.segment)
+        self.frequencies = np.fft.rfftfreq(self.nfft, 1 / self.sample_rate)
+        # Density scaling; every bin but DC and Nyquist also carries the negative frequencies
+        self.scale = np.full(len(self.frequencies), 2 / (self.sample_rate * np.sum(self.window ** 2)))
+        self.scale[0] /= 2
+        if self.nfft % 2 == 0:
+            self.scale[-1] /= 2
+
+    # PSD of (... x segment) windows of samples, one spectrum per segment
+    def spectra(self, segments):
+        segments = segments - segments.mean(axis=-1, keepdims=True)
+        transform = np.fft.rfft(segments * self.window, n=self.nfft, axis=-1)
+        return (transform.real ** 2 + transform.imag ** 2) * self.scale
+
+    # Matrix summing a PSD over each band (bins x bands), including the bin width
+    def band_matrix(self, bands=BANDS):
+        resolution = self.sample_rate / self.nfft
+        frequencies = self.frequencies
+        return np.stack([((frequencies >= low) & (frequencies < high)).astype(float) * resolution
+                         for low, high in bands.values()], axis=1)
+
+# Spectrogram of a (rides x samples) array, or of one series. Returns the
+# frequencies, the frame times (centre of each segment, in seconds from the
+# first sample) and a (rides x frames x frequencies) PSD array.
+def stft(values, segment=segment_length, hop=hop_length, sample_rate=1.0, window='hann', config=None):
+    config = config or SpectralConfig(segment, hop, sample_rate, window)
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    if values.shape[1] < config.segment:
+        return config.frequencies, np.empty(0), np.empty((len(values), 0, len(config.frequencies)))
+    segments = sliding_window_view(values, config.segment, axis=1)[:, ::config.hop]
+    times = (np.arange(segments.shape[1]) * config.hop + config.segment / 2) / config.sample_rate
+    return config.frequencies, times, config.spectra(segments)
+
+# Welch estimate: the mean of the STFT frames. Returns the frequencies and a
+# (rides x frequencies) PSD array (NaN for rides shorter than one segment).
+def welch(values, segment=segment_length, hop=hop_length, sample_rate=1.0, window='hann', config=None):
+    frequencies, _, psd = stft(values, segment, hop, sample_rate, window, config)
+    if psd.shape[1] == 0:
+        return frequencies, np.full((psd.shape[0], len(frequencies)), np.nan)
+    return frequencies, psd.mean(axis=1)
+
+# Power in each band for PSDs along the last axis. Returns a dict of arrays
+# shaped like psd without its last axis, plus 'total' and the 'low_high' ratio.
+def band_powers(psd, config=None, bands=BANDS):
+    config = config or SpectralConfig()
+    powers = np.asarray(psd) @ config.band_matrix(bands)
+    result = {name: powers[..., index] for index, name in enumerate(bands)}
+    result['total'] = powers.sum(axis=-1)
+    if 'low' in result and 'high' in result:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result['low_high'] = result['low'] / result['high']
+    return result
+
+class SpectralStream:
+    # Incremental STFT for a fixed batch of rides that receive samples in step
+    def __init__(self, rides=1, segment=segment_length, hop=hop_length, sample_rate=1.0, window='hann',
+                 history=spectral_history, bands=BANDS):
+        self.config = SpectralConfig(segment, hop, sample_rate, window)
+        self.rides = rides
+        self.history = history
+        self.bands = bands
+        self.reset()
+
+    def reset(self):
+        self.samples_seen = 0
+        self.frames_seen = 0
+        self._buffer = np.empty((self.rides, 0))
+        self._buffer_start = 0  # Sample index of the first buffered sample (or of the next one kept)
+        self.frames = deque(maxlen=self.history)  # Recent (time, rides x frequencies PSD) frames
+        self._sum = np.zeros((self.rides, len(self.config.frequencies)))
+
+    @property
+    def frequencies(self):
+        return self.config.frequencies
+
+    # Add a (rides x new samples) array (or new samples of a single ride). Returns
+    # the frame times and the (rides x frames x frequencies) PSD of the segments
+    # completed by these samples.
+    def update(self, values):
+        config = self.config
+        values = np.asarray(values, dtype=float).reshape(self.rides, -1)
+        # With hop > segment, samples between the end of a segment and the start of
+        # the next (before _buffer_start) are never needed
+        skip = min(values.shape[1], max(0, self._buffer_start - self.samples_seen))
+        self.samples_seen += values.shape[1]
+        buffer = np.concatenate([self._buffer, values[:, skip:]], axis=1)
+
+        # Only the segments completed by the new samples are transformed
+        next_start = self.frames_seen * config.hop - self._buffer_start
+        count = max(0, (buffer.shape[1] - next_start - config.segment) // config.hop + 1)
+        if count:
+            windows = sliding_window_view(buffer[:, next_start:], config.segment, axis=1)[:, ::config.hop][:, :count]
+            psd = config.spectra(windows)
+            starts = (self.frames_seen + np.arange(count)) * config.hop
+            times = (starts + config.segment / 2) / config.sample_rate
+        else:
+            psd = np.empty((self.rides, 0, len(config.frequencies)))
+            times = np.empty(0)
+
+        # Running Welch sum over the last `history` frames, summed afresh once per
+        # `history` frames so rounding errors cannot build up
+        for index in range(count):
+            if len(self.frames) == self.history:
+                self._sum -= self.frames[0][1]
+            self.frames.append((times[index], psd[:, index]))
+            self._sum += psd[:, index]
+            self.frames_seen += 1
+            if self.frames_seen % self.history == 0:
+                self._sum = np.sum([frame for _, frame in self.frames], axis=0)
+
+        # Keep only the samples later segments still need
+        keep_from = self.frames_seen * config.hop - self._buffer_start
+        self._buffer = buffer[:, keep_from:].copy() if keep_from > 0 else buffer
+        self._buffer_start += max(0, keep_from)
+        return times, psd
+
+    # Welch estimate over the recent frames (rides x frequencies; NaN before the first frame)
+    def welch(self):
+        if not self.frames:
+            return np.full_like(self._sum, np.nan)
+        return self._sum / len(self.frames)
+
+    # Band powers of the recent Welch estimate, one value per ride
+    def band_powers(self):
+        return band_powers(self.welch(), self.config, self.bands)
+
+    # Spectrogram of the recent frames: frame times and a (rides x frames x frequencies) PSD
+    def spectrogram(self):
+        if not self.frames:
+            return np.empty(0), np.empty((self.rides, 0, len(self.config.frequencies)))
+        times, psd = zip(*self.frames)
+        return np.array(times), np.stack(psd, axis=1)
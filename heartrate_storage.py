@@ -0,0 +1,221 @@
+import json
+import os
+import struct
+import numpy as np
+
+"""
+Binary columnar storage for heart rate recordings (.hrb files).
+
+Layout: the 4-byte magic b'HRB1', a little-endian uint32 with the header length,
+a JSON header and then every column as one contiguous block of little-endian
+float64 values, in the order given by the header's "columns" list. The header
+is padded so the column data starts on a 64-byte boundary, which lets readers
+memory-map the columns directly instead of parsing or copying them.
+
+The header holds the sample rate (Hz), the start time (Unix timestamp), the
+column names, the number of samples, the passenger/driver ages and, for fleet
+shard files, a "rides" table with the first row and length of every ride.
+
+load_heart_rate_data() also reads the compressed .hra archives of
+heartrate_archive.py, and can read only a time range of a recording.
+"""
+
+MAGIC = b'HRB1'
+FORMAT_VERSION = 1
+DATA_ALIGNMENT = 64
+COLUMN_DTYPE = np.dtype('<f8')
+
+DEFAULT_DATA_FILE = 'heart_rate_data.hrb'
+DEFAULT_CSV_FILE = 'heart_rate_data.txt'
+
+# CSV header titles used by the scripts for each column name
+CSV_COLUMN_TITLES = {
+    'passenger': 'Passenger Heart Rate',
+    'driver': 'Driver Heart Rate',
+    'ride_id': 'Ride ID',
+    'time': 'Time',
+}
+CSV_COLUMN_NAMES = {title.lower(): name for name, title in CSV_COLUMN_TITLES.items()}
+
+class HeartRateRecording:
+    def __init__(self, header, columns):
+        self.header = header
+        self.columns = columns
+
+    @property
+    def sample_rate(self):
+        return self.header.get('sample_rate', 1.0)
+
+    @property
+    def start_time(self):
+        return self.header.get('start_time', 0.0)
+
+    @property
+    def ages(self):
+        return self.header.get('ages', {})
+
+    @property
+    def column_names(self):
+        return list(self.columns)
+
+    def __len__(self):
+        return self.header['length']
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    # Seconds since the start of the recording: the stored time column when
+    # there is one, otherwise derived from the sample rate
+    @property
+    def time(self):
+        if 'time' in self.columns:
+            return self.columns['time']
+        return np.arange(len(self)) / self.sample_rate
+
+    # Yield (ride info, recording) pairs for every ride in a fleet shard. The
+    # per-ride recordings are views into this one, so nothing is copied.
+    def rides(self):
+        for ride in self.header.get('rides', []):
+            start, stop = ride['start'], ride['start'] + ride['length']
+            header = dict(self.header, length=ride['length'], ages={
+                'passenger': ride.get('passenger_age'), 'driver': ride.get('driver_age')})
+            header.pop('rides')
+            yield ride, HeartRateRecording(header, {name: column[start:stop] for name, column in self.columns.items()})
+
+# Build the padded header bytes for a file with the given columns and length
+def _encode_header(column_names, length, sample_rate, start_time, ages, rides):
+    header = {
+        'version': FORMAT_VERSION,
+        'sample_rate': float(sample_rate),
+        'start_time': float(start_time),
+        'columns': list(column_names),
+        'dtype': COLUMN_DTYPE.str,
+        'length': int(length),
+        'ages': ages or {},
+    }
+    if rides is not None:
+        header['rides'] = rides
+    encoded = json.dumps(header).encode('utf-8')
+    prefix_size = len(MAGIC) + 4
+    padded_size = -(-(prefix_size + len(encoded)) // DATA_ALIGNMENT) * DATA_ALIGNMENT
+    encoded += b' ' * (padded_size - prefix_size - len(encoded))
+    return header, MAGIC + struct.pack('<I', len(encoded)) + encoded
+
+# Memory-map the column block of an .hrb file as one (columns x samples) array
+def _map_columns(path, header, data_offset, mode):
+    shape = (len(header['columns']), header['length'])
+    if shape[0] * shape[1] == 0:
+        data = np.empty(shape, dtype=COLUMN_DTYPE)
+    else:
+        data = np.memmap(path, dtype=COLUMN_DTYPE, mode=mode, offset=data_offset, shape=shape)
+    return {name: data[index] for index, name in enumerate(header['columns'])}
+
+# Create an .hrb file of a known length and return it as a writable recording,
+# so large files can be filled in place one ride at a time
+def create_heart_rate_file(path, column_names, length, sample_rate=1.0, start_time=0.0, ages=None, rides=None):
+    header, encoded = _encode_header(column_names, length, sample_rate, start_time, ages, rides)
+    with open(path, 'wb') as file:
+        file.write(encoded)
+        file.truncate(len(encoded) + len(column_names) * length * COLUMN_DTYPE.itemsize)
+    return HeartRateRecording(header, _map_columns(path, header, len(encoded), 'r+'))
+
+# Write a dict of equally long columns to an .hrb file
+def write_heart_rate_file(path, columns, sample_rate=1.0, start_time=0.0, ages=None, rides=None):
+    lengths = {len(column) for column in columns.values()}
+    if len(lengths) > 1:
+        raise ValueError("All columns must have the same length.")
+    length = lengths.pop() if lengths else 0
+    header, encoded = _encode_header(columns, length, sample_rate, start_time, ages, rides)
+    with open(path, 'wb') as file:
+        file.write(encoded)
+        for column in columns.values():
+            file.write(np.ascontiguousarray(column, dtype=COLUMN_DTYPE).tobytes())
+    return header
+
+# Check whether a file starts with the .hrb magic bytes
+def is_heart_rate_file(path):
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+# Read an .hrb file; the columns are read-only memory-mapped views of the file
+def read_heart_rate_file(path):
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a heart rate data file.")
+        (header_size,) = struct.unpack('<I', file.read(4))
+        header = json.loads(file.read(header_size).decode('utf-8'))
+    if header.get('version') != FORMAT_VERSION:
+        raise ValueError(f"{path}: unsupported format version {header.get('version')}.")
+    data_offset = len(MAGIC) + 4 + header_size
+    expected_size = data_offset + len(header['columns']) * header['length'] * COLUMN_DTYPE.itemsize
+    if os.path.getsize(path) < expected_size:
+        raise ValueError(f"{path} is truncated.")
+    return HeartRateRecording(header, _map_columns(path, header, data_offset, 'r'))
+
+# Map a CSV header line to column names
+def parse_csv_header(line):
+    names = []
+    for name in line.strip().split(','):
+        name = name.strip().lower()
+        names.append(CSV_COLUMN_NAMES.get(name, name.replace(' ', '_')))
+    return names
+
+# Read a CSV heart rate file (the old heart_rate_data.txt format or a CSV export)
+def read_heart_rate_csv(path, sample_rate=1.0, start_time=0.0):
+    with open(path, 'r') as file:
+        column_names = parse_csv_header(next(file))
+        data = np.loadtxt(file, delimiter=',', ndmin=2).reshape(-1, len(column_names))
+    columns = {name: data[:, index] for index, name in enumerate(column_names)}
+    header = {'version': FORMAT_VERSION, 'sample_rate': sample_rate, 'start_time': start_time,
+              'columns': column_names, 'length': len(data), 'ages': {}}
+    return HeartRateRecording(header, columns)
+
+# Rows of a recording between start and stop seconds (inclusive, None for open
+# ends) of each ride; the ride table is rebuilt for the rows that are kept, and
+# a recording without a time column gets one so the rows keep their times
+def select_time_range(recording, start=None, stop=None):
+    if start is None and stop is None:
+        return recording
+    times = np.asarray(recording.time)
+    keep = np.ones(len(times), dtype=bool)
+    if start is not None:
+        keep &= times >= start
+    if stop is not None:
+        keep &= times <= stop
+    columns = {name: np.asarray(column)[keep] for name, column in recording.columns.items()}
+    columns['time'] = times[keep]
+    header = dict(recording.header, length=int(keep.sum()), columns=list(columns))
+    if 'rides' in header:
+        rides, row = [], 0
+        for ride in header['rides']:
+            length = int(keep[ride['start']:ride['start'] + ride['length']].sum())
+            if length:
+                rides.append(dict(ride, start=row, length=length))
+                row += length
+        header['rides'] = rides
+    return HeartRateRecording(header, columns)
+
+# Shared reader used by all scripts: .hrb files are memory-mapped, .hra archives
+# are decompressed (only the chunks in the time range) and anything else is
+# parsed as CSV. With start and/or stop only that time range (seconds of each ride) is returned.
+def load_heart_rate_data(path, start=None, stop=None):
+    from heartrate_archive import is_archive_file, read_archive
+
+    if is_archive_file(path):
+        return read_archive(path, start, stop)
+    if is_heart_rate_file(path):
+        return select_time_range(read_heart_rate_file(path), start, stop)
+    return select_time_range(read_heart_rate_csv(path), start, stop)
+
+# Export a recording (or a dict of columns) to CSV in the heart_rate_data.txt format
+def export_csv(recording, path):
+    columns = recording.columns if isinstance(recording, HeartRateRecording) else recording
+    titles = [CSV_COLUMN_TITLES.get(name, name) for name in columns]
+    formats = ['%d' if name == 'ride_id' else '%g' if name == 'time' else '%.17g' for name in columns]
+    with open(path, 'w') as file:
+        file.write(", ".join(titles) + "\n")
+        if columns:
+            np.savetxt(file, np.column_stack(list(columns.values())), fmt=formats, delimiter=',')
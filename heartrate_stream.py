@@ -0,0 +1,127 @@
+import io
+import os
+import numpy as np
+from heartrate_storage import parse_csv_header
+
+"""
+Streaming ingestion of a heart rate CSV file that is still being written to.
+
+HeartRateTailReader remembers how far into the file it has read and only
+parses the rows appended since the last poll. A trailing line without a
+newline is kept back until it is complete. When the file is replaced (a
+different inode, e.g. after log rotation) or truncated, the reader starts
+again from the top of the new file and reports the reset so callers can drop
+the history they were holding. A file replaced in place that happens to keep
+its inode is caught by checking that the last bytes already read are unchanged.
+Lines that are not a full row of numbers are skipped and counted, so one bad
+line never stops the tail.
+
+Only the CSV format can be tailed: .hrb files have a fixed length in their
+header and are written in one go.
+"""
+
+class HeartRateTailReader:
+    def __init__(self, path):
+        self.path = path
+        self.column_names = None
+        self.offset = 0
+        self.rows_read = 0
+        self.resets = 0
+        self.bad_lines = 0  # Lines skipped because they were not a row of numbers
+        self._file_id = None
+        self._partial = b''
+        self._last_bytes = b''
+
+    def _reset(self):
+        self.column_names = None
+        self.offset = 0
+        self.rows_read = 0
+        self._partial = b''
+        self._last_bytes = b''
+        self.resets += 1
+
+    # Empty columns, used when there is nothing new to return
+    def _empty_columns(self):
+        return {name: np.empty(0) for name in self.column_names or ()}
+
+    # Read the rows appended since the last call. Returns (columns, reset) where
+    # columns maps column names to arrays of the new rows and reset is True if
+    # the file was rotated or truncated since the last call.
+    def poll(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return self._empty_columns(), False
+
+        reset = False
+        file_id = (stat.st_dev, stat.st_ino)
+        if self._file_id is not None and (file_id != self._file_id or stat.st_size < self.offset):
+            self._reset()
+            reset = True
+        self._file_id = file_id
+
+        with open(self.path, 'rb') as file:
+            if self._last_bytes:
+                file.seek(self.offset - len(self._last_bytes))
+                if file.read(len(self._last_bytes)) != self._last_bytes:
+                    self._reset()
+                    reset = True
+            if stat.st_size == self.offset:
+                return self._empty_columns(), reset
+            file.seek(self.offset)
+            chunk = file.read(stat.st_size - self.offset)
+
+        # Only parse complete lines; keep a partly written last line for later
+        data = self._partial + chunk
+        end = data.rfind(b'\n') + 1
+        data, partial = data[:end], data[end:]
+
+        column_names = self.column_names
+        if column_names is None:
+            header_end = data.find(b'\n') + 1
+            if header_end:
+                column_names = parse_csv_header(data[:header_end].decode('utf-8', errors='replace'))
+                data = data[header_end:]
+            else:
+                partial = data + partial
+                data = b''
+
+        # The read position only moves on once the new bytes have been parsed
+        columns = self._parse_rows(data, column_names) if column_names is not None else self._empty_columns()
+        self.column_names = column_names
+        self._partial = partial
+        self.offset += len(chunk)
+        self._last_bytes = (self._last_bytes + chunk)[-64:]
+        return columns, reset
+
+    # Parse complete CSV lines into one array per column. Fields may have spaces
+    # around them; lines that are not a full row of numbers are skipped and
+    # counted in bad_lines.
+    def _parse_rows(self, data, column_names):
+        num_columns = len(column_names)
+        rows = np.empty((0, num_columns))
+        if data.strip():
+            try:
+                rows = np.loadtxt(io.BytesIO(data), delimiter=',', ndmin=2)
+            except ValueError:
+                rows = None
+            if rows is None or rows.shape[1] != num_columns:
+                rows = self._parse_lines(data, num_columns)
+        self.rows_read += len(rows)
+        return {name: rows[:, index] for index, name in enumerate(column_names)}
+
+    # Slow path for a chunk with bad lines: parse line by line
+    def _parse_lines(self, data, num_columns):
+        rows = []
+        for line in data.split(b'\n'):
+            if not line.strip():
+                continue
+            try:
+                row = [float(field) for field in line.split(b',')]
+            except ValueError:
+                row = None
+            if row is None or len(row) != num_columns:
+                self.bad_lines += 1
+                continue
+            rows.append(row)
+        return np.array(rows, dtype=float).reshape(-1, num_columns)
@@ -1,230 +1,147 @@
-import matplotlib.pyplot as plt
-import numpy as np
-import tkinter as tk
-from tkinter import messagebox
-import time
-import threading
-
-threshold = 140  # Set the threshold heart rate for anxiety
-
-# Function to check for an anxious heart rate and prompt driver and passenger
-def check_anxious_heart_rate(driver_data, passenger_data):
-    driver_max = np.max(driver_data)
-    passenger_max = np.max(passenger_data)
-    for n in range(1):
-        if driver_max > threshold:
-            response_driver = messagebox.askyesno("Anxious Heart Rate", "Driver: Are you feeling okay?")
-            if not response_driver:
-                messagebox.showinfo("Emergency Response", "Emergency response has been notified for the driver.")
-
-        if passenger_max > threshold:
-            response_passenger = messagebox.askyesno("Anxious Heart Rate", "Passenger: Are you feeling okay?")
-            if not response_passenger:
-                messagebox.showinfo("Emergency Response", "Emergency response has been notified for the passenger.")
-
-# Read heart rate data from file
-def read_heart_rate_data():
-    file_name = 'heart_rate_data.txt'
-    with open(file_name, 'r') as file:
-        next(file)  # Skip the first row (column headers)
-        heart_rate_data = np.loadtxt(file, delimiter=',')
-    return heart_rate_data
-
-# Plot heart rate data in a 2D graph
-def plot_heart_rate_data(time, driver_data, passenger_data, fig, axs):
-    # Plot for the driver's heart rate data
-    axs[0, 0].plot(time, driver_data, label='Driver')
-    axs[0, 0].set_ylabel('Heart Rate (BPM)')
-    axs[0, 0].axhline(y=140, color='r', linestyle='--', label='anxious_threshold BPM')
-    axs[0, 0].legend()
-
-    # Plot for the passenger's heart rate data
-    axs[0, 1].plot(time, passenger_data, label='Passenger')
-    axs[0, 1].set_ylabel('Heart Rate (BPM)')
-    axs[0, 1].axhline(y=140, color='r', linestyle='--', label='anxious_threshold BPM')
-    axs[0, 1].legend()
-
-    # Create a third graph to show data where both bpms are higher
-    both_high = np.where((driver_data > threshold) & (passenger_data > threshold))
-    axs[1, 0].plot(time[both_high], driver_data[both_high], 'ro', label='High BPM (Driver)')
-    axs[1, 0].plot(time[both_high], passenger_data[both_high], 'go', label='High BPM (Passenger)')
-    axs[1, 0].set_xlabel('Time (seconds)')
-    axs[1, 0].set_ylabel('Heart Rate (BPM)')
-    axs[1, 0].axhline(y=140, color='r', linestyle='--', label='anxious_threshold BPM')
-    axs[1, 0].legend()
-
-    # Create a fourth graph with combined heart rate data
-    axs[1, 1].plot(time, driver_data, label='Driver')
-    axs[1, 1].plot(time, passenger_data, label='Passenger')
-    axs[1, 1].set_xlabel('Time (seconds)')
-    axs[1, 1].set_ylabel('Heart Rate (BPM)')
-    axs[1, 1].axhline(y=140, color='r', linestyle='--', label='anxious_threshold BPM')
-    axs[1, 1].legend()
-
-    plt.tight_layout()
-    plt.draw()
-
-
-    class HeartRateMonitorApp:
-        def __init__(self, root):
-            self.root = root
-            self.root.title("Heart Rate Monitor")
-            self.root.protocol("WM_DELETE_WINDOW", self.on_close)
-
-            self.driver_contacted = False
-            self.passenger_contacted = False
-            self.response_unit_contacted = False
-
-            self.create_gui()
-
-            # Create a queue to communicate between the main thread and the plotting thread
-            self.plot_queue = queue.Queue()
-
-            # Start the plotting thread
-            self.plot_thread = threading.Thread(target=self.plot_heart_rate_data)
-            self.plot_thread.start()
-
-        def create_gui(self):
-            self.control_label = tk.Label(self.root, text="Control Status", font=("Helvetica", 16))
-            self.control_label.grid(row=0, column=0, pady=10)
-
-            self.danger_label = tk.Label(self.root, text="Danger Factors", font=("Helvetica", 16))
-            self.danger_label.grid(row=0, column=1, pady=10)
-
-            self.driver_button = tk.Button(self.root, text="Contact Driver", command=self.contact_driver)
-            self.driver_button.grid(row=1, column=0, pady=10)
-
-            self.passenger_button = tk.Button(self.root, text="Contact Passenger", command=self.contact_passenger)
-            self.passenger_button.grid(row=2, column=0, pady=10)
-
-            self.response_unit_button = tk.Button(self.root, text="Contact Response Unit", command=self.contact_response_unit)
-            self.response_unit_button.grid(row=3, column=0, pady=10)
-
-            self.status_control = tk.Label(self.root, text="Control: OK", font=("Helvetica", 12), fg="green")
-            self.status_control.grid(row=1, column=1)
-
-            self.status_danger = tk.Label(self.root, text="Danger: OK", font=("Helvetica", 12), fg="green")
-            self.status_danger.grid(row=2, column=1)
-
-            self.status_driver = tk.Label(self.root, text="Driver: Not Contacted", font=("Helvetica", 12), fg="orange")
-            self.status_driver.grid(row=4, column=0, pady=10)
-
-            self.status_passenger = tk.Label(self.root, text="Passenger: Not Contacted", font=("Helvetica", 12), fg="orange")
-            self.status_passenger.grid(row=5, column=0, pady=10)
-
-            self.status_response_unit = tk.Label(self.root, text="Response Unit: Not Contacted", font=("Helvetica", 12), fg="orange")
-            self.status_response_unit.grid(row=6, column=0, pady=10)
-
-        def contact_driver(self):
-            if not self.driver_contacted:
-                self.driver_contacted = True
-                self.status_driver.config(text="Driver: Contacted", fg="green")
-
-        def contact_passenger(self):
-            if not self.passenger_contacted:
-                self.passenger_contacted = True
-                self.status_passenger.config(text="Passenger: Contacted", fg="green")
-
-        def contact_response_unit(self):
-            if not self.response_unit_contacted:
-                self.response_unit_contacted = True
-                self.status_response_unit.config(text="Response Unit: Contacted", fg="green")
-
-        def on_close(self):
-            self.plot_thread.join()
-            self.root.destroy()
-
-        def check_anxious_heart_rate(self):
-            driver_max = np.max(self.driver_data)
-            passenger_max = np.max(self.passenger_data)
-
-            if driver_max > threshold:
-                self.status_control.config(text="Control: Danger", fg="red")
-                self.status_danger.config(text="Danger: Driver's heart rate is high", fg="red")
-                # Add a message to the queue to update the plot with the anxious heart rate
-                self.plot_queue.put("Driver's heart rate is high")
-
-            elif passenger_max > threshold:
-                self.status_control.config(text="Control: Danger", fg="red")
-                self.status_danger.config(text="Danger: Passenger's heart rate is high", fg="red")
-                # Add a message to the queue to update the plot with the anxious heart rate
-                self.plot_queue.put("Passenger's heart rate is high")
-
-            else:
-                self.status_control.config(text="Control: OK", fg="green")
-                self.status_danger.config(text="Danger: OK", fg="green")
-                # Add a message to the queue to update the plot with the normal heart rate
-                self.plot_queue.put("Normal heart rate")
-
-        def plot_heart_rate_data(self):
-            while True:
-                # Get the next message from the queue
-                message = self.plot_queue.get()
-
-                # Update the plot with the message 
-                if message == "Driver's heart rate is high":
-                    self.axs[0, 0].axhline(y=140, color='r', linestyle='--', label='Anxious threshold BPM')
-
-                elif message == "Passenger's heart rate is high":
-                    self.axs[0, 1].axhline(y=140, color='r', linestyle='--', label='Anxious threshold BPM')
-
-                elif message == "Normal heart rate":
-                    self.axs[0, 0].clear()
-                    self.axs[0, 1].clear()
-
-                # Redraw the plot
-                plt.draw()
-
-                # Wait for 1 second before updating the plot again
-                time.sleep(60)
-
-
-def main():
-    # Enable Matplotlib interactive mode
-    plt.ion()
-
-    # Read heart rate data from file
-    heart_rate_data = read_heart_rate_data()
-
-    # Extract driver and passenger data
-    time_array = np.arange(0, len(heart_rate_data))
-    driver_data = heart_rate_data[:, 0]
-    passenger_data = heart_rate_data[:, 1]
-
-    # Create a threading event to signal the plot thread to update
-    event = threading.Event()
-
-    # Create the initial Matplotlib plot
-    fig, axs = plt.subplots(2, 2, figsize=(10, 6))
-
-    # Start a thread to run the plot function
-    plot_thread = threading.Thread(target=plot_heart_rate_data, args=(time_array, driver_data, passenger_data, fig, axs))
-    plot_thread.start()
-
-    # Start the main loop
-    while True:
-        # Check for an anxious heart rate and prompt driver and passenger
-        check_anxious_heart_rate(driver_data, passenger_data)
-
-        # Append new heart rate data to the arrays
-        new_heart_rate_data = read_heart_rate_data()
-        time_array = np.append(time_array, new_heart_rate_data[:, 0])
-        driver_data = np.append(driver_data, new_heart_rate_data[:, 1])
-        passenger_data = np.append(passenger_data, new_heart_rate_data[:, 1])  # Use index 1 for passenger_data
-
-        # Call the Matplotlib plotting function in the main thread
-        plot_heart_rate_data(time_array, driver_data, passenger_data, fig, axs)
-
-        # Check if the user has pressed the Enter key to quit
-        if input() == '':
-            break
-
-    # Wait for the plot thread to finish before exiting
-    plot_thread.join()
-
-# Start the GUI application
-root = tk.Tk()
-root.withdraw()
-
-# Execute the main function
-main()
\ No newline at end of file
+import argparse
+import numpy as np
+import threading
+from heartrate_alerts import AlertDispatcher, show_pending_alerts
+from heartrate_clock import make_clock
+from heartrate_detection import HeartRateDetector
+from heartrate_storage import DEFAULT_CSV_FILE, DEFAULT_DATA_FILE, load_heart_rate_data
+from heartrate_stream import HeartRateTailReader
+from heartrate_buffer import SampleRingBuffer
+from heartrate_report import RideReport
+from heartrate_perf import PerfCounters
+
+retention_window = 60 * 60  # Seconds of heart rate history kept in memory
+poll_interval = 1.0  # Seconds between polls of the live file
+event_interval = 0.05  # Seconds between passes of the Tk event loop
+
+# Set stop_event when Enter is pressed. Runs on its own thread, so waiting for
+# the key never blocks the monitor; without a terminal it never fires.
+def wait_for_enter(stop_event):
+    try:
+        input()
+    except EOFError:
+        return
+    stop_event.set()
+
+# Function to check for an anxious heart rate and alert driver and passenger.
+# Only the given (new) samples are fed to the streaming detector, which keeps
+# its own state between calls. Alerts go to the dispatcher, which never blocks;
+# the prompts are shown by show_pending_alerts. Returns the queued alerts.
+def check_anxious_heart_rate(detector, time, driver_data, passenger_data, dispatcher):
+    events = detector.update_many(time, driver_data, passenger_data)
+    return dispatcher.submit_many([event for event in events if event.level == 'anxious'])
+
+# Read heart rate data from file (.hrb files are memory-mapped, .hra archives are
+# decompressed, CSV files are parsed), optionally only from start to stop seconds
+def read_heart_rate_data(file_name=DEFAULT_DATA_FILE, start=None, stop=None):
+    return load_heart_rate_data(file_name, start, stop)
+
+# Panels of the monitor plot (see heartrate_report.RideReport)
+MONITOR_PANELS = ('driver', 'passenger', 'both_high', 'combined')
+
+# Plot heart rate data in a 2D graph. The report's figure, lines and legends are
+# created once; each pass only swaps in the latest data and redraws. The lines
+# are downsampled to the axis width (min/max per pixel, see heartrate_lod), so
+# long rides stay responsive.
+def plot_heart_rate_data(time, driver_data, passenger_data, report):
+    report.update(time, driver_data, passenger_data)
+    report.fig.canvas.draw_idle()
+
+def main():
+    parser = argparse.ArgumentParser(description="Follow a live heart rate file and alert on anxious heart rates.")
+    parser.add_argument('--data-file', default=DEFAULT_CSV_FILE, help="live CSV file to follow")
+    parser.add_argument('--perf', metavar='FILE',
+                        help="print stage timings and counters and write them to this JSON file on exit")
+    parser.add_argument('--virtual', action='store_true',
+                        help="poll on a virtual clock, without waiting between polls (e.g. for a finished file)")
+    args = parser.parse_args()
+
+    # All waits of the live loop and the alert cooldowns go through one clock, real or virtual
+    clock = make_clock(args.virtual)
+
+    # Timings of the load, detect and draw stages (no-ops unless --perf is given)
+    perf = PerfCounters(enabled=args.perf is not None)
+
+    # GUI modules are only loaded when the script runs, not on import
+    import matplotlib.pyplot as plt
+    import tkinter as tk
+
+    # Start the GUI application (the alert windows need a Tk root)
+    root = tk.Tk()
+    root.withdraw()
+
+    # Alerts are queued without blocking and answered in their own windows
+    dispatcher = AlertDispatcher(clock=clock)
+
+    # Enable Matplotlib interactive mode
+    plt.ion()
+
+    # Follow the live CSV file; each poll only parses the rows appended since the last one
+    reader = HeartRateTailReader(args.data_file)
+    with perf.stage('load'):
+        heart_rate_data, _ = reader.poll()
+
+    # Keep a fixed-size history; the arrays below are views of its latest samples
+    history = SampleRingBuffer.for_retention(retention_window)
+    if heart_rate_data:
+        history.extend(dict(heart_rate_data, time=np.arange(0, reader.rows_read)))
+    window = history.window()
+    time_array, driver_data, passenger_data = window['time'], window['driver'], window['passenger']
+
+    # Streaming detector shared with the other scripts; it is only fed new samples
+    detector = HeartRateDetector()
+    with perf.stage('detect'):
+        check_anxious_heart_rate(detector, time_array, driver_data, passenger_data, dispatcher)
+    show_pending_alerts(root, dispatcher)
+
+    # Create the Matplotlib plot once; the main loop updates its lines on every pass
+    report = RideReport(plt.figure(figsize=(10, 6)), MONITOR_PANELS)
+
+    # Poll the file every poll_interval seconds; in between, keep the alert windows
+    # responsive by running the Tk event loop every event_interval seconds
+    stop_event = threading.Event()
+    threading.Thread(target=wait_for_enter, args=(stop_event,), daemon=True).start()
+    print(f"Following {args.data_file}. Press Enter to quit.")
+    next_poll = clock()
+    while not stop_event.is_set():
+        if clock() < next_poll:
+            root.update()
+            clock.wait(stop_event, min(event_interval, next_poll - clock()))
+            continue
+        next_poll = clock() + poll_interval
+
+        # Append only the newly written heart rate data to the history
+        with perf.stage('load'):
+            new_heart_rate_data, reset = reader.poll()
+        if reset:
+            # The file was rotated or truncated, so start the history again
+            history.clear()
+            detector.reset()
+        new_rows = len(new_heart_rate_data.get('driver', ()))
+        perf.gauge('rows_per_poll', new_rows)
+        if new_rows:
+            new_time = np.arange(reader.rows_read - new_rows, reader.rows_read)
+            history.extend(dict(new_heart_rate_data, time=new_time))
+
+            # Check the new samples for an anxious heart rate and prompt driver and passenger
+            with perf.stage('detect'):
+                check_anxious_heart_rate(detector, new_time, new_heart_rate_data['driver'],
+                                         new_heart_rate_data['passenger'], dispatcher)
+            show_pending_alerts(root, dispatcher)
+        window = history.window()
+        time_array, driver_data, passenger_data = window['time'], window['driver'], window['passenger']
+
+        # Call the Matplotlib plotting function in the main thread
+        with perf.stage('draw'):
+            plot_heart_rate_data(time_array, driver_data, passenger_data, report)
+        if perf.enabled:
+            print("\n".join(perf.summary_lines()))
+
+        # Draw the alert windows and handle the answers given so far
+        root.update()
+
+    if args.perf:
+        perf.export(args.perf)
+
+if __name__ == "__main__":
+    main()
@@ -1,136 +1,753 @@
-import tkinter as tk
-import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import time
-import threading
-import queue
-
-threshold = 140  # Set the threshold heart rate for anxiety
-control_threshold = 160  # Set the threshold heart rate for control
-
-class HeartRateMonitorApp:
-    def __init__(self, root, data_file):
-        self.root = root
-        self.root.title("Heart Rate Monitor")
-        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
-
-        self.driver_contacted = False
-        self.passenger_contacted = False
-        self.response_unit_contacted = False
-
-        self.create_gui()
-        self.create_plot()
-
-        # Create a queue to communicate between the main thread and the plotting thread
-        self.plot_queue = queue.Queue()
-
-        # Load heart rate data from the file (skip header)
-        self.heart_rate_data = np.loadtxt(data_file, delimiter=',', skiprows=1)
-
-        # Start the plotting thread
-        self.plot_thread = threading.Thread(target=self.plot_heart_rate_data)
-        self.plot_thread.start()
-
-    def create_gui(self):
-        self.control_label = tk.Label(self.root, text="Control Status", font=("Helvetica", 16))
-        self.control_label.grid(row=0, column=0, pady=10)
-
-        self.danger_label = tk.Label(self.root, text="Danger Factors", font=("Helvetica", 16))
-        self.danger_label.grid(row=0, column=1, pady=10)
-
-        self.driver_button = tk.Button(self.root, text="Contact Driver", command=self.contact_driver)
-        self.driver_button.grid(row=1, column=0, pady=10)
-
-        self.passenger_button = tk.Button(self.root, text="Contact Passenger", command=self.contact_passenger)
-        self.passenger_button.grid(row=2, column=0, pady=10)
-
-        self.response_unit_button = tk.Button(self.root, text="Contact Response Unit", command=self.contact_response_unit)
-        self.response_unit_button.grid(row=3, column=0, pady=10)
-
-        self.status_control = tk.Label(self.root, text="Control: OK", font=("Helvetica", 12), fg="green")
-        self.status_control.grid(row=1, column=1)
-
-        self.status_danger = tk.Label(self.root, text="Danger: OK", font=("Helvetica", 12), fg="green")
-        self.status_danger.grid(row=2, column=1)
-
-        self.status_driver = tk.Label(self.root, text="Driver: Not Contacted", font=("Helvetica", 12), fg="orange")
-        self.status_driver.grid(row=4, column=0, pady=10)
-
-        self.status_passenger = tk.Label(self.root, text="Passenger: Not Contacted", font=("Helvetica", 12), fg="orange")
-        self.status_passenger.grid(row=5, column=0, pady=10)
-
-        self.status_response_unit = tk.Label(self.root, text="Response Unit: Not Contacted", font=("Helvetica", 12), fg="orange")
-        self.status_response_unit.grid(row=6, column=0, pady=10)
-
-    def create_plot(self):
-        self.fig, self.axs = plt.subplots(1, 2, figsize=(10, 4), tight_layout=True)
-        self.axs[0].set_title('Driver Heart Rate')
-        self.axs[1].set_title('Passenger Heart Rate')
-
-        self.canvas = FigureCanvasTkAgg(self.fig, master=self.root)
-        self.canvas_widget = self.canvas.get_tk_widget()
-        self.canvas_widget.grid(row=1, column=2, rowspan=6, padx=10)
-
-    def contact_driver(self):
-        if not self.driver_contacted:
-            self.driver_contacted = True
-            self.status_driver.config(text="Driver: Contacted", fg="green")
-
-    def contact_passenger(self):
-        if not self.passenger_contacted:
-            self.passenger_contacted = True
-            self.status_passenger.config(text="Passenger: Contacted", fg="green")
-
-    def contact_response_unit(self):
-        if not self.response_unit_contacted:
-            self.response_unit_contacted = True
-            self.status_response_unit.config(text="Response Unit: Contacted", fg="green")
-
-    def on_close(self):
-        self.plot_thread.join()
-        self.root.destroy()
-
-    def plot_heart_rate_data(self):
-        while True:
-            for heart_rate_entry in self.heart_rate_data:
-                driver_heart_rate, passenger_heart_rate = heart_rate_entry
-
-                # Update the plot
-                self.axs[0].clear()
-                self.axs[0].plot([driver_heart_rate], 'bo-', label='Driver Heart Rate')
-                self.axs[0].set_title('Driver Heart Rate')
-                self.axs[0].axhline(y=threshold, color='r', linestyle='--', label='Anxious threshold BPM')
-                self.axs[0].legend()
-
-                self.axs[1].clear()
-                self.axs[1].plot([passenger_heart_rate], 'bo-', label='Passenger Heart Rate')
-                self.axs[1].set_title('Passenger Heart Rate')
-                self.axs[1].axhline(y=threshold, color='r', linestyle='--', label='Anxious threshold BPM')
-                self.axs[1].legend()
-
-                # Check for danger and control thresholds
-                if driver_heart_rate > control_threshold or passenger_heart_rate > control_threshold:
-                    self.status_control.config(text="Control: High BPM", fg="red")
-                else:
-                    self.status_control.config(text="Control: OK", fg="green")
-
-                if driver_heart_rate > threshold or passenger_heart_rate > threshold:
-                    self.status_danger.config(text="Danger: High BPM", fg="orange")
-                else:
-                    self.status_danger.config(text="Danger: OK", fg="green")
-
-                # Redraw the canvas
-                self.canvas.draw()
-
-                # Wait for a short interval before updating the plot again
-                time.sleep(1)
-
-def main():
-    data_file = 'heart_rate_data.txt'  # Provide the correct path to your data file
-    root = tk.Tk()
-    app = HeartRateMonitorApp(root, data_file)
-    root.mainloop()
-
-if __name__ == "__main__":
-    main()
+import argparse
+import asyncio
+import numpy as np
+import threading
+import queue
+import time
+from heartrate_storage import DEFAULT_DATA_FILE, load_heart_rate_data
+from heartrate_alerts import AlertDispatcher, describe_alert
+from heartrate_buffer import SampleRingBuffer
+from heartrate_detection import HeartRateDetector
+from heartrate_render import BlitRenderer
+from heartrate_analytics import RollingStats
+from heartrate_fleet import ALARM_NAMES, FleetState
+from heartrate_perf import PerfCounters
+from heartrate_replay import SPEEDS, ReplayEngine
+from heartrate_clock import RealClock, make_clock, wait_event
+
+retention_window = 5 * 60  # Seconds of heart rate history shown in the plots
+target_fps = 20  # Plot frames per second drawn by the Tk main loop
+perf_refresh_interval = 1.0  # Seconds between updates of the performance status panel
+max_queued_samples = 5000  # The replay waits while more samples than this are waiting to be drawn
+
+class HeartRateMonitorApp:
+    # data_file is replayed from disk; with data_file=None the app shows live
+    # samples passed to add_samples (e.g. from heartrate_server). Pass an enabled
+    # PerfCounters as perf to time the load, detect and draw stages. Detector
+    # alerts go to the AlertDispatcher `alerts`; the contact buttons acknowledge them.
+    # A recording is replayed at `speed` times real time (None for as fast as
+    # possible) from start_time, looping at the end when loop is True. The replay
+    # and the alert cooldowns follow `clock` (see heartrate_clock; a VirtualClock
+    # replays as fast as the frames are drawn). time_range=(start, stop) loads
+    # only that part of the file (from an .hra archive only its chunks are read).
+    # With root=None the app has no window: the plots are drawn on an Agg canvas
+    # and each frame is drawn by calling plot_heart_rate_data (see heartrate_benchmark).
+    def __init__(self, root, data_file=None, retention_window=retention_window, target_fps=target_fps,
+                 sample_rate=1.0, perf=None, alerts=None, speed=1.0, loop=True, start_time=None, clock=None,
+                 time_range=None):
+        self.headless = root is None
+        self.root = _HeadlessRoot() if self.headless else root
+        self.root.title("Heart Rate Monitor")
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.perf = perf if perf is not None else PerfCounters(enabled=False)
+        self.last_perf_refresh = 0.0
+        self.clock = clock or RealClock()
+        self.alerts = alerts if alerts is not None else AlertDispatcher(clock=self.clock)
+
+        self.driver_contacted = False
+        self.passenger_contacted = False
+        self.response_unit_contacted = False
+
+        if self.headless:
+            self.create_headless_status()
+        else:
+            self.create_gui()
+
+        # Create a queue to pass samples from the reading thread to the Tk main loop
+        self.plot_queue = queue.Queue()
+
+        if data_file is not None:
+            # Load heart rate data from the file (.hrb files are memory-mapped, .hra archives
+            # are decompressed, CSV files are parsed)
+            with self.perf.stage('load'):
+                self.heart_rate_data = load_heart_rate_data(data_file, *(time_range or (None, None)))
+            sample_rate = self.heart_rate_data.sample_rate
+
+            # Streaming detector shared with the other scripts, using age-group thresholds when the file has ages
+            self.detector = HeartRateDetector.for_recording(self.heart_rate_data)
+
+            # Seekable replay over the sample times (sample positions when the
+            # times are not increasing, e.g. a fleet shard with several rides)
+            self.replay_times = np.asarray(self.heart_rate_data.time, dtype=float)
+            if np.any(np.diff(self.replay_times) < 0):
+                self.replay_times = np.arange(len(self.replay_times)) / sample_rate
+            self.replay = ReplayEngine(self.replay_times, sample_rate, speed, loop, self.clock)
+            if start_time is not None:
+                self.replay.seek(start_time)
+            if self.headless:
+                self.status_replay = _HeadlessLabel()
+            else:
+                self.create_replay_controls()
+        else:
+            self.heart_rate_data = None
+            self.replay = None
+            self.detector = HeartRateDetector()
+
+        # Recent samples for plotting, kept in a fixed-size ring buffer
+        self.history = SampleRingBuffer.for_retention(retention_window, sample_rate)
+
+        # Live rolling statistics per occupant (same values as the batch analysis)
+        self.stats = {'driver': RollingStats(), 'passenger': RollingStats()}
+
+        self.retention_window = retention_window
+        self.create_plot()
+
+        # Start the thread that reads samples; all drawing happens on the Tk main loop
+        self.frame_interval = max(1, round(1000 / target_fps))
+        self.stop_event = threading.Event()
+        self.plot_thread = None
+        if self.heart_rate_data is not None:
+            self.plot_thread = threading.Thread(target=self.read_heart_rate_data, daemon=True)
+            self.plot_thread.start()
+
+        # Schedule the first frame
+        self.root.after(self.frame_interval, self.plot_heart_rate_data)
+
+    def create_gui(self):
+        import tkinter as tk
+
+        self.control_label = tk.Label(self.root, text="Control Status", font=("Helvetica", 16))
+        self.control_label.grid(row=0, column=0, pady=10)
+
+        self.danger_label = tk.Label(self.root, text="Danger Factors", font=("Helvetica", 16))
+        self.danger_label.grid(row=0, column=1, pady=10)
+
+        self.driver_button = tk.Button(self.root, text="Contact Driver", command=self.contact_driver)
+        self.driver_button.grid(row=1, column=0, pady=10)
+
+        self.passenger_button = tk.Button(self.root, text="Contact Passenger", command=self.contact_passenger)
+        self.passenger_button.grid(row=2, column=0, pady=10)
+
+        self.response_unit_button = tk.Button(self.root, text="Contact Response Unit", command=self.contact_response_unit)
+        self.response_unit_button.grid(row=3, column=0, pady=10)
+
+        self.status_control = tk.Label(self.root, text="Control: OK", font=("Helvetica", 12), fg="green")
+        self.status_control.grid(row=1, column=1)
+
+        self.status_danger = tk.Label(self.root, text="Danger: OK", font=("Helvetica", 12), fg="green")
+        self.status_danger.grid(row=2, column=1)
+
+        self.status_stats = tk.Label(self.root, text="", font=("Helvetica", 10), justify=tk.LEFT)
+        self.status_stats.grid(row=3, column=1)
+
+        self.status_alert = tk.Label(self.root, text="No alerts", font=("Helvetica", 12), fg="green")
+        self.status_alert.grid(row=7, column=0, columnspan=2, pady=10)
+
+        self.status_driver = tk.Label(self.root, text="Driver: Not Contacted", font=("Helvetica", 12), fg="orange")
+        self.status_driver.grid(row=4, column=0, pady=10)
+
+        self.status_passenger = tk.Label(self.root, text="Passenger: Not Contacted", font=("Helvetica", 12), fg="orange")
+        self.status_passenger.grid(row=5, column=0, pady=10)
+
+        self.status_response_unit = tk.Label(self.root, text="Response Unit: Not Contacted", font=("Helvetica", 12), fg="orange")
+        self.status_response_unit.grid(row=6, column=0, pady=10)
+
+        # Performance counters, only shown when they are enabled
+        self.status_perf = tk.Label(self.root, text="", font=("Courier", 9), justify=tk.LEFT)
+        if self.perf.enabled:
+            self.status_perf.grid(row=4, column=1, rowspan=3, sticky='n')
+
+    # Without a window the status labels only keep their last text
+    def create_headless_status(self):
+        self.status_control = _HeadlessLabel(text="Control: OK", fg="green")
+        self.status_danger = _HeadlessLabel(text="Danger: OK", fg="green")
+        self.status_stats = _HeadlessLabel(text="")
+        self.status_alert = _HeadlessLabel(text="No alerts", fg="green")
+        self.status_driver = _HeadlessLabel(text="Driver: Not Contacted", fg="orange")
+        self.status_passenger = _HeadlessLabel(text="Passenger: Not Contacted", fg="orange")
+        self.status_response_unit = _HeadlessLabel(text="Response Unit: Not Contacted", fg="orange")
+        self.status_perf = _HeadlessLabel(text="")
+
+    # Speed buttons, a seek slider over the ride and a loop switch for replays
+    def create_replay_controls(self):
+        import tkinter as tk
+
+        controls = tk.Frame(self.root)
+        controls.grid(row=8, column=0, columnspan=3, pady=10, sticky='we')
+        for speed in SPEEDS:
+            tk.Button(controls, text=f"{speed}x" if speed else "Max",
+                      command=lambda speed=speed: self.replay.set_speed(speed)).pack(side=tk.LEFT, padx=2)
+
+        self.loop_replay = tk.BooleanVar(value=self.replay.loop)
+        tk.Checkbutton(controls, text="Loop", variable=self.loop_replay,
+                       command=self.set_replay_loop).pack(side=tk.LEFT, padx=10)
+
+        # Seek when the slider is released, not on every step while it is dragged
+        self.seek_scale = tk.Scale(controls, from_=self.replay.index.start, to=self.replay.index.end,
+                                   orient=tk.HORIZONTAL, showvalue=False, length=500)
+        self.seek_scale.pack(side=tk.LEFT, padx=10, fill=tk.X, expand=True)
+        self.seek_scale.bind('<ButtonRelease-1>', lambda event: self.seek(self.seek_scale.get()))
+
+        self.status_replay = tk.Label(controls, text="", font=("Helvetica", 10), width=24)
+        self.status_replay.pack(side=tk.LEFT)
+
+    def seek(self, ride_time):
+        self.replay.seek(float(ride_time))
+
+    def set_replay_loop(self):
+        self.replay.loop = self.loop_replay.get()
+
+    # Without a window the figure is drawn on a plain Agg canvas
+    def create_plot(self):
+        if self.headless:
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            from matplotlib.figure import Figure
+
+            self.fig = Figure(figsize=(10, 4), tight_layout=True)
+            self.axs = self.fig.subplots(1, 2)
+            self.canvas = FigureCanvasAgg(self.fig)
+        else:
+            import matplotlib.pyplot as plt
+            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+            self.fig, self.axs = plt.subplots(1, 2, figsize=(10, 4), tight_layout=True)
+            self.canvas = FigureCanvasTkAgg(self.fig, master=self.root)
+            self.canvas_widget = self.canvas.get_tk_widget()
+            self.canvas_widget.grid(row=1, column=2, rowspan=6, padx=10)
+        self.axs[0].set_title('Driver Heart Rate')
+        self.axs[1].set_title('Passenger Heart Rate')
+        self.create_artists()
+
+    # The lines, threshold lines and legends are created once; frames only update
+    # the line data.
+    def create_artists(self):
+        self.renderer = BlitRenderer(self.fig, self.canvas, x_span=self.retention_window)
+        self.driver_line = self.renderer.add_line(self.axs[0], 'b-', label='Driver Heart Rate')
+        self.axs[0].axhline(y=self.detector.thresholds['driver']['anxious'], color='r', linestyle='--', label='Anxious threshold BPM')
+        self.axs[0].legend(loc='upper left')
+
+        self.passenger_line = self.renderer.add_line(self.axs[1], 'b-', label='Passenger Heart Rate')
+        self.axs[1].axhline(y=self.detector.thresholds['passenger']['anxious'], color='r', linestyle='--', label='Anxious threshold BPM')
+        self.axs[1].legend(loc='upper left')
+
+    # The contact buttons also acknowledge the open alerts of that occupant
+    # (the response unit acknowledges all of them)
+    def contact_driver(self):
+        self.alerts.acknowledge_all(occupant='driver', response='driver contacted')
+        if not self.driver_contacted:
+            self.driver_contacted = True
+            self.status_driver.config(text="Driver: Contacted", fg="green")
+        self.refresh_alerts()
+
+    def contact_passenger(self):
+        self.alerts.acknowledge_all(occupant='passenger', response='passenger contacted')
+        if not self.passenger_contacted:
+            self.passenger_contacted = True
+            self.status_passenger.config(text="Passenger: Contacted", fg="green")
+        self.refresh_alerts()
+
+    def contact_response_unit(self):
+        self.alerts.acknowledge_all(response='response unit contacted')
+        if not self.response_unit_contacted:
+            self.response_unit_contacted = True
+            self.status_response_unit.config(text="Response Unit: Contacted", fg="green")
+        self.refresh_alerts()
+
+    # Take newly queued alerts and show the open ones. An alert for an occupant
+    # who was already contacted marks them as not contacted again.
+    def refresh_alerts(self):
+        for alert in self.alerts.poll():
+            if alert.occupant == 'driver' and self.driver_contacted:
+                self.driver_contacted = False
+                self.status_driver.config(text="Driver: Not Contacted", fg="orange")
+            elif alert.occupant == 'passenger' and self.passenger_contacted:
+                self.passenger_contacted = False
+                self.status_passenger.config(text="Passenger: Not Contacted", fg="orange")
+        pending = self.alerts.pending()
+        if pending:
+            more = f" (+{len(pending) - 1} more)" if len(pending) > 1 else ""
+            self.status_alert.config(text=f"Alert: {describe_alert(pending[-1])}{more}", fg="red")
+        else:
+            self.status_alert.config(text="No alerts", fg="green")
+
+    def on_close(self):
+        self.stop_event.set()
+        if self.plot_thread is not None:
+            self.plot_thread.join(timeout=1)
+        self.root.destroy()
+
+    # Queue live samples for the next frame; safe to call from any thread
+    def add_samples(self, times, driver_data, passenger_data):
+        for sample in zip(times.tolist(), driver_data.tolist(), passenger_data.tolist()):
+            self.plot_queue.put(sample)
+
+    # Reading thread: let the replay engine pace the recording and queue the due
+    # samples. None marks the start of a new replay (at a loop or after a seek).
+    # No Tk or Matplotlib calls are made here.
+    def read_heart_rate_data(self):
+        driver_data = self.heart_rate_data['driver']
+        passenger_data = self.heart_rate_data['passenger']
+
+        def emit(start, stop, restarted):
+            if restarted:
+                self.plot_queue.put(None)
+            for sample in zip(self.replay_times[start:stop].tolist(), driver_data[start:stop].tolist(),
+                              passenger_data[start:stop].tolist()):
+                self.plot_queue.put(sample)
+            # Fast replays wait for the frames to catch up instead of filling memory
+            while self.plot_queue.qsize() > max_queued_samples and not self.stop_event.is_set():
+                self.stop_event.wait(self.frame_interval / 1000)
+
+        self.replay.run(emit, self.stop_event)
+
+    # Runs on the Tk main loop every frame_interval ms: take the queued samples,
+    # update the detector and status labels and blit the new plot frame. The next
+    # frame is scheduled even if this one fails, so one bad sample cannot stop the monitor.
+    def plot_heart_rate_data(self):
+        try:
+            self.draw_frame()
+        finally:
+            if not self.stop_event.is_set():
+                self.root.after(self.frame_interval, self.plot_heart_rate_data)
+
+    def draw_frame(self):
+        self.perf.frame(self.frame_interval / 1000)
+        self.perf.gauge('queue_depth', self.plot_queue.qsize())
+        updated = False
+        with self.perf.stage('detect'):
+            while True:
+                try:
+                    sample = self.plot_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if sample is None:
+                    # Each replay of the recording starts with an empty history
+                    self.history.clear()
+                    self.detector.reset()
+                    for stats in self.stats.values():
+                        stats.reset()
+                    self.renderer.reset_limits()
+                    continue
+                self.history.append(*sample)
+                self.alerts.submit_many(self.detector.update(*sample))
+                self.stats['driver'].update(sample[1])
+                self.stats['passenger'].update(sample[2])
+                updated = True
+
+        if updated:
+            # Update the plot
+            window = self.history.window()
+            with self.perf.stage('draw'):
+                self.renderer.update({
+                    self.driver_line: (window['time'], window['driver']),
+                    self.passenger_line: (window['time'], window['passenger']),
+                })
+
+            # Check for danger and control thresholds
+            if self.detector.is_active('control'):
+                self.status_control.config(text="Control: High BPM", fg="red")
+            else:
+                self.status_control.config(text="Control: OK", fg="green")
+
+            if self.detector.is_active('anxious'):
+                self.status_danger.config(text="Danger: High BPM", fg="orange")
+            else:
+                self.status_danger.config(text="Danger: OK", fg="green")
+
+            # Rolling statistics over the last few samples
+            lines = []
+            for occupant, rolling in self.stats.items():
+                stats = rolling.stats()
+                lines.append(f"{occupant.title()}: mean {stats['mean']:.0f}, sd {stats['std']:.1f}, "
+                             f"min {stats['min']:.0f}, max {stats['max']:.0f} BPM")
+            self.status_stats.config(text="\n".join(lines))
+
+        if not self.alerts.queue.empty():
+            self.refresh_alerts()
+        if self.replay is not None:
+            speed = f"{self.replay.speed:g}x" if self.replay.speed else "max speed"
+            self.status_replay.config(text=f"{self.replay.ride_time():.0f} / {self.replay.index.end:.0f} s at {speed}")
+        self.refresh_perf()
+
+    # Show the performance counters, at most every perf_refresh_interval seconds
+    def refresh_perf(self):
+        now = time.monotonic()
+        if self.perf.enabled and now - self.last_perf_refresh >= perf_refresh_interval:
+            self.status_perf.config(text="\n".join(self.perf.summary_lines()))
+            self.last_perf_refresh = now
+
+# Stand-ins for the Tk root and labels of a HeartRateMonitorApp without a window
+class _HeadlessRoot:
+    def title(self, text):
+        pass
+
+    def protocol(self, name, callback):
+        pass
+
+    def after(self, delay, callback):
+        pass
+
+    def destroy(self):
+        pass
+
+class _HeadlessLabel:
+    def __init__(self, **options):
+        self.options = options
+
+    def config(self, **options):
+        self.options.update(options)
+
+class FleetDashboardApp:
+    # Shows many rides at once: a "worst rides first" list and one shared figure
+    # with a panel per visible ride. Samples arrive through add_ride_samples.
+    # Replays and alert cooldowns follow `clock` (see heartrate_clock).
+    def __init__(self, root, retention_window=retention_window, target_fps=target_fps, max_rides=256,
+                 panel_rows=2, panel_columns=3, sample_rate=1.0, perf=None, alerts=None, clock=None):
+        self.root = root
+        self.root.title("Heart Rate Fleet Dashboard")
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.perf = perf if perf is not None else PerfCounters(enabled=False)
+        self.last_perf_refresh = 0.0
+        self.clock = clock or RealClock()
+        self.alerts = alerts if alerts is not None else AlertDispatcher(clock=self.clock)
+
+        capacity = max(1, int(np.ceil(retention_window * sample_rate)))
+        self.state = FleetState(max_rides, capacity, self.alerts)
+        self.retention_window = retention_window
+        self.sample_queue = queue.Queue()
+        self.stop_event = threading.Event()
+        self.plot_thread = None
+
+        self.panel_rows = panel_rows
+        self.panel_columns = panel_columns
+        self.panel_slots = []  # Ride slot shown in each panel
+        self.list_slots = []  # Ride slot of each list entry
+        self.selected_slot = None
+        self.list_refresh_interval = 0.5  # Seconds between list rebuilds
+        self.last_list_refresh = 0.0
+
+        self.create_gui()
+        self.create_plot()
+
+        self.frame_interval = max(1, round(1000 / target_fps))
+        self.root.after(self.frame_interval, self.plot_heart_rate_data)
+
+    def create_gui(self):
+        import tkinter as tk
+
+        self.status_fleet = tk.Label(self.root, text="No rides", font=("Helvetica", 14))
+        self.status_fleet.grid(row=0, column=0, columnspan=2, pady=10)
+
+        self.ride_list = tk.Listbox(self.root, width=48, height=24, font=("Courier", 10), exportselection=False)
+        self.ride_list.grid(row=1, column=0, columnspan=2, padx=10)
+        self.ride_list.bind('<<ListboxSelect>>', self.select_ride)
+
+        self.driver_button = tk.Button(self.root, text="Contact Driver", command=self.contact_driver)
+        self.driver_button.grid(row=2, column=0, pady=5)
+
+        self.passenger_button = tk.Button(self.root, text="Contact Passenger", command=self.contact_passenger)
+        self.passenger_button.grid(row=2, column=1, pady=5)
+
+        self.response_unit_button = tk.Button(self.root, text="Contact Response Unit", command=self.contact_response_unit)
+        self.response_unit_button.grid(row=3, column=0, columnspan=2, pady=5)
+
+        self.status_perf = tk.Label(self.root, text="", font=("Courier", 9), justify=tk.LEFT)
+        if self.perf.enabled:
+            self.status_perf.grid(row=4, column=0, columnspan=2, pady=5)
+
+    def create_plot(self):
+        import matplotlib.pyplot as plt
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+        self.fig, axs = plt.subplots(self.panel_rows, self.panel_columns, figsize=(12, 6), tight_layout=True,
+                                     squeeze=False)
+        self.axs = axs.ravel()
+        self.canvas = FigureCanvasTkAgg(self.fig, master=self.root)
+        self.canvas_widget = self.canvas.get_tk_widget()
+        self.canvas_widget.grid(row=0, column=2, rowspan=4, padx=10)
+
+        # Each panel shows the anxious thresholds of its ride's driver and passenger
+        self.renderer = BlitRenderer(self.fig, self.canvas, x_span=self.retention_window)
+        self.panel_lines = []
+        self.panel_thresholds = []
+        default_thresholds = HeartRateDetector().thresholds
+        for ax in self.axs:
+            driver_line = self.renderer.add_line(ax, 'b-', label='Driver')
+            passenger_line = self.renderer.add_line(ax, 'g-', label='Passenger')
+            self.panel_lines.append((driver_line, passenger_line))
+            self.panel_thresholds.append({
+                occupant: ax.axhline(y=default_thresholds[occupant]['anxious'], color=color, linestyle='--')
+                for occupant, color in (('driver', 'r'), ('passenger', 'm'))})
+        self.axs[0].legend(loc='upper left')
+
+    # Queue samples of one ride; safe to call from any thread
+    def add_ride_samples(self, ride_id, times, driver_data, passenger_data):
+        self.sample_queue.put((ride_id, times, driver_data, passenger_data))
+
+    # Queue one sample for each of several rides (arrays of equal length); safe to call from any thread
+    def add_fleet_samples(self, ride_ids, times, driver_data, passenger_data):
+        self.sample_queue.put((np.asarray(ride_ids), times, driver_data, passenger_data))
+
+    def select_ride(self, event=None):
+        selection = self.ride_list.curselection()
+        if selection and selection[0] < len(self.list_slots):
+            self.selected_slot = self.list_slots[selection[0]]
+
+    # The contact buttons also acknowledge the open alerts of the selected ride
+    def contact_driver(self):
+        if self.selected_slot is not None:
+            self.state.driver_contacted[self.selected_slot] = True
+            self.alerts.acknowledge_all(int(self.state.ride_ids[self.selected_slot]), 'driver', 'driver contacted')
+            self.last_list_refresh = 0.0
+
+    def contact_passenger(self):
+        if self.selected_slot is not None:
+            self.state.passenger_contacted[self.selected_slot] = True
+            self.alerts.acknowledge_all(int(self.state.ride_ids[self.selected_slot]), 'passenger',
+                                        'passenger contacted')
+            self.last_list_refresh = 0.0
+
+    def contact_response_unit(self):
+        if self.selected_slot is not None:
+            self.state.response_unit_contacted[self.selected_slot] = True
+            self.alerts.acknowledge_all(int(self.state.ride_ids[self.selected_slot]),
+                                        response='response unit contacted')
+            self.last_list_refresh = 0.0
+
+    # Take newly queued alerts; a new alert for an occupant who was already
+    # contacted marks them as not contacted again
+    def refresh_alerts(self):
+        for alert in self.alerts.poll():
+            slot = self.state.slots.get(alert.ride_id)
+            if slot is not None:
+                contacted = self.state.driver_contacted if alert.occupant == 'driver' else self.state.passenger_contacted
+                contacted[slot] = False
+
+    def on_close(self):
+        self.stop_event.set()
+        if self.plot_thread is not None:
+            self.plot_thread.join(timeout=1)
+        self.root.destroy()
+
+    # Reading thread: replay every ride of a fleet shard file side by side at the file's sample rate
+    def replay_fleet(self, recording):
+        rides = list(recording.rides()) or [({'ride_id': 0, 'start': 0, 'length': len(recording)}, recording)]
+        ride_ids = np.array([ride['ride_id'] for ride, _ in rides])
+        starts = np.array([ride['start'] for ride, _ in rides])
+        lengths = np.array([ride['length'] for ride, _ in rides])
+        sample_interval = 1 / recording.sample_rate
+        step = 0
+        while not self.stop_event.is_set():
+            # Rows of this step for every ride that has not finished yet
+            active = step < lengths
+            if not active.any():
+                return
+            rows = starts[active] + step
+            self.add_fleet_samples(ride_ids[active], recording.time[rows], recording['driver'][rows],
+                                   recording['passenger'][rows])
+            # A virtual clock does not wait, so wait for the frames to catch up instead
+            while self.sample_queue.qsize() > max_queued_samples and not self.stop_event.is_set():
+                self.stop_event.wait(self.frame_interval / 1000)
+            if wait_event(self.clock, self.stop_event, sample_interval):
+                return
+            step += 1
+
+    # Replay a fleet shard file; the rides' detectors use the ages in its ride table
+    def start_replay(self, recording):
+        rides = [(ride['ride_id'], ride_recording.ages) for ride, ride_recording in recording.rides()]
+        for ride_id, ages in rides or [(0, recording.ages)]:
+            self.state.set_ages(ride_id, ages)
+        self.plot_thread = threading.Thread(target=self.replay_fleet, args=(recording,), daemon=True)
+        self.plot_thread.start()
+
+    # One list line per ride
+    def describe_ride(self, slot):
+        state = self.state
+        contacted = ''.join(flag for flag, done in (('D', state.driver_contacted[slot]),
+                                                    ('P', state.passenger_contacted[slot]),
+                                                    ('R', state.response_unit_contacted[slot])) if done)
+        return (f"Ride {state.ride_ids[slot]:<6} D {state.latest_driver[slot]:5.0f} "
+                f"P {state.latest_passenger[slot]:5.0f} {ALARM_NAMES[state.alarm[slot]]:<8} {contacted}")
+
+    def refresh_list(self, ranking):
+        import tkinter as tk
+
+        self.list_slots = ranking.tolist()
+        self.ride_list.delete(0, tk.END)
+        for index, slot in enumerate(self.list_slots):
+            self.ride_list.insert(tk.END, self.describe_ride(slot))
+            if self.state.alarm[slot]:
+                self.ride_list.itemconfig(index, fg='red')
+            if slot == self.selected_slot:
+                self.ride_list.selection_set(index)
+        alarmed = len(self.state.alarmed())
+        pending = len(self.alerts.pending())
+        dropped = f", {self.state.evicted} stale rides dropped" if self.state.evicted else ""
+        self.status_fleet.config(text=f"{len(self.state)} rides, {alarmed} in alarm, {pending} open alerts{dropped}",
+                                 fg="red" if alarmed or pending else "green")
+
+    # Runs on the Tk main loop: apply queued samples, re-rank the rides and
+    # redraw only the panels of the rides that are shown. The next frame is
+    # scheduled even if this one fails, so one bad chunk cannot freeze the dashboard.
+    def plot_heart_rate_data(self):
+        try:
+            self.draw_frame()
+        finally:
+            if not self.stop_event.is_set():
+                self.root.after(self.frame_interval, self.plot_heart_rate_data)
+
+    def draw_frame(self):
+        self.perf.frame(self.frame_interval / 1000)
+        self.perf.gauge('queue_depth', self.sample_queue.qsize())
+        updated = False
+        with self.perf.stage('detect'):
+            while True:
+                try:
+                    ride_id, times, driver_data, passenger_data = self.sample_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if isinstance(ride_id, np.ndarray):
+                    self.state.add_many(ride_id, times, driver_data, passenger_data)
+                else:
+                    self.state.add(ride_id, times, driver_data, passenger_data)
+                updated = True
+
+        if updated:
+            self.refresh_alerts()
+            ranking = self.state.ranking()
+            now = time.monotonic()
+            if now - self.last_list_refresh >= self.list_refresh_interval:
+                self.refresh_list(ranking)
+                self.last_list_refresh = now
+
+            # The selected ride always gets a panel, then the rides in alarm (those
+            # already shown first, then the worst). Free panels keep the rides they
+            # already show, so panels are not reshuffled (and fully redrawn) every
+            # time the ranking moves.
+            shown = [] if self.selected_slot is None else [self.selected_slot]
+            alarmed = set(self.state.alarmed().tolist())
+            shown += [slot for slot in self.panel_slots if slot in alarmed and slot not in shown]
+            shown += [slot for slot in ranking.tolist() if slot in alarmed and slot not in shown]
+            shown += [slot for slot in self.panel_slots if slot not in shown]
+            shown += [slot for slot in ranking.tolist() if slot not in shown]
+            shown = shown[:len(self.axs)]
+            if set(shown) == set(self.panel_slots):
+                shown = self.panel_slots
+            if shown != self.panel_slots:
+                self.panel_slots = shown
+                for index, ax in enumerate(self.axs):
+                    title = f"Ride {self.state.ride_ids[shown[index]]}" if index < len(shown) else ""
+                    ax.set_title(title)
+                    if index < len(shown):
+                        for occupant, value in self.state.anxious_thresholds(shown[index]).items():
+                            self.panel_thresholds[index][occupant].set_ydata([value, value])
+                self.renderer.reset_limits()
+
+            data = {}
+            for index, (driver_line, passenger_line) in enumerate(self.panel_lines):
+                if index < len(shown):
+                    times, driver_data, passenger_data = self.state.window(shown[index])
+                else:
+                    times = driver_data = passenger_data = np.empty(0)
+                data[driver_line] = (times, driver_data)
+                data[passenger_line] = (times, passenger_data)
+            with self.perf.stage('draw'):
+                self.renderer.update(data)
+
+        self.refresh_perf()
+
+    def refresh_perf(self):
+        now = time.monotonic()
+        if self.perf.enabled and now - self.last_perf_refresh >= perf_refresh_interval:
+            self.status_perf.config(text="\n".join(self.perf.summary_lines()))
+            self.last_perf_refresh = now
+
+# Run a heartrate_server.IngestionServer on a background asyncio loop and pass
+# every chunk of samples to listener(ride_id, records, events)
+def start_ingestion_server(listener, host, port, retention_window=retention_window):
+    from heartrate_server import IngestionServer
+
+    server = IngestionServer(retention_window)
+    server.add_listener(listener)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(server.start(host, port, port))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return server
+
+# Follow a heartrate_bus.SampleBus from a background thread: records are
+# grouped per ride by an IngestionServer (without sockets) and passed on to
+# listener(ride_id, records, events) like start_ingestion_server does
+def start_bus_reader(listener, name, retention_window=retention_window):
+    from heartrate_bus import SampleBus
+    from heartrate_server import IngestionServer
+
+    server = IngestionServer(retention_window)
+    server.add_listener(listener)
+    reader = SampleBus.attach(name).reader()
+
+    def follow():
+        while True:
+            records = reader.wait(1.0)
+            if len(records):
+                # Listeners queue the columns for the Tk thread, which may read them after
+                # the ring has moved on, so they get a copy rather than the bus view
+                server.ingest(records.copy())
+            elif reader.bus.closed:
+                break
+
+    threading.Thread(target=follow, daemon=True).start()
+    return server, reader
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a heart rate recording in the monitor.")
+    parser.add_argument('--data-file', default=DEFAULT_DATA_FILE, help="heart rate file (.hrb, .hra or CSV)")
+    parser.add_argument('--range', type=float, nargs=2, metavar=('START', 'STOP'),
+                        help="only load this part of the recording (seconds of each ride)")
+    parser.add_argument('--listen', type=int, metavar='PORT', help="show live samples sent to this port instead")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on with --listen")
+    parser.add_argument('--bus', metavar='NAME',
+                        help="show live samples from this shared-memory bus (see heartrate_bus.py) instead")
+    parser.add_argument('--ride', type=int, default=0, help="ride id to show with --listen or --bus")
+    parser.add_argument('--dashboard', action='store_true',
+                        help="show all rides (of a fleet shard file, --listen or --bus) in the fleet dashboard")
+    parser.add_argument('--retention', type=float, default=retention_window, help="seconds of history to plot")
+    parser.add_argument('--fps', type=float, default=target_fps, help="target plot frame rate")
+    parser.add_argument('--speed', type=float, default=1.0, help="replay speed (0 for as fast as possible)")
+    parser.add_argument('--start', type=float, help="start the replay at this many seconds into the ride")
+    parser.add_argument('--no-loop', action='store_true', help="stop at the end of the recording")
+    parser.add_argument('--virtual', action='store_true',
+                        help="replay on a virtual clock, as fast as the frames are drawn")
+    parser.add_argument('--perf', metavar='FILE',
+                        help="show stage timings and counters and write them to this JSON file on exit")
+    args = parser.parse_args()
+    perf = PerfCounters(enabled=args.perf is not None)
+    clock = make_clock(args.virtual)
+
+    # GUI modules are only loaded when the monitor actually runs
+    import tkinter as tk
+    root = tk.Tk()
+    if args.dashboard:
+        app = FleetDashboardApp(root, args.retention, args.fps, perf=perf, clock=clock)
+        def forward(ride_id, records, events):
+            app.add_ride_samples(ride_id, records['time'], records['driver'], records['passenger'])
+
+        if args.listen is not None:
+            start_ingestion_server(forward, args.host, args.listen, args.retention)
+        elif args.bus is not None:
+            start_bus_reader(forward, args.bus, args.retention)
+        else:
+            with perf.stage('load'):
+                recording = load_heart_rate_data(args.data_file, *(args.range or (None, None)))
+            app.start_replay(recording)
+    elif args.listen is not None or args.bus is not None:
+        app = HeartRateMonitorApp(root, None, args.retention, args.fps, perf=perf)
+
+        def forward(ride_id, records, events):
+            if ride_id == args.ride:
+                app.add_samples(records['time'], records['driver'], records['passenger'])
+
+        if args.bus is not None:
+            start_bus_reader(forward, args.bus, args.retention)
+        else:
+            start_ingestion_server(forward, args.host, args.listen, args.retention)
+    else:
+        app = HeartRateMonitorApp(root, args.data_file, args.retention, args.fps, perf=perf,
+                                  speed=args.speed or None, loop=not args.no_loop, start_time=args.start,
+                                  clock=clock, time_range=args.range)
+    root.mainloop()
+
+    if args.perf:
+        perf.export(args.perf)
+
+if __name__ == "__main__":
+    main()
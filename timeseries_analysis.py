@@ -0,0 +1,127 @@
+import argparse
+import numpy as np
+from heartrate_analytics import rolling_mean
+from heartrate_alerts import AlertDispatcher, show_pending_alerts
+from heartrate_clock import Scheduler, make_clock
+from heartrate_detection import HeartRateDetector
+from heartrate_report import RideReport
+from heartrate_spectral import SpectralConfig, band_powers, stft
+from heartrate_storage import DEFAULT_DATA_FILE, load_heart_rate_data
+
+# Function to check for an anxious heart rate and alert driver and passenger.
+# Only the given (new) samples are fed to the streaming detector, which keeps
+# its own state between calls. Alerts go to the dispatcher, which never blocks;
+# the prompts are shown by show_pending_alerts. Returns the queued alerts.
+def check_anxious_heart_rate(detector, time, driver_data, passenger_data, dispatcher):
+    events = detector.update_many(time, driver_data, passenger_data)
+    return dispatcher.submit_many([event for event in events if event.level == 'anxious'])
+
+# Read heart rate data from file (.hrb files are memory-mapped, .hra archives are
+# decompressed, CSV files are parsed), optionally only from start to stop seconds
+def read_heart_rate_data(file_name=DEFAULT_DATA_FILE, start=None, stop=None):
+    return load_heart_rate_data(file_name, start, stop)
+
+# Apply time-series analysis techniques to heart rate data
+def analyze_heart_rate_data(time, driver_data, passenger_data):
+    # Perform time-series analysis here
+    # Apply moving averages, Fourier Transform(not effective since data is not stationary) try Spectral analysis,
+    # see spectral_analysis below for a sliding-window (STFT/Welch) spectrum instead of one periodogram
+
+    # Example: Calculate moving averages (the batch side of heartrate_analytics,
+    # which gives the same values as the live RollingStats in the monitor)
+    window_size = 10
+    driver_data_smooth = rolling_mean(driver_data, window_size)[window_size - 1:]
+    passenger_data_smooth = rolling_mean(passenger_data, window_size)[window_size - 1:]
+    
+    return driver_data_smooth, passenger_data_smooth
+
+# Spectral analysis over sliding windows, since the data is not stationary: the
+# spectrogram of both occupants in one batch (see heartrate_spectral) and the
+# power in each frequency band per frame. Returns the frequencies, the frame
+# times, a (2 x frames x frequencies) PSD array (driver, then passenger) and a
+# dict of (2 x frames) band powers.
+def spectral_analysis(time, driver_data, passenger_data, sample_rate=1.0):
+    config = SpectralConfig(sample_rate=sample_rate)
+    frequencies, frame_times, psd = stft(np.stack([driver_data, passenger_data]), config=config)
+    start = time[0] if len(time) else 0
+    return frequencies, start + frame_times, psd, band_powers(psd, config)
+
+# Panels of the analysis plot (see heartrate_report.RideReport)
+ANALYSIS_PANELS = ('driver', 'passenger', 'smoothed', 'combined', 'driver_spectrogram', 'passenger_spectrogram')
+
+# Plot heart rate data in a 2D graph. The figure and its artists are created on
+# the first call (heartrate_report.RideReport); pass the returned report back in
+# and later calls only swap in the data and redraw, instead of opening a new
+# figure every time. The lines are downsampled to the axis width (min/max per
+# pixel, see heartrate_lod), so long rides stay responsive. thresholds maps the
+# occupants to the anxious thresholds drawn (the default threshold when omitted);
+# sample_rate (Hz) sets the spectrogram windows.
+def plot_heart_rate_data(time, driver_data , passenger_data, report=None, thresholds=None, sample_rate=1.0):
+    import matplotlib.pyplot as plt
+
+    if report is None:
+        report = RideReport(plt.figure(figsize=(10, 9)), ANALYSIS_PANELS)
+        plt.show(block=False)
+    report.update(time, driver_data, passenger_data, sample_rate=sample_rate, thresholds=thresholds)
+    report.fig.canvas.draw_idle()
+    report.fig.canvas.flush_events()
+    return report
+
+# Main function
+def main():
+    parser = argparse.ArgumentParser(description="Analyse and plot a recorded ride.")
+    parser.add_argument('--data-file', default=DEFAULT_DATA_FILE, help="heart rate file (.hrb, .hra or CSV)")
+    parser.add_argument('--range', type=float, nargs=2, metavar=('START', 'STOP'),
+                        help="only analyse this part of the ride (seconds)")
+    parser.add_argument('--duration', type=float, default=60, help="seconds to keep the plots updating")
+    parser.add_argument('--virtual', action='store_true',
+                        help="run on a virtual clock: the updates happen as fast as they can be drawn")
+    args = parser.parse_args()
+
+    # All pacing goes through one clock, real or virtual
+    clock = make_clock(args.virtual)
+
+    # Start the GUI application (the alert windows need a Tk root); GUI modules are only loaded here
+    import tkinter as tk
+    root = tk.Tk()
+    root.withdraw()
+
+    # Read heart rate data from file
+    heart_rate_data = read_heart_rate_data(args.data_file, *(args.range or (None, None)))
+
+    # Extract driver and passenger data
+    time_array = np.asarray(heart_rate_data.time)
+    driver_data = heart_rate_data['driver']
+    passenger_data = heart_rate_data['passenger']
+
+    # Check for an anxious heart rate once with the shared detector; the dispatcher
+    # prompts each occupant at most once per cooldown, in windows that answer
+    # while the plots keep updating
+    detector = HeartRateDetector.for_recording(heart_rate_data)
+    dispatcher = AlertDispatcher(clock=clock)
+    check_anxious_heart_rate(detector, time_array, driver_data, passenger_data, dispatcher)
+    show_pending_alerts(root, dispatcher)
+
+    # Band powers over the ride (mean of the sliding windows), the features for alerting on
+    # oscillations; a ride shorter than one window has none
+    sample_rate = heart_rate_data.sample_rate
+    _, frame_times, _, powers = spectral_analysis(time_array, driver_data, passenger_data, sample_rate)
+    if not len(frame_times):
+        print("Ride too short for the band powers.")
+    else:
+        for index, occupant in enumerate(('driver', 'passenger')):
+            print(f"{occupant.title()} band power: " + ", ".join(
+                f"{name.replace('_', ' ')} {np.mean(values[index]):.3g}" for name, values in powers.items()))
+
+    # Plot heart rate data in a 2D graph, then redraw it every second for 60 seconds by default
+    # with the anxious thresholds of the occupants' age groups
+    thresholds = {occupant: levels['anxious'] for occupant, levels in detector.thresholds.items()}
+    report = plot_heart_rate_data(time_array, driver_data, passenger_data, thresholds=thresholds,
+                                  sample_rate=sample_rate)
+    scheduler = Scheduler(clock)
+    scheduler.call_every(1, plot_heart_rate_data, time_array, driver_data, passenger_data, report, thresholds,
+                         sample_rate, delay=1)
+    scheduler.run_for(args.duration)
+
+if __name__ == "__main__":
+    main()